@@ -1,10 +1,17 @@
 import os
+import threading
+from typing import Optional
 
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
-# from services.classify_comments.inference import classify_text
+from services.classify_comments.inference import (
+    classify_texts, get_embedding_and_tokenizer, start_warm_up
+)
+from services.classify_comments.micro_batcher import (
+    DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_LATENCY_MS, MicroBatcher
+)
 
 
 load_dotenv()
@@ -12,24 +19,59 @@ load_dotenv()
 flask_app = os.getenv("FLASK_APP")
 flask_run_port = os.getenv("FLASK_RUN_PORT")
 flask_run_host = os.getenv("FLASK_RUN_HOST")
+# requests that arrive within this window of each other are classified in
+# the same batch.
+classify_max_batch_size = int(
+    os.getenv("CLASSIFY_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)
+)
+classify_max_latency_ms = float(
+    os.getenv("CLASSIFY_MAX_LATENCY_MS", DEFAULT_MAX_LATENCY_MS)
+)
+classify_timeout_seconds = float(os.getenv("CLASSIFY_TIMEOUT_SECONDS", "30"))
+# load the model in the background as soon as the worker starts, rather than
+# on its first request.
+classify_warm_up = os.getenv("CLASSIFY_WARM_UP", "false").lower() == "true"
 
 app = Flask(__name__)
 CORS(app)
 # app.config["FLASK_APP"] = flask_app
 
+# the model is loaded the first time that a worker classifies (or by the
+# warm-up), rather than at import, so that workers forked by gunicorn each
+# load their own copy.
+batcher: Optional[MicroBatcher] = None
+batcher_lock = threading.Lock()
+if classify_warm_up:
+    start_warm_up()
 
-def classify_text() -> int:
-    return {"prob": 0.9, "label": 1}
+
+def get_batcher() -> MicroBatcher:
+    global batcher
+    with batcher_lock:
+        if batcher is None:
+            embedding, tokenizer = get_embedding_and_tokenizer()
+            batcher = MicroBatcher(
+                classify_texts=lambda texts: classify_texts(
+                    texts, embedding, tokenizer
+                ),
+                max_batch_size=classify_max_batch_size,
+                max_latency_ms=classify_max_latency_ms
+            )
+        return batcher
 
 
 @app.route("/api/classify", methods=["POST"])
 def classify() -> tuple[dict, int]:
     try:
         data = request.get_json()
-        if "text" not in data:
+        if not isinstance(data, dict) or "text" not in data:
             return jsonify({"error": "The 'text' field is missing in the payload"}), 400
         text = data["text"]
-        result = classify_text(text)
+        if not isinstance(text, str):
+            return jsonify({"error": "The 'text' field must be a string"}), 400 # noqa
+        result = get_batcher().classify(
+            text, timeout=classify_timeout_seconds
+        )
         res = {**result, "text": text}
         return jsonify(res), 200
 
@@ -37,6 +79,38 @@ def classify() -> tuple[dict, int]:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/classify/batch", methods=["POST"])
+def classify_batch() -> tuple[dict, int]:
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict) or not isinstance(data.get("texts"), list): # noqa
+            return jsonify({"error": "The 'texts' field must be a list in the payload"}), 400 # noqa
+        texts = data["texts"]
+        if not all(isinstance(text, str) for text in texts):
+            return jsonify({"error": "Every text in the 'texts' field must be a string"}), 400 # noqa
+        results = get_batcher().classify_many(
+            texts, timeout=classify_timeout_seconds
+        )
+        res = {
+            "results": [
+                {**result, "text": text}
+                for text, result in zip(texts, results)
+            ]
+        }
+        return jsonify(res), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/classify/metrics", methods=["GET"])
+def classify_metrics() -> tuple[dict, int]:
+    """Request latencies and batch sizes of this worker."""
+    if batcher is None:
+        return jsonify({"num_requests": 0}), 200
+    return jsonify(batcher.metrics.to_dict()), 200
+
+
 if __name__ == "__main__":
     # app.run(port=int(flask_run_port), host=flask_run_host, debug=True)
     app.run(debug=True)
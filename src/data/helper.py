@@ -8,18 +8,31 @@ import pandas as pd
 from lib.helper import CURRENT_TIME_STR
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+# set `DUMP_FORMAT=parquet` to dump to the Parquet data lake (see
+# `data/lake.py`) instead of to .csv files.
+DUMP_FORMAT = os.getenv("DUMP_FORMAT", "csv")
 
 def dump_df_to_csv(
     df: pd.DataFrame,
     table_name: str,
-    filename: Optional[str] = f"{CURRENT_TIME_STR}.csv"
+    filename: Optional[str] = f"{CURRENT_TIME_STR}.csv",
+    dump_format: str = DUMP_FORMAT
 ) -> None:
     """Dumps a pandas df to .csv.
     
     Takes as argument the table name, which will be the folder that the data is
     stored in. The filename is the name of the .csv file. By default, it will
     be determined by the timestamp.
+
+    If `dump_format` is "parquet", the df is dumped to the table's partition
+    for the current date in the Parquet data lake instead (and `filename` is
+    ignored).
     """
+    if dump_format == "parquet":
+        # imported here, so that pyarrow is only imported when it's used.
+        from data.lake import dump_df_to_lake
+        dump_df_to_lake(df=df, table_name=table_name)
+        return
     # create directory for table if it doesn't exist
     table_dir = os.path.join(DATA_DIR, table_name)
     if not os.path.exists(table_dir):
@@ -0,0 +1,148 @@
+"""Append-only checkpoint journal for long-running steps.
+
+Steps that need to be able to resume after an interruption (e.g., sending
+DMs) append a record to the journal after each unit of work, and read the
+journal back when they restart. Records are stored as JSON lines in a single
+file, `data/<table_name>/journal.jsonl`, rather than as one file per record.
+
+Every append is flushed to the OS, so records survive the process crashing.
+To keep appends cheap, the file is only fsynced every `fsync_every` appends
+(and on `sync`/`close`), so the last few records can be lost if the machine
+itself goes down.
+
+Once the results of a step have been written somewhere durable (e.g.,
+upserted to the DB), `clear` deletes the journal. If the step is interrupted
+before that, the journal is replayed on the next run, so whatever consumes it
+needs to be idempotent.
+"""
+import json
+import os
+from typing import Iterator, Optional
+
+from data.helper import DATA_DIR
+
+JOURNAL_FILENAME = "journal.jsonl"
+DEFAULT_FSYNC_EVERY = 10
+
+
+class CheckpointJournal:
+    """Journal of records, indexed by the values of `key_fields`.
+
+    The index maps each key to the byte offset of its latest record, rather
+    than to the record itself, so it stays small for large journals. Records
+    are read back from the file when needed.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        key_fields: tuple[str, ...],
+        fsync_every: int = DEFAULT_FSYNC_EVERY,
+        journal_dir: str = DATA_DIR
+    ) -> None:
+        self.key_fields = key_fields
+        self.fsync_every = fsync_every
+        self.journal_fp = os.path.join(
+            journal_dir, table_name, JOURNAL_FILENAME
+        )
+        self.key_to_offset: dict[tuple, int] = {}
+        self.num_unsynced_appends = 0
+        os.makedirs(os.path.dirname(self.journal_fp), exist_ok=True)
+        self.load_index()
+        self.journal_file = open(self.journal_fp, "ab")
+
+    def get_key(self, record: dict) -> tuple:
+        return tuple(record[key_field] for key_field in self.key_fields)
+
+    def load_index(self) -> None:
+        """Indexes the records in the journal. A partially written last line
+        (from a crash in the middle of an append) is truncated away."""
+        if not os.path.exists(self.journal_fp):
+            return
+        offset = 0
+        with open(self.journal_fp, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Partially written record.")
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Truncating partially written record at byte {offset} of {self.journal_fp}.") # noqa
+                    break
+                self.key_to_offset[self.get_key(record)] = offset
+                offset += len(line)
+        if offset < os.path.getsize(self.journal_fp):
+            with open(self.journal_fp, "r+b") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+
+    def __len__(self) -> int:
+        return len(self.key_to_offset)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.key_to_offset
+
+    def append(self, record: dict) -> None:
+        """Appends a record. A later record with the same key replaces an
+        earlier one."""
+        self.key_to_offset[self.get_key(record)] = self.journal_file.tell()
+        self.journal_file.write(
+            (json.dumps(record, default=str) + "\n").encode("utf-8")
+        )
+        self.journal_file.flush()
+        self.num_unsynced_appends += 1
+        if self.num_unsynced_appends >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.num_unsynced_appends = 0
+
+    def read_record_at(self, offset: int) -> dict:
+        with open(self.journal_fp, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, key: tuple) -> Optional[dict]:
+        """Returns the latest record with a key, if there is one."""
+        if key not in self.key_to_offset:
+            return None
+        self.journal_file.flush()
+        return self.read_record_at(self.key_to_offset[key])
+
+    def iter_records(self) -> Iterator[dict]:
+        """Yields the latest record of each key, in the order that they were
+        appended."""
+        self.journal_file.flush()
+        latest_offsets = set(self.key_to_offset.values())
+        offset = 0
+        with open(self.journal_fp, "rb") as f:
+            for line in f:
+                if offset in latest_offsets:
+                    yield json.loads(line)
+                offset += len(line)
+
+    def records(self) -> list[dict]:
+        return list(self.iter_records())
+
+    def close(self) -> None:
+        if not self.journal_file.closed:
+            self.sync()
+            self.journal_file.close()
+
+    def clear(self) -> None:
+        """Deletes the journal, e.g., once its records have been written
+        somewhere durable."""
+        self.close()
+        if os.path.exists(self.journal_fp):
+            os.remove(self.journal_fp)
+        self.key_to_offset = {}
+        self.journal_file = open(self.journal_fp, "ab")
+        # make the deletion durable too, so that a crash right after can't
+        # bring back an already-written journal.
+        dir_fd = os.open(os.path.dirname(self.journal_fp), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -0,0 +1,262 @@
+"""Parquet data lake for the data dumps.
+
+An alternative to the .csv dumps in `data/<table>/`. Dumps are written as
+Parquet files to `data/lake/<table>/date=<YYYY-MM-DD>/`, so column types are
+kept and reads can skip the dates and columns that they don't need.
+
+Every dump adds a small file, so `compact` merges the files of each date into
+a single file with large row groups.
+
+Usage:
+    python -m data.lake compact [--table-name comments]
+    python -m data.lake import-csv --table-name comments
+"""
+import argparse
+import datetime
+import json
+import os
+from typing import Optional
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from lib.helper import CURRENT_TIME_STR
+
+LAKE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lake")
+DATE_PARTITION_FORMAT = "%Y-%m-%d"
+COMPACTED_ROW_GROUP_SIZE = 1_000_000
+COMPACTED_FILE_PREFIX = "compacted"
+
+
+def get_date_partition_dir(table_name: str, date: str) -> str:
+    return os.path.join(LAKE_DIR, table_name, f"date={date}")
+
+
+def prepare_df_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """Serializes object columns that Parquet can't store as-is (e.g.,
+    columns with dicts, or with a mix of strings and numbers) to JSON
+    strings."""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].apply(
+                lambda value: value if value is None
+                else json.dumps(value, default=str)
+            )
+    return df
+
+
+def dump_df_to_lake(
+    df: pd.DataFrame, table_name: str, date: Optional[str] = None
+) -> str:
+    """Dumps a pandas df to the date partition of a table in the lake.
+
+    The date defaults to the date of the current run. Returns the path of
+    the new file.
+    """
+    date = date or datetime.datetime.strptime(
+        CURRENT_TIME_STR, "%Y-%m-%d_%H%M"
+    ).strftime(DATE_PARTITION_FORMAT)
+    partition_dir = get_date_partition_dir(table_name=table_name, date=date)
+    os.makedirs(partition_dir, exist_ok=True)
+    # a run can dump the same table more than once.
+    file_path = os.path.join(
+        partition_dir, f"{CURRENT_TIME_STR}-{uuid.uuid4().hex[:8]}.parquet"
+    )
+    prepare_df_for_parquet(df).to_parquet(file_path, index=False)
+    return file_path
+
+
+def unify_schemas(schemas: list[pa.Schema]) -> pa.Schema:
+    """Merges the schemas of files written by different runs, which can have
+    different columns or types. Types are promoted where possible (e.g., ints
+    to floats), and columns whose types can't be merged (e.g., a column that
+    was all nulls, and so read as floats, in one .csv dump and strings in
+    another) are read as strings."""
+    try:
+        return pa.unify_schemas(schemas, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    fields: dict[str, pa.Field] = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name not in fields:
+                fields[field.name] = field
+                continue
+            try:
+                fields[field.name] = pa.unify_schemas(
+                    [pa.schema([fields[field.name]]), pa.schema([field])],
+                    promote_options="permissive"
+                ).field(field.name)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                fields[field.name] = pa.field(field.name, pa.large_string())
+    return pa.schema(list(fields.values()))
+
+
+def get_table_dataset(table_name: str) -> ds.Dataset:
+    """Returns the dataset of all of the files of a table, with their schemas
+    unified (see `unify_schemas`)."""
+    table_dir = os.path.join(LAKE_DIR, table_name)
+    if not os.path.exists(table_dir):
+        raise ValueError(f"No data in the lake for table {table_name}.")
+    file_paths = [
+        os.path.join(root, filename)
+        for root, _, filenames in os.walk(table_dir)
+        for filename in filenames
+        if filename.endswith(".parquet")
+    ]
+    schema = unify_schemas(
+        [pq.read_schema(file_path) for file_path in file_paths]
+    )
+    return ds.dataset(
+        file_paths,
+        schema=schema.append(pa.field("date", pa.string())),
+        format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([("date", pa.string())]), flavor="hive"
+        ),
+        partition_base_dir=table_dir
+    )
+
+
+def load_lake_dataset(
+    table_name: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    filter: Optional[ds.Expression] = None
+) -> ds.Dataset:
+    """Returns a lazily filtered dataset of a table, for the dates between
+    `start_date` and `end_date` (inclusive, as YYYY-MM-DD) and any other
+    filter (e.g., `ds.field("subreddit") == "politics"`).
+
+    Nothing is read until the dataset is scanned, e.g., with
+    `.to_table(columns=[...])`, and then only the files of the matching dates
+    and the requested columns are read.
+    """
+    dataset = get_table_dataset(table_name=table_name)
+    expression = None
+    if start_date:
+        expression = ds.field("date") >= start_date
+    if end_date:
+        end_date_expression = ds.field("date") <= end_date
+        expression = (
+            end_date_expression if expression is None
+            else expression & end_date_expression
+        )
+    if filter is not None:
+        expression = filter if expression is None else expression & filter
+    return dataset if expression is None else dataset.filter(expression)
+
+
+def load_lake_table_as_df(
+    table_name: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    filter: Optional[ds.Expression] = None
+) -> pd.DataFrame:
+    """Loads (the requested columns of) a filtered table from the lake."""
+    return load_lake_dataset(
+        table_name=table_name,
+        start_date=start_date,
+        end_date=end_date,
+        filter=filter
+    ).to_table(columns=columns).to_pandas()
+
+
+def compact_date_partition(
+    table_name: str, date: str, row_group_size: int = COMPACTED_ROW_GROUP_SIZE
+) -> None:
+    """Merges the files of one date of a table into a single file."""
+    partition_dir = get_date_partition_dir(table_name=table_name, date=date)
+    file_paths = sorted(
+        os.path.join(partition_dir, filename)
+        for filename in os.listdir(partition_dir)
+        if filename.endswith(".parquet")
+    )
+    if len(file_paths) < 2:
+        return
+    tables = [pq.read_table(file_path) for file_path in file_paths]
+    schema = unify_schemas([table.schema for table in tables])
+    compacted_table = pa.concat_tables([
+        table.select(
+            [name for name in schema.names if name in table.column_names]
+        ).cast(pa.schema([
+            schema.field(name) for name in schema.names
+            if name in table.column_names
+        ]))
+        for table in tables
+    ], promote_options="default")
+    compacted_file_path = os.path.join(
+        partition_dir,
+        f"{COMPACTED_FILE_PREFIX}-{CURRENT_TIME_STR}-{uuid.uuid4().hex[:8]}.parquet" # noqa
+    )
+    tmp_file_path = f"{compacted_file_path}.tmp"
+    pq.write_table(
+        compacted_table, tmp_file_path, row_group_size=row_group_size
+    )
+    # the compacted file is in place before the small files are removed, so
+    # an interrupted compaction never loses rows.
+    os.replace(tmp_file_path, compacted_file_path)
+    for file_path in file_paths:
+        os.remove(file_path)
+    print(f"Compacted {len(file_paths)} files of {table_name} for {date} ({compacted_table.num_rows} rows).") # noqa
+
+
+def compact_lake(table_name: Optional[str] = None) -> None:
+    """Compacts every date of a table (or of every table)."""
+    if not os.path.exists(LAKE_DIR):
+        print("No data in the lake to compact.")
+        return
+    table_names = [table_name] if table_name else sorted(os.listdir(LAKE_DIR))
+    for table_name in table_names:
+        table_dir = os.path.join(LAKE_DIR, table_name)
+        for partition in sorted(os.listdir(table_dir)):
+            if partition.startswith("date="):
+                compact_date_partition(
+                    table_name=table_name, date=partition.split("=", 1)[1]
+                )
+
+
+def import_csv_dumps_to_lake(table_name: str, csv_dir: str) -> None:
+    """Copies the .csv dumps of a table into the lake, using the date in the
+    name of each file."""
+    for filename in sorted(os.listdir(csv_dir)):
+        if not filename.endswith(".csv"):
+            continue
+        date = datetime.datetime.strptime(
+            filename[:len("YYYY-MM-DD_HHMM")], "%Y-%m-%d_%H%M"
+        ).strftime(DATE_PARTITION_FORMAT)
+        df = pd.read_csv(os.path.join(csv_dir, filename))
+        dump_df_to_lake(df=df, table_name=table_name, date=date)
+    print(f"Imported .csv dumps of {table_name} into the lake.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the data lake.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact", help="Merge the small files of each date."
+    )
+    compact_parser.add_argument("--table-name", default=None)
+    import_parser = subparsers.add_parser(
+        "import-csv", help="Import the .csv dumps of a table."
+    )
+    import_parser.add_argument("--table-name", required=True)
+    args = parser.parse_args()
+    if args.command == "compact":
+        compact_lake(table_name=args.table_name)
+    elif args.command == "import-csv":
+        from data.helper import DATA_DIR
+        import_csv_dumps_to_lake(
+            table_name=args.table_name,
+            csv_dir=os.path.join(DATA_DIR, args.table_name)
+        )
+        compact_lake(table_name=args.table_name)
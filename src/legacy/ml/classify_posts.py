@@ -26,7 +26,7 @@ from ml.constants import (
     LABEL_COL, LABELED_DATA_FILENAME, ML_ROOT_PATH, PROB_COL
 )
 from services.classify_comments.inference import (
-    classify_text, load_default_embedding_and_tokenizer
+    DEFAULT_BATCH_SIZE, classify_texts, load_default_embedding_and_tokenizer
 )
 from sync.constants import (
     COLS_TO_IDENTIFY_POST, POST_TEXT_COLNAME, SYNC_RESULTS_FILENAME,
@@ -40,17 +40,14 @@ logger = RedditLogger(name=__name__)
 def perform_classifications(
     texts_list: List[str],
     embedding: Model,
-    tokenizer: Tuple
-) -> Tuple[List[List[int]], List[int]]:
-    probs: List[List[int]] = [] # nested list, e.g., [[0.2], [0.5]]
-    labels: List[int] = [] # e.g., [0, 1]
-
-    for text in texts_list:
-        prob, label = classify_text(text, embedding, tokenizer)
-        probs.append(prob)
-        labels.append(label)
-
-    return probs, labels
+    tokenizer: Tuple,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Tuple[List[List[float]], List[int]]:
+    probs, labels = classify_texts(
+        texts_list, embedding, tokenizer, batch_size=batch_size
+    )
+    # nested list, e.g., [[0.2], [0.5]], and labels, e.g., [0, 1]
+    return [[prob] for prob in probs.tolist()], labels.tolist()
 
 
 if __name__ == "__main__":
@@ -1,84 +1,278 @@
 """Backup the existing Postgres data.
 
-Saves to a `lib/db/sql/backup/{timestamp}` directory. Dumps both a compressed
-version of the data as well as the schemas of every existing table.
+Saves to a `lib/db/sql/snapshots/{timestamp}` directory. Dumps a compressed
+version of the data, the schemas of every existing table, and a manifest with
+the row count and checksum of every file.
+
+Each table is streamed from Postgres with `COPY ... TO STDOUT` straight into
+a compressed file, one worker (with its own connection) per table. All of the
+workers read from the same exported snapshot, so the tables are consistent
+with each other.
+
+With `--incremental`, only the rows whose watermark column (see
+`TABLE_TO_WATERMARK_COLUMN_MAP`) is past the watermark recorded in the
+latest snapshot's manifest are dumped. Tables without a watermark column are
+dumped in full. Deleted rows aren't captured by incremental snapshots, so
+take a full snapshot every so often.
 """
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import gzip
+import hashlib
 import json
 import os
-from typing import Optional, Literal
+from typing import IO, Optional, Literal, cast
+
+import psycopg2
 
 from lib.db.sql.helper import (
-    current_file_directory, cursor, get_all_tables_in_db,
-    get_table_col_to_dtype_map, load_table_as_df
+    DB_PARAMS, current_file_directory, get_all_tables_in_db,
+    get_table_col_to_dtype_map
 )
 from lib.helper import CURRENT_TIME_STR
 
+snapshots_dir = os.path.join(current_file_directory, "snapshots")
+MANIFEST_FILENAME = "manifest.json"
+DEFAULT_MAX_WORKERS = 8
+
+CopyFormat = Literal["csv", "sql", "binary"]
+Compression = Optional[Literal["gzip", "zstd"]]
+
+format_to_copy_options = {
+    "csv": "(FORMAT csv, HEADER)",
+    "sql": "",
+    "binary": "(FORMAT binary)"
+}
+format_to_suffix = {"csv": ".csv", "sql": ".sql", "binary": ".bin"}
+compression_to_suffix = {"gzip": ".gz", "zstd": ".zst", None: ""}
+
+# columns that are updated whenever a row is written, used to find the rows
+# that changed since the last snapshot.
+TABLE_TO_WATERMARK_COLUMN_MAP = {
+    "subreddits": "synctimestamp",
+    "users": "synctimestamp",
+    "threads": "synctimestamp",
+    "comments": "synctimestamp",
+    "messages_received": "synctimestamp",
+    "user_to_message_status": "last_update_timestamp",
+}
+
 
 def init_directory() -> str:
-    backup_dir = os.path.join(current_file_directory, "snapshots")
-    if not os.path.exists(backup_dir):
-        os.mkdir(backup_dir)
-    timestamp_dir = os.path.join(backup_dir, CURRENT_TIME_STR)
+    if not os.path.exists(snapshots_dir):
+        os.mkdir(snapshots_dir)
+    timestamp_dir = os.path.join(snapshots_dir, CURRENT_TIME_STR)
     if not os.path.exists(timestamp_dir):
         os.mkdir(timestamp_dir)
     return timestamp_dir
 
 
-def dump_table_to_sql(
-    table_name: str, table_fp: str, zipped: bool = False
-) -> None:
-    query = f"SELECT * FROM {table_name}"
-    copy_query = f"COPY ({query}) TO STDOUT"
-    if zipped:
-        assert table_fp.endswith(".sql.gz")
-        with gzip.open(table_fp, "wt", encoding="utf-8") as gzipped_file:
-            cursor.copy_expert(copy_query, gzipped_file)
-    else:
-        assert table_fp.endswith(".sql")
-        with open(table_fp, "w", encoding="utf-8") as f:
-            cursor.copy_expert(copy_query, f)   
-    print(f"Successfully dumped '{table_name}' table to {table_fp}.")
+def open_compressed_file(
+    fp: str,
+    compression: Compression,
+    binary: bool = False,
+    mode: Literal["r", "w"] = "w"
+) -> IO:
+    """Opens a file compressed with gzip or zstd (or not compressed)."""
+    file_mode = f"{mode}b" if binary else f"{mode}t"
+    encoding = None if binary else "utf-8"
+    if compression == "gzip":
+        # a GzipFile (binary mode) has the IO interface, but isn't typed as IO.
+        return cast(IO, gzip.open(fp, file_mode, encoding=encoding))
+    if compression == "zstd":
+        # only needed for zstd backups.
+        import zstandard
+        return zstandard.open(fp, file_mode, encoding=encoding)
+    return open(fp, file_mode, encoding=encoding)
 
 
-def dump_table_to_csv(
-    table_name: str, table_fp: str, zipped: bool = False
-) -> None:
-    df = load_table_as_df(table_name)
+def get_file_checksum(fp: str) -> str:
+    """Returns the SHA-256 checksum of a file."""
+    sha256 = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_table_fp(
+    timestamp_dir: str,
+    table_name: str,
+    format: CopyFormat,
+    compression: Compression
+) -> str:
+    suffix = format_to_suffix[format] + compression_to_suffix[compression]
+    return os.path.join(timestamp_dir, f"{table_name}{suffix}")
+
+
+def connect_to_snapshot(
+    snapshot_id: Optional[str] = None
+) -> psycopg2.extensions.connection:
+    """Opens a read-only connection whose transaction reads from an exported
+    snapshot (if given)."""
+    snapshot_conn = psycopg2.connect(**DB_PARAMS)
+    snapshot_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    if snapshot_id:
+        snapshot_conn.cursor().execute(
+            "SET TRANSACTION SNAPSHOT %s;", (snapshot_id,)
+        )
+    return snapshot_conn
+
+
+def dump_table(
+    table_name: str,
+    table_fp: str,
+    format: CopyFormat = "csv",
+    compression: Compression = "gzip",
+    snapshot_id: Optional[str] = None,
+    watermark_column: Optional[str] = None,
+    since_watermark: Optional[str] = None
+) -> dict:
+    """Streams a table into a compressed file with `COPY ... TO STDOUT`.
+
+    Only rows past `since_watermark` are dumped, if it's given. Uses its own
+    connection, so that tables can be dumped in parallel.
+
+    Returns the manifest entry of the table.
+    """
+    where_filter = (
+        f"WHERE {watermark_column} > %(since_watermark)s"
+        if watermark_column and since_watermark else ""
+    )
+    snapshot_conn = connect_to_snapshot(snapshot_id=snapshot_id)
     try:
-        if zipped:
-            df.to_csv(table_fp, index=False, compression="gzip")
-        else:
-            df.to_csv(table_fp, index=False)
-        print(f"Successfully dumped '{table_name}' table to {table_fp}.")
+        with snapshot_conn.cursor() as snapshot_cursor:
+            query = snapshot_cursor.mogrify(
+                f"SELECT * FROM {table_name} {where_filter}",
+                {"since_watermark": since_watermark}
+            ).decode("utf-8")
+            copy_query = (
+                f"COPY ({query}) TO STDOUT {format_to_copy_options[format]}"
+            )
+            with open_compressed_file(
+                table_fp, compression=compression, binary=format == "binary"
+            ) as f:
+                snapshot_cursor.copy_expert(copy_query, f)
+            row_count = snapshot_cursor.rowcount
+        snapshot_conn.rollback()
     except Exception as e:
         print(f"Unable to dump '{table_name}' table to {table_fp}.")
         raise e
+    finally:
+        snapshot_conn.close()
+    print(f"Successfully dumped {row_count} rows of '{table_name}' table to {table_fp}.") # noqa
+    return {
+        "file": os.path.basename(table_fp),
+        "row_count": row_count,
+        "sha256": get_file_checksum(table_fp),
+        "num_bytes": os.path.getsize(table_fp),
+        "watermark_column": watermark_column,
+        "since_watermark": since_watermark if where_filter else None
+    }
 
 
-def dump_postgres_db(
-    timestamp_dir: str, table_list: list[str], zipped: bool=False,
-    format: Optional[Literal["csv", "sql"]] = "csv"
-) -> None:
-    print(f"Dumping DB tables to {timestamp_dir}...")
+def get_latest_manifest(exclude_snapshot: str = CURRENT_TIME_STR) -> Optional[dict]: # noqa
+    """Returns the manifest of the latest snapshot that has one."""
+    if not os.path.exists(snapshots_dir):
+        return None
+    for snapshot in sorted(os.listdir(snapshots_dir), reverse=True):
+        manifest_fp = os.path.join(snapshots_dir, snapshot, MANIFEST_FILENAME)
+        if snapshot != exclude_snapshot and os.path.exists(manifest_fp):
+            with open(manifest_fp, "r", encoding="utf-8") as f:
+                return json.load(f)
+    return None
+
+
+def get_table_watermarks(
+    snapshot_cursor: psycopg2.extensions.cursor, table_list: list[str]
+) -> dict[str, Optional[str]]:
+    """Returns the latest value of the watermark column of each table, as of
+    the snapshot."""
+    table_to_watermark_map: dict[str, Optional[str]] = {}
     for table_name in table_list:
-        suffix = ".csv" if format == "csv" else ".sql"
-        suffix = suffix + ".gz" if zipped else suffix
-        table_fp = os.path.join(timestamp_dir, f"{table_name}{suffix}")
-        if format == "sql":
-            dump_table_to_sql(
-                table_name=table_name,
-                table_fp=table_fp,
-                zipped=zipped
-            )
-        elif format == "csv":
-            dump_table_to_csv(
-                table_name=table_name,
-                table_fp=table_fp,
-                zipped=zipped
-            )
+        watermark_column = TABLE_TO_WATERMARK_COLUMN_MAP.get(table_name)
+        if not watermark_column:
+            continue
+        snapshot_cursor.execute(
+            f"SELECT MAX({watermark_column})::text FROM {table_name};"
+        )
+        table_to_watermark_map[table_name] = snapshot_cursor.fetchone()[0]
+    return table_to_watermark_map
 
-    print(f"Finished successfully dumping tables from DB.")
+
+def dump_postgres_db(
+    timestamp_dir: str,
+    table_list: list[str],
+    format: CopyFormat = "csv",
+    compression: Compression = "gzip",
+    incremental: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS
+) -> dict:
+    """Dumps tables in parallel, from one consistent snapshot, and writes the
+    manifest of the snapshot. Returns the manifest."""
+    print(f"Dumping DB tables to {timestamp_dir}...")
+    base_manifest = get_latest_manifest() if incremental else None
+    if incremental and base_manifest is None:
+        print("No previous snapshot with a manifest. Taking a full snapshot.")
+    base_tables = base_manifest["tables"] if base_manifest else {}
+    # the coordinating connection holds the snapshot open until all of the
+    # workers have finished.
+    coordinator_conn = connect_to_snapshot()
+    try:
+        coordinator_cursor = coordinator_conn.cursor()
+        coordinator_cursor.execute("SELECT pg_export_snapshot();")
+        snapshot_id = coordinator_cursor.fetchone()[0]
+        table_to_watermark_map = get_table_watermarks(
+            snapshot_cursor=coordinator_cursor, table_list=table_list
+        )
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(table_list)) or 1
+        ) as executor:
+            table_to_future_map = {
+                table_name: executor.submit(
+                    dump_table,
+                    table_name=table_name,
+                    table_fp=get_table_fp(
+                        timestamp_dir=timestamp_dir,
+                        table_name=table_name,
+                        format=format,
+                        compression=compression
+                    ),
+                    format=format,
+                    compression=compression,
+                    snapshot_id=snapshot_id,
+                    watermark_column=TABLE_TO_WATERMARK_COLUMN_MAP.get(
+                        table_name
+                    ),
+                    since_watermark=base_tables.get(table_name, {}).get(
+                        "watermark"
+                    )
+                )
+                for table_name in table_list
+            }
+            table_to_manifest_entry_map = {
+                table_name: {
+                    **future.result(),
+                    "watermark": table_to_watermark_map.get(table_name)
+                }
+                for table_name, future in table_to_future_map.items()
+            }
+    finally:
+        coordinator_conn.rollback()
+        coordinator_conn.close()
+    manifest = {
+        "snapshot": os.path.basename(timestamp_dir),
+        "type": "incremental" if base_manifest else "full",
+        "base_snapshot": base_manifest["snapshot"] if base_manifest else None,
+        "format": format,
+        "compression": compression,
+        "tables": table_to_manifest_entry_map
+    }
+    manifest_fp = os.path.join(timestamp_dir, MANIFEST_FILENAME)
+    with open(manifest_fp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Finished successfully dumping tables from DB. Manifest: {manifest_fp}") # noqa
+    return manifest
 
 
 def dump_postgres_db_schemas_to_file(
@@ -107,12 +301,21 @@ def dump_postgres_db_schemas_to_file(
     print(f"Finished dumping DB schema file to {full_fp}.")
 
 
-def main() -> None:
+def main(
+    format: CopyFormat = "csv",
+    compression: Compression = "gzip",
+    incremental: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
     timestamp_dir = init_directory()
-    table_list: list[str] = get_all_tables_in_db()
+    table_list: list[str] = get_all_tables_in_db(include_partitions=False)
     dump_postgres_db(
-        timestamp_dir=timestamp_dir, table_list=table_list, zipped=True,
-        format="csv"
+        timestamp_dir=timestamp_dir,
+        table_list=table_list,
+        format=format,
+        compression=compression,
+        incremental=incremental,
+        max_workers=max_workers
     )
     dump_postgres_db_schemas_to_file(
         timestamp_dir=timestamp_dir, table_list=table_list, zipped=False
@@ -120,4 +323,25 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Back up the Postgres DB.")
+    parser.add_argument(
+        "--format", choices=["csv", "sql", "binary"], default="csv"
+    )
+    parser.add_argument(
+        "--compression", choices=["gzip", "zstd", "none"], default="gzip"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only dump rows that changed since the latest snapshot."
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+        help="Max number of tables to dump in parallel."
+    )
+    args = parser.parse_args()
+    main(
+        format=args.format,
+        compression=None if args.compression == "none" else args.compression,
+        incremental=args.incremental,
+        max_workers=args.max_workers
+    )
@@ -1,16 +1,27 @@
-"""Helper utilities for interacting with Postgres."""
+"""Helper utilities for interacting with Postgres.
+
+Set `DB_BACKEND=sqlite` to use an embedded SQLite database file instead (see
+`lib/db/sql/sqlite_helper.py`). Postgres is used by default.
+"""
 from dotenv import load_dotenv
 import json
 import os
-from typing import Optional
+from typing import Any, Optional
 
 import numpy as np
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
 from sqlalchemy import create_engine
-from sqlalchemy.types import Integer, Text, Boolean, Float
+from sqlalchemy.types import Integer, Text, Boolean, Float, TIMESTAMP
 
-from lib.db.sql.tables import TABLE_TO_KEYS_MAP
+from lib.db.sql import sqlite_helper
+from lib.db.sql.query_cache import (
+    USE_QUERY_CACHE, get_tables_referenced_by_query, query_cache
+)
+from lib.db.sql.tables import (
+    TABLE_TO_COLUMN_TYPES_MAP, TABLE_TO_KEYS_MAP, TABLE_TO_PARTITION_KEY_MAP
+)
 
 current_file_directory = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.abspath(os.path.join(current_file_directory, "../../../../.env"))
@@ -24,12 +35,21 @@ DB_PARAMS = {
     'password': os.getenv("DB_PASSWORD")
 }
 
-conn = psycopg2.connect(**DB_PARAMS)
-cursor = conn.cursor()
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+
+if DB_BACKEND == "postgres":
+    conn = psycopg2.connect(**DB_PARAMS)
+    cursor = conn.cursor()
 
-# https://saturncloud.io/blog/writing-dataframes-to-a-postgres-database-using-psycopg2/
-db_uri = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['database']}" # noqa 
-engine = create_engine(db_uri)
+    # https://saturncloud.io/blog/writing-dataframes-to-a-postgres-database-using-psycopg2/
+    db_uri = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['database']}" # noqa 
+    engine = create_engine(db_uri)
+elif DB_BACKEND == "sqlite":
+    conn = sqlite_helper.connect()
+    cursor = conn.cursor()
+    engine = create_engine(f"sqlite:///{sqlite_helper.SQLITE_DB_PATH}")
+else:
+    raise ValueError(f"Unknown DB backend: {DB_BACKEND}")
 
 
 dtype_to_sql_type_map = {
@@ -38,14 +58,20 @@ dtype_to_sql_type_map = {
     np.dtype("int32"): "int",
     np.dtype("int64"): "int",
     np.dtype("float32"): "float",
-    np.dtype("float64"): "float"
+    np.dtype("float64"): "float",
+    np.dtype("datetime64[ns]"): "timestamptz",
+    pd.DatetimeTZDtype(tz="UTC"): "timestamptz"
 }
 
 sql_string_type_to_native_type = {
     "text": Text,
     "bool": Boolean,
     "int": Integer,
-    "float": Float
+    "float": Float,
+    "timestamptz": TIMESTAMP(timezone=True),
+    # JSONB values are serialized before they're written, so they're passed
+    # through as text literals and cast to JSONB by Postgres.
+    "jsonb": Text
 }
 
 
@@ -57,14 +83,29 @@ def convert_python_dtype_to_sql_type(dtype: np.dtype) -> str:
 
 
 def get_sql_cols_for_df_fields(
-    df: pd.DataFrame, return_native_sqlalchemy_types: bool = False
+    df: pd.DataFrame,
+    return_native_sqlalchemy_types: bool = False,
+    table_name: Optional[str] = None
 ) -> dict:
+    """Returns a map of col:SQL type for the fields in a df.
+
+    Types are inferred from the pandas dtypes, except for any columns whose
+    types are declared for the table in `TABLE_TO_COLUMN_TYPES_MAP`.
+    """
+    declared_col_to_sql_type_map = (
+        TABLE_TO_COLUMN_TYPES_MAP.get(table_name, {})
+        if table_name is not None else {}
+    )
     col_to_dtype_map = {
         col: df[col].dtype
         for col in df.columns
     }
     col_to_sql_type_map = {
-        col: convert_python_dtype_to_sql_type(dtype)
+        col: (
+            declared_col_to_sql_type_map[col]
+            if col in declared_col_to_sql_type_map
+            else convert_python_dtype_to_sql_type(dtype)
+        )
         for col, dtype in col_to_dtype_map.items()
     }
     if return_native_sqlalchemy_types:
@@ -81,6 +122,7 @@ def drop_table(table_name: str, cascade: bool = False) -> None:
     try:
         print(f"Dropping table {table_name}...")
         cursor.execute(f"DROP TABLE IF EXISTS {table_name} {'CASCADE' if cascade else ''};") # noqa
+        bump_table_write_version(table_name=table_name)
         conn.commit()
         print(f"Table {table_name} deleted successfully.")
     except Exception as e:
@@ -99,6 +141,70 @@ def get_table_row_count(table_name: str) -> Optional[int]:
         raise
 
 
+def get_estimated_table_row_count(table_name: str) -> Optional[int]:
+    """Gets the planner's estimate of the number of rows in a table.
+
+    Reads `pg_class.reltuples` instead of scanning the table, so it's cheap
+    even for large tables but only as fresh as the last VACUUM/ANALYZE.
+    Returns None if the table has never been analyzed. For SQLite, which
+    keeps no such estimate, this is an exact count.
+    """
+    if DB_BACKEND == "sqlite":
+        return get_table_row_count(table_name=table_name)
+    try:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = %s;",
+            (table_name,)
+        )
+        result = cursor.fetchone()
+        if result is None or result[0] < 0:
+            return None
+        return result[0]
+    except Exception as e:
+        print(f"Unable to get estimated row count for table {table_name}: {e}") # noqa
+        raise
+
+
+class WriteResult:
+    """Statistics for a write of a dataframe to a table.
+
+    The counts come from the write itself rather than from `COUNT(*)` queries
+    before and after the write. `estimated_row_count` is only set if it was
+    requested (see `get_estimated_table_row_count`).
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        num_rows_inserted: int = 0,
+        num_rows_updated: int = 0,
+        estimated_row_count: Optional[int] = None
+    ) -> None:
+        self.table_name = table_name
+        self.num_rows_inserted = num_rows_inserted
+        self.num_rows_updated = num_rows_updated
+        self.estimated_row_count = estimated_row_count
+
+    @property
+    def num_rows_written(self) -> int:
+        return self.num_rows_inserted + self.num_rows_updated
+
+    def to_dict(self) -> dict:
+        """Converts object and its attributes to a JSON dict."""
+        return {
+            **{attr: getattr(self, attr) for attr in self.__dict__},
+            "num_rows_written": self.num_rows_written
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"WriteResult(table_name={self.table_name}, "
+            f"num_rows_inserted={self.num_rows_inserted}, "
+            f"num_rows_updated={self.num_rows_updated}, "
+            f"estimated_row_count={self.estimated_row_count})"
+        )
+
+
 def generate_primary_key_statement(primary_keys: list[str]) -> str:
     return f"PRIMARY KEY ({', '.join(primary_keys)})"
 
@@ -122,12 +228,104 @@ def create_foreign_key_statement(foreign_keys: list[dict]) -> str:
     return foreign_key_str
 
 
+def get_partitioned_primary_keys(table_name: str) -> list[str]:
+    """Returns the primary keys of a table when it's partitioned, which must
+    include its partition key."""
+    primary_keys: list[str] = TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
+    partition_key = TABLE_TO_PARTITION_KEY_MAP.get(table_name)
+    if partition_key and partition_key not in primary_keys:
+        return primary_keys + [partition_key]
+    return primary_keys
+
+
+def check_if_table_is_partitioned(table_name: str) -> bool:
+    """Checks if a table exists in the database as a partitioned table."""
+    if DB_BACKEND == "sqlite":
+        return False
+    cursor.execute(
+        """
+            SELECT EXISTS (
+                SELECT FROM pg_partitioned_table
+                JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid
+                WHERE pg_class.relname = %s
+            );
+        """,
+        (table_name,)
+    )
+    return cursor.fetchone()[0]
+
+
+def get_table_upsert_keys(table_name: str) -> list[str]:
+    """Returns the keys to upsert on for a table: its primary keys, plus its
+    partition key if the table is partitioned."""
+    if (
+        table_name in TABLE_TO_PARTITION_KEY_MAP
+        and check_if_table_is_partitioned(table_name)
+    ):
+        return get_partitioned_primary_keys(table_name)
+    return TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
+
+
+def adapt_foreign_keys_to_partitioned_tables(
+    foreign_keys: list[dict], field_names: list[str]
+) -> list[dict]:
+    """Foreign keys that reference a partitioned table have to include its
+    partition key. If the referencing table also has that column, it's added
+    to the foreign key. Otherwise, the foreign key is left out, since Postgres
+    can't enforce it.
+    """
+    adapted_foreign_keys: list[dict] = []
+    for foreign_key in foreign_keys:
+        reference_table = foreign_key["reference_table"]
+        partition_key = TABLE_TO_PARTITION_KEY_MAP.get(reference_table)
+        if (
+            partition_key is None
+            or not check_if_table_is_partitioned(reference_table)
+        ):
+            adapted_foreign_keys.append(foreign_key)
+        elif partition_key in field_names:
+            adapted_foreign_keys.append({
+                **foreign_key,
+                "key": f"{foreign_key['key']}, {partition_key}",
+                "reference_table_key": (
+                    f"{foreign_key['reference_table_key']}, {partition_key}"
+                )
+            })
+        else:
+            print(
+                f"Not adding foreign key on {foreign_key['key']}, since "
+                f"{reference_table} is partitioned on {partition_key}."
+            )
+    return adapted_foreign_keys
+
+
 # https://www.postgresqltutorial.com/postgresql-python/create-tables/
 def generate_create_table_statement(
-    table_name: str, field_to_sql_type_map: dict
+    table_name: str,
+    field_to_sql_type_map: dict,
+    partitioned: Optional[bool] = None
 ) -> str:
-    primary_keys: list[str] = TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
-    foreign_keys: list[dict] = TABLE_TO_KEYS_MAP[table_name]["foreign_keys"]
+    """Generates the CREATE TABLE statement for a table.
+
+    Tables in `TABLE_TO_PARTITION_KEY_MAP` are created (in Postgres) as tables
+    range-partitioned on their partition key, unless `partitioned` is set to
+    False. Their partitions are created separately (see
+    `create_partitions_for_months`).
+    """
+    if partitioned is None:
+        partitioned = (
+            DB_BACKEND == "postgres"
+            and TABLE_TO_PARTITION_KEY_MAP.get(table_name)
+            in field_to_sql_type_map
+        )
+    primary_keys: list[str] = (
+        get_partitioned_primary_keys(table_name) if partitioned
+        else TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
+    )
+    foreign_keys: list[dict] = [
+        dict(foreign_key)
+        for foreign_key in TABLE_TO_KEYS_MAP[table_name]["foreign_keys"]
+    ]
     fields_list = [
         f"""
             {field_name} {field_type}
@@ -140,16 +338,123 @@ def generate_create_table_statement(
         for field_name, field_type in field_to_sql_type_map.items()
     ]
     fields_query = ',\n'.join(fields_list)
-    primary_keys = generate_primary_key_statement(primary_keys)
-    foreign_keys = create_foreign_key_statement(foreign_keys)
+    foreign_keys = adapt_foreign_keys_to_partitioned_tables(
+        foreign_keys=foreign_keys,
+        field_names=list(field_to_sql_type_map.keys())
+    )
+    primary_key_statement = generate_primary_key_statement(primary_keys)
+    foreign_key_statement = create_foreign_key_statement(foreign_keys)
+    partition_statement = (
+        f"PARTITION BY RANGE ({TABLE_TO_PARTITION_KEY_MAP[table_name]})"
+        if partitioned else ""
+    )
     create_table_sql = f"""CREATE TABLE {table_name} (
         {fields_query},
-        {primary_keys}{',' if foreign_keys else ''}
-        {foreign_keys}
-    )
+        {primary_key_statement}{',' if foreign_key_statement else ''}
+        {foreign_key_statement}
+    ) {partition_statement}
     """
     return create_table_sql
-   
+
+
+def get_partition_name(table_name: str, month_start: pd.Timestamp) -> str:
+    return f"{table_name}_{month_start.strftime('%Y_%m')}"
+
+
+def get_existing_partitions(table_name: str) -> set[str]:
+    """Returns the names of the partitions of a partitioned table."""
+    cursor.execute(
+        """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s;
+        """,
+        (table_name,)
+    )
+    return {partition[0] for partition in cursor.fetchall()}
+
+
+def get_months_of_epoch_series(series: pd.Series) -> list[pd.Timestamp]:
+    """Returns the (UTC) start of each month that a series of epoch
+    timestamps falls in."""
+    timestamps = pd.to_datetime(series.dropna(), unit="s", utc=True)
+    return [
+        pd.Timestamp(f"{year_month}-01", tz="UTC")
+        for year_month in sorted(timestamps.dt.strftime("%Y-%m").unique())
+    ]
+
+
+def generate_create_partition_statement(
+    table_name: str, month_start: pd.Timestamp
+) -> str:
+    """Generates the statement that creates the partition of a table for the
+    month starting at `month_start`."""
+    partition_name = get_partition_name(
+        table_name=table_name, month_start=month_start
+    )
+    next_month_start = month_start + pd.offsets.MonthBegin(1)
+    return f"""
+        CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name}
+        FOR VALUES FROM ({month_start.timestamp()})
+        TO ({next_month_start.timestamp()});
+    """
+
+
+def create_partitions_for_months(
+    table_name: str, month_starts: list[pd.Timestamp], commit: bool = True
+) -> list[str]:
+    """Creates the monthly partitions of a partitioned table that don't exist
+    yet, plus a default partition for rows in months that don't have their own
+    partition (the partition key is part of the primary key, so it's never
+    NULL).
+
+    Returns the names of the partitions that were created.
+    """
+    existing_partitions = get_existing_partitions(table_name=table_name)
+    created_partitions: list[str] = []
+    default_partition_name = f"{table_name}_default"
+    if default_partition_name not in existing_partitions:
+        cursor.execute(
+            f"CREATE TABLE {default_partition_name} PARTITION OF {table_name} DEFAULT;" # noqa
+        )
+        created_partitions.append(default_partition_name)
+    for month_start in month_starts:
+        partition_name = get_partition_name(
+            table_name=table_name, month_start=month_start
+        )
+        if partition_name in existing_partitions:
+            continue
+        cursor.execute(generate_create_partition_statement(
+            table_name=table_name, month_start=month_start
+        ))
+        created_partitions.append(partition_name)
+    if commit:
+        conn.commit()
+    if created_partitions:
+        print(f"Created partitions {created_partitions} of {table_name}.")
+    return created_partitions
+
+
+def create_partitions_for_df(
+    df: pd.DataFrame, table_name: str, commit: bool = True
+) -> None:
+    """Makes sure that a partitioned table has partitions for all of the rows
+    in a df, so that rows in new months don't land in the default partition
+    (which only catches months without a partition)."""
+    if (
+        table_name not in TABLE_TO_PARTITION_KEY_MAP
+        or not check_if_table_is_partitioned(table_name)
+    ):
+        return
+    partition_key = TABLE_TO_PARTITION_KEY_MAP[table_name]
+    create_partitions_for_months(
+        table_name=table_name,
+        month_starts=get_months_of_epoch_series(df[partition_key]),
+        commit=commit
+    )
+
 
 def generate_create_table_statement_from_df(
     df: pd.DataFrame, table_name: str
@@ -158,7 +463,9 @@ def generate_create_table_statement_from_df(
     
     Infers the columns and dtypes from the pandas df.
     """
-    col_to_sql_type_map = get_sql_cols_for_df_fields(df)
+    col_to_sql_type_map = get_sql_cols_for_df_fields(
+        df=df, table_name=table_name
+    )
 
     create_table_sql = generate_create_table_statement(
         table_name=table_name,
@@ -170,18 +477,20 @@ def generate_create_table_statement_from_df(
 
 
 def create_new_table_from_df(
-    df: pd.DataFrame, table_name: str
+    df: pd.DataFrame, table_name: str, commit: bool = True
 ) -> None:
     """Given a df, create a new table from it.
     
-    Infers the columns and dtypes from the pandas df.
+    Infers the columns and dtypes from the pandas df. If `commit` is False,
+    the table is created as part of the current transaction.
     """
     try:
         create_table_statement = generate_create_table_statement_from_df(
             df=df, table_name=table_name
         )
         cursor.execute(create_table_statement)
-        conn.commit()
+        if commit:
+            conn.commit()
         print(f"Table {table_name} created successfully.")
     except Exception as e:
         print(f"Unable to create table {table_name}: {e}")
@@ -190,6 +499,10 @@ def create_new_table_from_df(
 
 def check_if_table_exists(table_name: str) -> bool:
     """Checks if a table exists in the database."""
+    if DB_BACKEND == "sqlite":
+        return sqlite_helper.check_if_table_exists(
+            cursor=cursor, table_name=table_name
+        )
     try:
         cursor.execute(
             f"SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name='{table_name}');"
@@ -201,11 +514,20 @@ def check_if_table_exists(table_name: str) -> bool:
         raise
 
 
-def get_all_tables_in_db() -> list[str]:
-    query = """
+def get_all_tables_in_db(include_partitions: bool = True) -> list[str]:
+    """Returns the names of the tables in the database. Partitions of
+    partitioned tables are left out if `include_partitions` is False, e.g.,
+    when their rows are already read through the partitioned table."""
+    if DB_BACKEND == "sqlite":
+        return sqlite_helper.get_all_tables_in_db(cursor=cursor)
+    partitions_filter = "" if include_partitions else """
+        AND table_name NOT IN (SELECT relname FROM pg_class WHERE relispartition)
+    """ # noqa
+    query = f"""
         SELECT table_name
         FROM information_schema.tables
         WHERE table_schema = 'public'
+        {partitions_filter}
     """
     cursor.execute(query)
     table_names = cursor.fetchall()
@@ -214,10 +536,15 @@ def get_all_tables_in_db() -> list[str]:
 
 def get_table_col_to_dtype_map(table_name: str) -> dict:
     """Returns a map of col:dtype for a given Postgres table."""
+    if DB_BACKEND == "sqlite":
+        return sqlite_helper.get_table_col_to_dtype_map(
+            cursor=cursor, table_name=table_name
+        )
     query = f"""
         SELECT column_name, data_type
         FROM information_schema.columns
-        WHERE table_name = '{table_name}';
+        WHERE table_name = '{table_name}'
+        ORDER BY ordinal_position;
     """
     cursor.execute(query)
     column_info = cursor.fetchall()
@@ -228,14 +555,17 @@ def get_table_col_to_dtype_map(table_name: str) -> dict:
 def create_upsert_query_from_df(
     df: pd.DataFrame, table_name: str, upsert_keys: list[str]
 ) -> str:
-    """Creates an upsert query from a dataframe.
+    """Creates an upsert query from a dataframe, for use with
+    `execute_values`.
     
     Upsert keys, more likely than not, should correspond to the primary keys
-    of their respective tables.
+    of their respective tables. Returns `(xmax = 0)` for every row written,
+    which is true for rows that were inserted and false for rows that already
+    existed and were updated.
     """
     upsert_query = f"""
         INSERT INTO {table_name} ({', '.join(df.columns)})
-        VALUES ({', '.join(['%s'] * len(df.columns))})
+        VALUES %s
         ON CONFLICT ({', '.join(upsert_keys)})
         DO UPDATE SET
     """
@@ -245,32 +575,136 @@ def create_upsert_query_from_df(
         if col not in upsert_keys
     ]
     update_fields_string = ', '.join(update_fields)
-    upsert_query += f"{update_fields_string};"
+    upsert_query += f"{update_fields_string}\n        RETURNING (xmax = 0);"
     return upsert_query
 
 
-def convert_complex_fields_to_string(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert complex fields in a DataFrame to
-    JSON strings.
-    
-    Converts to string if any of the values in the series is one ofthese
-    complex values. We can dump as a string and then load as a JSON object.
+def create_insert_query_from_df(df: pd.DataFrame, table_name: str) -> str:
+    """Creates a (non-upsert) insert query from a dataframe, for use with
+    `execute_values`."""
+    return f"""
+        INSERT INTO {table_name} ({', '.join(df.columns)})
+        VALUES %s;
+    """
+
+
+def get_table_write_levels(table_names: list[str]) -> list[list[str]]:
+    """Groups tables into levels, so that every table only references tables
+    in earlier levels, based on the foreign keys in `TABLE_TO_KEYS_MAP`.
+    Tables in the same level don't depend on each other, so they can be
+    written in parallel.
+
+    Only references between the given tables are considered. Tables within a
+    level keep the order that they were given in.
     """
+    table_to_dependencies_map = {
+        table_name: {
+            foreign_key["reference_table"]
+            for foreign_key in (
+                TABLE_TO_KEYS_MAP[table_name]["foreign_keys"]
+                if table_name in TABLE_TO_KEYS_MAP else []
+            )
+            if foreign_key["reference_table"] in table_names
+            and foreign_key["reference_table"] != table_name
+        }
+        for table_name in table_names
+    }
+    ordered_tables: list[str] = []
+    table_levels: list[list[str]] = []
+    while len(ordered_tables) < len(table_names):
+        ready_tables = [
+            table_name for table_name in table_names
+            if table_name not in ordered_tables
+            and table_to_dependencies_map[table_name].issubset(ordered_tables)
+        ]
+        if not ready_tables:
+            raise ValueError(
+                f"Circular foreign keys between tables: {table_names}"
+            )
+        ordered_tables.extend(ready_tables)
+        table_levels.append(ready_tables)
+    return table_levels
+
+
+def get_table_write_order(table_names: list[str]) -> list[str]:
+    """Orders tables so that every table is written after the tables that it
+    references, based on the foreign keys in `TABLE_TO_KEYS_MAP`.
+
+    Only references between the given tables are considered. Tables that
+    don't depend on each other keep the order that they were given in.
+    """
+    return [
+        table_name
+        for table_level in get_table_write_levels(table_names)
+        for table_name in table_level
+    ]
+
+
+def serialize_json_value(value: Any) -> Optional[str]:
+    """Dumps a value as a JSON string, for writing to a JSONB column.
+
+    Nulls stay as nulls, and strings are assumed to already be serialized
+    (e.g., values read back from a .csv dump).
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def series_has_complex_values(series: pd.Series) -> bool:
+    """Checks if a series holds complex (dict/list/tuple) values.
+
+    Only looks at the first non-null value, rather than scanning the whole
+    series. This is a fallback for fields that aren't declared in
+    `TABLE_TO_COLUMN_TYPES_MAP` (e.g., new fields added by the Reddit API).
+    """
+    if series.dtype != np.dtype('O'):
+        return False
+    first_valid_index = series.first_valid_index()
+    if first_valid_index is None:
+        return False
+    return isinstance(series[first_valid_index], (dict, list, tuple))
+
+
+def convert_series_to_utc_timestamps(series: pd.Series) -> pd.Series:
+    """Parses a series (e.g., of ISO strings) as UTC timestamps, for writing
+    to a TIMESTAMPTZ column. Unparseable values and NaTs are set to None."""
+    timestamps = pd.to_datetime(series, utc=True, errors="coerce")
+    return timestamps.astype(object).where(timestamps.notna(), None)
+
+
+def convert_fields_to_table_types(
+    df: pd.DataFrame, table_name: str, table_col_to_dtype_map: dict
+) -> pd.DataFrame:
+    """Converts fields in a dataframe to match the column types of the table.
+
+    Uses the schema of the table (plus the types declared in
+    `TABLE_TO_COLUMN_TYPES_MAP`) to know which columns need converting,
+    instead of scanning the values of every column. JSONB fields are dumped
+    as JSON strings and TIMESTAMPTZ fields are parsed as UTC timestamps.
+    """
+    declared_col_to_sql_type_map = TABLE_TO_COLUMN_TYPES_MAP.get(
+        table_name, {}
+    )
     for col in df.columns:
-        if (
-            df[col].apply(
-                lambda x: (
-                    isinstance(x, dict) or isinstance(x, list)
-                    or isinstance(x, tuple)
-                )
-            ).any()
+        table_dtype = table_col_to_dtype_map.get(col)
+        if table_dtype == "timestamp with time zone":
+            df[col] = convert_series_to_utc_timestamps(df[col])
+        elif (
+            table_dtype == "jsonb"
+            or declared_col_to_sql_type_map.get(col) == "jsonb"
+            or series_has_complex_values(df[col])
         ):
-            df[col] = df[col].apply(json.dumps)
+            df[col] = df[col].map(serialize_json_value)
     return df
 
 
 def process_df_based_on_expected_dtypes(
-    df: pd.DataFrame, table_name: str
+    df: pd.DataFrame,
+    table_name: str,
+    table_col_to_dtype_map: Optional[dict] = None
 ) -> pd.DataFrame:
     """Based on the schema of the table in Postgres, process the dataframe
     accordingly.
@@ -281,7 +715,10 @@ def process_df_based_on_expected_dtypes(
     This function is to help us avoid any DatatypeMismatch problems encountered
     when inserting into Postgres.
     """
-    table_col_to_dtype_map = get_table_col_to_dtype_map(table_name=table_name)
+    if table_col_to_dtype_map is None:
+        table_col_to_dtype_map = get_table_col_to_dtype_map(
+            table_name=table_name
+        )
     for col in df.columns:
         table_dtype = table_col_to_dtype_map[col]
         if table_dtype == "boolean":
@@ -290,16 +727,175 @@ def process_df_based_on_expected_dtypes(
     return df
 
 
+def get_existing_keys(
+    table_name: str, keys: list[str], key_values: list[tuple]
+) -> set[tuple]:
+    """Gets which of `key_values` (tuples of the values of `keys`) are
+    already in a table, looking up only those keys."""
+    if DB_BACKEND == "sqlite":
+        return sqlite_helper.get_existing_keys(
+            cursor=cursor,
+            table_name=table_name,
+            upsert_keys=keys,
+            keys=key_values
+        )
+    key_cols = ", ".join(keys)
+    existing_keys = execute_values(
+        cursor,
+        f"SELECT {key_cols} FROM {table_name} WHERE ({key_cols}) IN (VALUES %s)", # noqa
+        list(set(key_values)),
+        fetch=True
+    )
+    return set(existing_keys)
+
+
+def execute_write_query_from_df(
+    df: pd.DataFrame, table_name: str, upsert: bool = False
+) -> tuple[int, int]:
+    """Writes the rows of a dataframe to a table, without committing.
+
+    Returns a tuple of (number of rows inserted, number of rows updated).
+    """
+    if DB_BACKEND == "sqlite":
+        return sqlite_helper.execute_write_query_from_df(
+            cursor=cursor, df=df, table_name=table_name, upsert=upsert
+        )
+    if upsert:
+        upsert_keys = get_table_upsert_keys(table_name=table_name)
+        # a single multi-row upsert can't touch the same row twice, so keep
+        # only the last version of each row (which is what upserting the rows
+        # one at a time would have left in the table).
+        df = df.drop_duplicates(subset=upsert_keys, keep="last")
+        query = create_upsert_query_from_df(
+            df=df, table_name=table_name, upsert_keys=upsert_keys
+        )
+    else:
+        query = create_insert_query_from_df(df=df, table_name=table_name)
+    rows = [tuple(row) for _, row in df.iterrows()]
+    if not upsert:
+        execute_values(cursor, query, rows)
+        return (len(rows), 0)
+    is_inserted_results = execute_values(cursor, query, rows, fetch=True)
+    num_rows_inserted = sum(
+        1 for (is_inserted,) in is_inserted_results if is_inserted
+    )
+    return (num_rows_inserted, len(is_inserted_results) - num_rows_inserted)
+
+
+TABLE_WRITE_VERSIONS_TABLE_NAME = "table_write_versions"
+create_table_write_versions_table_statement = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE_WRITE_VERSIONS_TABLE_NAME} (
+        table_name text PRIMARY KEY,
+        version bigint NOT NULL
+    );
+"""
+
+
+def bump_table_write_version(
+    table_name: str,
+    write_cursor: Optional[Any] = None,
+    backend: str = DB_BACKEND
+) -> None:
+    """Increments the write version of a table, without committing, so that
+    cached query results on the table are no longer used (see
+    `lib/db/sql/query_cache.py`). Meant to be committed in the same
+    transaction as the write.
+
+    `write_df_to_database` and `write_dfs_to_database` call this themselves.
+    Anything else that writes to a table (raw SQL, COPY, migrations) has to
+    call it, with the cursor that it writes through, before committing.
+    """
+    write_cursor = write_cursor or cursor
+    placeholder = "?" if backend == "sqlite" else "%s"
+    write_cursor.execute(create_table_write_versions_table_statement)
+    write_cursor.execute(
+        f"""
+            INSERT INTO {TABLE_WRITE_VERSIONS_TABLE_NAME} (table_name, version)
+            VALUES ({placeholder}, 1)
+            ON CONFLICT (table_name)
+            DO UPDATE SET version = {TABLE_WRITE_VERSIONS_TABLE_NAME}.version + 1;
+        """, # noqa
+        (table_name,)
+    )
+
+
+def invalidate_cached_queries(table_names: list[str]) -> None:
+    """Bumps (and commits) the write versions of tables that were written to
+    by hand, e.g., from psql, so that their cached queries are no longer
+    used."""
+    try:
+        for table_name in table_names:
+            bump_table_write_version(table_name=table_name)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to invalidate cached queries on {table_names}: {e}")
+        raise
+
+
+def get_tables_underlying_views(table_names: list[str]) -> list[str]:
+    """Returns the given tables, with any views replaced by the tables that
+    they read from, so that writes to those tables are noticed by cached
+    queries on the views."""
+    if DB_BACKEND == "sqlite":
+        return table_names
+    underlying_table_names: set[str] = set()
+    table_names_to_check = set(table_names)
+    while table_names_to_check:
+        cursor.execute(
+            """
+                SELECT view_name, table_name
+                FROM information_schema.view_table_usage
+                WHERE view_name = ANY(%s);
+            """,
+            (list(table_names_to_check),)
+        )
+        view_to_table_names = cursor.fetchall()
+        view_names = {view_name for view_name, _ in view_to_table_names}
+        underlying_table_names.update(table_names_to_check - view_names)
+        table_names_to_check = {
+            table_name for _, table_name in view_to_table_names
+        } - underlying_table_names
+    return sorted(underlying_table_names)
+
+
+def get_table_write_versions(table_names: list[str]) -> dict[str, int]:
+    """Returns the write version of each table. Tables that have never been
+    written through `write_df_to_database` have version 0."""
+    table_to_version_map = {table_name: 0 for table_name in table_names}
+    if not check_if_table_exists(TABLE_WRITE_VERSIONS_TABLE_NAME):
+        return table_to_version_map
+    if DB_BACKEND == "sqlite":
+        placeholders = ', '.join(['?'] * len(table_names))
+        cursor.execute(
+            f"SELECT table_name, version FROM {TABLE_WRITE_VERSIONS_TABLE_NAME} WHERE table_name IN ({placeholders});", # noqa
+            tuple(table_names)
+        )
+    else:
+        cursor.execute(
+            f"SELECT table_name, version FROM {TABLE_WRITE_VERSIONS_TABLE_NAME} WHERE table_name = ANY(%s);", # noqa
+            (table_names,)
+        )
+    for table_name, version in cursor.fetchall():
+        table_to_version_map[table_name] = version
+    return table_to_version_map
+
+
 def write_df_to_database(
     df: pd.DataFrame,
     table_name: str,
     rebuild_table: bool = False,
-    upsert: bool = False
-) -> None:
+    upsert: bool = False,
+    estimate_row_count: bool = False
+) -> WriteResult:
     """Writes a dataframe to a Postgres table.
     
     Assumes that the column names of the dataframe are the same as the column
     match that of the table schema.
+
+    Returns a `WriteResult` with the number of rows inserted/updated. If
+    `estimate_row_count` is set, it also includes the estimated number of
+    rows in the table after the write.
     """
     try:
         # check to see if table exists. If not, create it
@@ -311,40 +907,55 @@ def write_df_to_database(
         if not table_exists:
             print(f"Table {table_name} doesn't exist. Creating now...")
             create_new_table_from_df(df=df, table_name=table_name)
-        df = convert_complex_fields_to_string(df)
-        df = process_df_based_on_expected_dtypes(df=df, table_name=table_name)
+        create_partitions_for_df(df=df, table_name=table_name)
+        table_col_to_dtype_map = get_table_col_to_dtype_map(
+            table_name=table_name
+        )
+        df = convert_fields_to_table_types(
+            df=df,
+            table_name=table_name,
+            table_col_to_dtype_map=table_col_to_dtype_map
+        )
+        df = process_df_based_on_expected_dtypes(
+            df=df,
+            table_name=table_name,
+            table_col_to_dtype_map=table_col_to_dtype_map
+        )
+        write_result = WriteResult(table_name=table_name)
         if upsert and table_exists:
-            row_count_before = get_table_row_count(table_name=table_name)
             print(f"Table {table_name} exists. Upserting {len(df)} rows...")
-            print(f"Row count before upsert: {row_count_before}.")
-            upsert_query = create_upsert_query_from_df(
-                df=df,
-                table_name=table_name,
-                upsert_keys=TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
-            )
-            # cursor.mogrify is faster than cursor.executemany()?
-            # https://www.datacareer.de/blog/improve-your-psycopg2-executions-for-postgresql-in-python/
-            # https://naysan.ca/2020/08/02/pandas-to-postgresql-using-psycopg2-mogrify-then-execute/
-            sql_statements = [
-                cursor.mogrify(upsert_query, tuple(row))
-                for _, row in df.iterrows()
-            ]
-            print(f"Upserting {len(sql_statements)} rows into {table_name}...") # noqa
             try:
-                for statement in sql_statements:
-                    cursor.execute(statement)
+                num_rows_inserted, num_rows_updated = (
+                    execute_write_query_from_df(
+                        df=df, table_name=table_name, upsert=True
+                    )
+                )
+                bump_table_write_version(table_name=table_name)
+                conn.commit()
+                write_result.num_rows_inserted = num_rows_inserted
+                write_result.num_rows_updated = num_rows_updated
+                print(f"Finished upserting {len(df)} rows into {table_name}.") # noqa
             except Exception as e:
+                # the failed upsert aborts the transaction, so nothing was
+                # written and there's nothing to invalidate.
+                conn.rollback()
                 print(f"Unable to execute SQL statement: {e}")
-            print(f"Finished upserting {len(sql_statements)} rows into {table_name}.") # noqa
-            row_count_after = get_table_row_count(table_name=table_name)
-            print(f"Row count after upsert: {row_count_after}.")
+        elif DB_BACKEND == "sqlite":
+            # write through the same connection that created the table,
+            # rather than through a second connection to the same file.
+            print(f"Inserting {len(df)} rows into {table_name}...")
+            write_result.num_rows_inserted, _ = execute_write_query_from_df(
+                df=df, table_name=table_name, upsert=False
+            )
+            bump_table_write_version(table_name=table_name)
             conn.commit()
+            print(f"Finished inserting (not upserting) {len(df)} rows to {table_name}.") # noqa
         else:
-            row_count_before = get_table_row_count(table_name=table_name)
-            print(f"Table {table_name} exists. Inserting {len(df)} rows...")
-            print(f"Row count before insert: {row_count_before}.")
+            print(f"Inserting {len(df)} rows into {table_name}...")
             dtype_mapping = get_sql_cols_for_df_fields(
-                df=df, return_native_sqlalchemy_types=True
+                df=df,
+                return_native_sqlalchemy_types=True,
+                table_name=table_name
             )
             df.to_sql(
                 table_name,
@@ -353,20 +964,130 @@ def write_df_to_database(
                 index=False,
                 dtype=dtype_mapping
             )
+            write_result.num_rows_inserted = len(df)
+            bump_table_write_version(table_name=table_name)
+            conn.commit()
             print(f"Finished inserting (not upserting) {len(df)} rows to {table_name}.") # noqa
-            row_count_after = get_table_row_count(table_name=table_name)
-            print(f"Row count after insert: {row_count_after}.")
+        if estimate_row_count:
+            write_result.estimated_row_count = get_estimated_table_row_count(
+                table_name=table_name
+            )
+        print(f"Write result: {write_result}")
+        return write_result
     except Exception as e:
         conn.rollback()
         print(f"Unable to write df to {table_name}: {e}")
         raise
 
 
-def load_query_as_df(query: str) -> pd.DataFrame:
-    """Loads a query from the database into a dataframe."""
+def write_dfs_to_database(
+    table_to_df_list: list[tuple[str, pd.DataFrame]],
+    upsert: bool = False,
+    estimate_row_count: bool = False
+) -> list[WriteResult]:
+    """Writes several dataframes to their tables in a single transaction.
+
+    Takes a list of (table_name, df) pairs. The tables are written in
+    foreign-key order (see `get_table_write_order`), creating any tables that
+    don't exist yet, and everything is committed once at the end, so either
+    the whole batch is written or none of it is.
+
+    Returns a `WriteResult` for each table, in the order that they were
+    written. Row counts of the tables are only estimated if
+    `estimate_row_count` is set.
+    """
+    table_to_df_map: dict[str, pd.DataFrame] = {}
+    for table_name, df in table_to_df_list:
+        if table_name in table_to_df_map:
+            raise ValueError(f"Table {table_name} is in the batch twice.")
+        table_to_df_map[table_name] = df
+    table_write_order = get_table_write_order(list(table_to_df_map.keys()))
+    print(f"Writing batch to tables (in order): {table_write_order}")
+    write_results: list[WriteResult] = []
     try:
+        for table_name in table_write_order:
+            df = table_to_df_map[table_name]
+            if len(df) == 0:
+                print(f"No rows to write to {table_name}. Skipping...")
+                write_results.append(WriteResult(table_name=table_name))
+                continue
+            table_exists = check_if_table_exists(table_name=table_name)
+            if not table_exists:
+                print(f"Table {table_name} doesn't exist. Creating now...")
+                create_new_table_from_df(
+                    df=df, table_name=table_name, commit=False
+                )
+            create_partitions_for_df(
+                df=df, table_name=table_name, commit=False
+            )
+            table_col_to_dtype_map = get_table_col_to_dtype_map(
+                table_name=table_name
+            )
+            df = convert_fields_to_table_types(
+                df=df,
+                table_name=table_name,
+                table_col_to_dtype_map=table_col_to_dtype_map
+            )
+            df = process_df_based_on_expected_dtypes(
+                df=df,
+                table_name=table_name,
+                table_col_to_dtype_map=table_col_to_dtype_map
+            )
+            print(f"Writing {len(df)} rows into {table_name}...")
+            num_rows_inserted, num_rows_updated = execute_write_query_from_df(
+                df=df, table_name=table_name, upsert=upsert and table_exists
+            )
+            bump_table_write_version(table_name=table_name)
+            write_results.append(
+                WriteResult(
+                    table_name=table_name,
+                    num_rows_inserted=num_rows_inserted,
+                    num_rows_updated=num_rows_updated
+                )
+            )
+        conn.commit()
+        if estimate_row_count:
+            for write_result in write_results:
+                write_result.estimated_row_count = (
+                    get_estimated_table_row_count(
+                        table_name=write_result.table_name
+                    )
+                )
+        print(f"Finished writing batch to tables {table_write_order}.")
+        for write_result in write_results:
+            print(f"Write result: {write_result}")
+        return write_results
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to write batch to tables {table_write_order}: {e}")
+        raise
+
+
+def load_query_as_df(
+    query: str, use_cache: bool = USE_QUERY_CACHE
+) -> pd.DataFrame:
+    """Loads a query from the database into a dataframe.
+
+    If `use_cache` is set, the result is read through the local query cache
+    (see `lib/db/sql/query_cache.py`).
+    """
+    try:
+        if use_cache:
+            table_versions = get_table_write_versions(
+                get_tables_underlying_views(
+                    get_tables_referenced_by_query(query)
+                )
+            )
+            cache_key = query_cache.get_cache_key(
+                query=query, table_versions=table_versions
+            )
+            df = query_cache.get(cache_key)
+            if df is not None:
+                return df
         cursor.execute(query)
         df = pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description]) # noqa
+        if use_cache:
+            query_cache.put(cache_key=cache_key, df=df)
         return df
     except Exception as e:
         print(f"Unable to load query {query}: {e}")
@@ -379,9 +1100,14 @@ def load_table_as_df(
     join_query: str = "",
     where_filter: str = "",
     order_by_clause: str = "",
-    limit_clause: str = ""
+    limit_clause: str = "",
+    use_cache: bool = USE_QUERY_CACHE
 ) -> pd.DataFrame:
-    """Loads a table from the database into a dataframe."""
+    """Loads a table from the database into a dataframe.
+
+    If `use_cache` is set, the result is read through the local query cache
+    (see `lib/db/sql/query_cache.py`).
+    """
     try:
         select_fields_query = ', '.join(select_fields)
         query = f"""
@@ -393,74 +1119,257 @@ def load_table_as_df(
             {order_by_clause}
             {limit_clause};
         """
-        cursor.execute(query)
-        df = pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description]) # noqa
-        return df
+        return load_query_as_df(query=query, use_cache=use_cache)
     except Exception as e:
         print(f"Unable to load table {table_name}: {e}")
         raise
 
 
-def return_statuses_of_user_to_message_status_table() -> None:
-    """Returns a dataframe of statuses of users to message."""
-    status_query = """
-        SELECT
-            message_status,
-            COUNT(*) AS num_users
-        FROM user_to_message_status
-        GROUP BY message_status
-    """
-    num_users_per_phase_query = """
-        SELECT
-            phase,
-            COUNT(*) AS num_users
+USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME = "user_to_message_status_summary"
+USER_TO_MESSAGE_STATUS_SUMMARY_TRIGGER_NAME = "user_to_message_status_summary_trigger" # noqa
+
+# counts of users per (phase, message_status, last_update_step), kept up to
+# date by a trigger on `user_to_message_status`. Every writer that changes a
+# user's status updates the counts in the same transaction, so reading the
+# summary doesn't depend on the size of `user_to_message_status`.
+create_user_to_message_status_summary_statements = [
+    f"""
+        CREATE TABLE IF NOT EXISTS {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME} (
+            phase text,
+            message_status text,
+            last_update_step text,
+            num_users bigint NOT NULL
+        );
+    """,
+    "LOCK TABLE user_to_message_status IN SHARE ROW EXCLUSIVE MODE;",
+    f"TRUNCATE {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME};",
+    f"""
+        INSERT INTO {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}
+        SELECT phase, message_status, last_update_step, COUNT(*)
         FROM user_to_message_status
-        GROUP BY phase
+        GROUP BY 1, 2, 3;
+    """,
+    f"""
+        CREATE OR REPLACE FUNCTION update_user_to_message_status_summary()
+        RETURNS trigger AS $$
+        BEGIN
+            IF (
+                TG_OP = 'UPDATE'
+                AND (OLD.phase, OLD.message_status, OLD.last_update_step)
+                IS NOT DISTINCT FROM
+                (NEW.phase, NEW.message_status, NEW.last_update_step)
+            ) THEN
+                RETURN NULL;
+            END IF;
+            IF (TG_OP = 'UPDATE' OR TG_OP = 'DELETE') THEN
+                UPDATE {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}
+                SET num_users = num_users - 1
+                WHERE phase IS NOT DISTINCT FROM OLD.phase
+                AND message_status IS NOT DISTINCT FROM OLD.message_status
+                AND last_update_step IS NOT DISTINCT FROM OLD.last_update_step;
+            END IF;
+            IF (TG_OP = 'UPDATE' OR TG_OP = 'INSERT') THEN
+                UPDATE {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}
+                SET num_users = num_users + 1
+                WHERE phase IS NOT DISTINCT FROM NEW.phase
+                AND message_status IS NOT DISTINCT FROM NEW.message_status
+                AND last_update_step IS NOT DISTINCT FROM NEW.last_update_step;
+                IF NOT FOUND THEN
+                    INSERT INTO {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}
+                    VALUES (
+                        NEW.phase, NEW.message_status, NEW.last_update_step, 1
+                    );
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """,
+    f"""
+        DROP TRIGGER IF EXISTS {USER_TO_MESSAGE_STATUS_SUMMARY_TRIGGER_NAME}
+        ON user_to_message_status;
+    """,
+    f"""
+        CREATE TRIGGER {USER_TO_MESSAGE_STATUS_SUMMARY_TRIGGER_NAME}
+        AFTER INSERT OR UPDATE OR DELETE ON user_to_message_status
+        FOR EACH ROW EXECUTE FUNCTION update_user_to_message_status_summary();
     """
-    num_users_per_last_update_step = """
-        SELECT
-            last_update_step,
-            COUNT(*) AS num_users
-        FROM user_to_message_status
-        GROUP BY last_update_step
+]
+
+# all five breakdowns of the summary in one pass. The GROUPING() bitmask
+# identifies which grouping set each row belongs to (a bit is set for each
+# column that was aggregated away: phase=4, message_status=2,
+# last_update_step=1).
+user_to_message_status_summary_query = f"""
+    SELECT
+        GROUPING(phase, message_status, last_update_step) AS grouping_set,
+        phase,
+        message_status,
+        last_update_step,
+        SUM(num_users) AS num_users
+    FROM {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}
+    WHERE num_users > 0
+    GROUP BY GROUPING SETS (
+        (message_status),
+        (phase),
+        (last_update_step),
+        (phase, message_status),
+        (phase, message_status, last_update_step)
+    )
+"""
+
+
+def check_if_user_to_message_status_summary_trigger_exists() -> bool:
+    cursor.execute(
+        "SELECT EXISTS (SELECT FROM pg_trigger WHERE tgname = %s);",
+        (USER_TO_MESSAGE_STATUS_SUMMARY_TRIGGER_NAME,)
+    )
+    return cursor.fetchone()[0]
+
+
+def create_user_to_message_status_summary() -> None:
+    """Creates (or rebuilds) the summary table of `user_to_message_status`,
+    backfills it, and adds the trigger that keeps it up to date.
+
+    This is the only time that `user_to_message_status` is scanned. It's
+    rerun automatically if the trigger is missing (e.g., if the table was
+    rebuilt).
     """
-    num_users_messaged_per_phase = """
-        SELECT
-            phase,
-            COUNT(*) AS num_users_messaged
-        FROM user_to_message_status
-        WHERE message_status = 'messaged_successfully'
-        GROUP BY phase
+    try:
+        print(f"Building {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}...")
+        for statement in create_user_to_message_status_summary_statements:
+            cursor.execute(statement)
+        conn.commit()
+        print(f"Finished building {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}.") # noqa
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to build {USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME}: {e}") # noqa
+        raise
+
+
+class UserToMessageStatusSummary:
+    """Number of users in `user_to_message_status`, broken down by status,
+    phase, and last update step."""
+
+    def __init__(self, summary_df: pd.DataFrame) -> None:
+        def to_counts_map(grouping_set: int, cols: list[str]) -> dict:
+            df = summary_df[summary_df["grouping_set"] == grouping_set]
+            return {
+                (row[cols[0]] if len(cols) == 1 else tuple(row[cols])): (
+                    int(row["num_users"])
+                )
+                for _, row in df.iterrows()
+            }
+
+        self.num_users_per_message_status: dict = to_counts_map(
+            5, ["message_status"]
+        )
+        self.num_users_per_phase: dict = to_counts_map(3, ["phase"])
+        self.num_users_per_last_update_step: dict = to_counts_map(
+            6, ["last_update_step"]
+        )
+        num_users_per_phase_and_status: dict = to_counts_map(
+            1, ["phase", "message_status"]
+        )
+        self.num_users_messaged_per_phase: dict = {
+            phase: num_users
+            for (phase, message_status), num_users
+            in num_users_per_phase_and_status.items()
+            if message_status == "messaged_successfully"
+        }
+        # observers only count once they've been matched to a comment.
+        self.num_users_per_status_per_phase: dict = {}
+        num_users_per_phase_status_and_step = to_counts_map(
+            0, ["phase", "message_status", "last_update_step"]
+        )
+        for (phase, message_status, last_update_step), num_users in (
+            num_users_per_phase_status_and_step.items()
+        ):
+            if phase == "author" or (
+                phase == "observer"
+                and last_update_step in [
+                    "match_observers_to_comments", "message_users"
+                ]
+            ):
+                key = (phase, message_status)
+                self.num_users_per_status_per_phase[key] = (
+                    self.num_users_per_status_per_phase.get(key, 0)
+                    + num_users
+                )
+
+    def to_dict(self) -> dict:
+        """Converts object and its attributes to a dict."""
+        return {attr: getattr(self, attr) for attr in self.__dict__}
+
+
+def compute_user_to_message_status_grouping_sets(
+    counts_df: pd.DataFrame
+) -> pd.DataFrame:
+    """Computes the same grouping sets as
+    `user_to_message_status_summary_query`, from a df of counts per (phase,
+    message_status, last_update_step). Used for backends without GROUPING
+    SETS (i.e., SQLite)."""
+    cols = ["phase", "message_status", "last_update_step"]
+    grouping_set_to_cols_map = {
+        5: ["message_status"],
+        3: ["phase"],
+        6: ["last_update_step"],
+        1: ["phase", "message_status"],
+        0: cols
+    }
+    grouping_set_dfs = []
+    for grouping_set, grouping_cols in grouping_set_to_cols_map.items():
+        grouping_set_df = counts_df.groupby(
+            grouping_cols, dropna=False, as_index=False
+        )["num_users"].sum()
+        grouping_set_df["grouping_set"] = grouping_set
+        grouping_set_dfs.append(grouping_set_df)
+    return pd.concat(grouping_set_dfs, ignore_index=True)
+
+
+def get_user_to_message_status_summary() -> UserToMessageStatusSummary:
+    """Returns the summary of users per status/phase/step, building the
+    summary table first if it doesn't exist yet.
+
+    SQLite has no triggers in plpgsql or GROUPING SETS, so for that backend we
+    count the (local) table directly instead.
+
+    The summary is never read through the query cache: the summary table is
+    kept up to date by a trigger rather than by `write_df_to_database`, so its
+    write version is never bumped and cached summaries would go stale.
     """
-    num_users_per_status_per_phase = """
-        SELECT
-            phase,
-            message_status,
-            COUNT(*) as num_users
-        FROM user_to_message_status
-        WHERE (
-            phase = 'author'
-            OR (
-                phase = 'observer'
-                AND last_update_step IN ('match_observers_to_comments', 'message_users')
-            )
+    if DB_BACKEND == "sqlite":
+        counts_df = load_query_as_df(query="""
+            SELECT
+                phase,
+                message_status,
+                last_update_step,
+                COUNT(*) AS num_users
+            FROM user_to_message_status
+            GROUP BY 1, 2, 3
+        """, use_cache=False)
+        return UserToMessageStatusSummary(
+            summary_df=compute_user_to_message_status_grouping_sets(counts_df)
         )
-        GROUP BY 1, 2
-    """ # noqa
-    status_df = load_query_as_df(query=status_query)
-    phase_df = load_query_as_df(query=num_users_per_phase_query)
-    last_update_step_df = load_query_as_df(query=num_users_per_last_update_step) # noqa
-    users_messaged_per_phase_df = load_query_as_df(
-        query=num_users_messaged_per_phase
+    if not (
+        check_if_table_exists(USER_TO_MESSAGE_STATUS_SUMMARY_TABLE_NAME)
+        and check_if_user_to_message_status_summary_trigger_exists()
+    ):
+        create_user_to_message_status_summary()
+    summary_df = load_query_as_df(
+        query=user_to_message_status_summary_query, use_cache=False
     )
-    users_per_status_per_phase = load_query_as_df(
-        query=num_users_per_status_per_phase
-    )
-    print(f"After update, the number of users per message status is::\n{status_df}") # noqa
-    print(f"After update, the number of users per phase is:\n{phase_df}")
-    print(f"After update, the number of users per last update step is:\n{last_update_step_df}") # noqa
-    print(f"After update, the number of users messaged per phase is:\n{users_messaged_per_phase_df}") # noqa
-    print(f"After update, the number of users per status per phase is:\n{users_per_status_per_phase}") # noqa
+    return UserToMessageStatusSummary(summary_df=summary_df)
+
+
+def return_statuses_of_user_to_message_status_table() -> None:
+    """Prints the number of users per status of users to message."""
+    summary = get_user_to_message_status_summary()
+    print(f"After update, the number of users per message status is:\n{pd.Series(summary.num_users_per_message_status, dtype=int)}") # noqa
+    print(f"After update, the number of users per phase is:\n{pd.Series(summary.num_users_per_phase, dtype=int)}") # noqa
+    print(f"After update, the number of users per last update step is:\n{pd.Series(summary.num_users_per_last_update_step, dtype=int)}") # noqa
+    print(f"After update, the number of users messaged per phase is:\n{pd.Series(summary.num_users_messaged_per_phase, dtype=int)}") # noqa
+    print(f"After update, the number of users per status per phase is:\n{pd.Series(summary.num_users_per_status_per_phase, dtype=int)}") # noqa
 
 
 if __name__ == "__main__":
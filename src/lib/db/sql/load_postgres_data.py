@@ -1,34 +1,106 @@
 """Loads the backup data into a Postgres table.
 
-By default, takes the latest snapshot.
+By default, takes the latest snapshot. If the snapshot is incremental (see
+`backup_postgres_data.py`), the snapshots that it builds on are loaded first.
+
+Tables are loaded in foreign-key order (see `get_table_write_levels`), with
+the tables that don't depend on each other loaded in parallel, each through
+its own connection. Each file is streamed into Postgres with
+`COPY ... FROM STDIN`.
+
+Tables that are empty before the load are loaded without their indexes and
+constraints, which are recreated once all of the data is loaded. Tables that
+already have rows are copied into a staging table and then upserted, so that
+existing rows are updated rather than duplicated.
+
+Snapshots from before `backup_postgres_data.py` wrote manifests were dumped
+through pandas (e.g., with integers written as floats), so they can't be
+copied as-is. They're loaded through `write_df_to_database` instead, one
+table at a time.
 """
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+from typing import IO, Optional
 
 import pandas as pd
+import psycopg2
 
+from lib.db.sql.backup_postgres_data import (
+    MANIFEST_FILENAME, Compression, format_to_copy_options, get_file_checksum,
+    open_compressed_file, snapshots_dir
+)
 from lib.db.sql.helper import (
-    current_file_directory as sql_helper_dir,
-    write_df_to_database
+    DB_PARAMS, bump_table_write_version, check_if_table_exists, check_if_table_is_partitioned, conn,
+    create_partitions_for_months, cursor, generate_create_partition_statement,
+    generate_create_table_statement, get_table_upsert_keys,
+    create_table_write_versions_table_statement, get_table_write_levels,
+    get_table_write_order, write_df_to_database
 )
-from lib.db.sql.tables import TABLE_TO_KEYS_MAP
+from lib.db.sql.tables import TABLE_TO_KEYS_MAP, TABLE_TO_PARTITION_KEY_MAP
 
-snapshots_dir = os.path.join(sql_helper_dir, "snapshots")
+DEFAULT_MAX_WORKERS = 4
 
 
 def get_latest_snapshot() -> str:
     return max(os.listdir(snapshots_dir))
 
 
-def get_compressed_files_to_load(latest_snapshot_timestamp: str) -> list[str]:
-    full_dir_path = os.path.join(
-        snapshots_dir, latest_snapshot_timestamp
-    )
-    full_filepaths = [
-        os.path.join(full_dir_path, file)
-        for file in os.listdir(full_dir_path)
-        if file.endswith(".csv.gz")
-    ]
-    return full_filepaths
+def load_snapshot_manifest(snapshot: str) -> dict:
+    """Loads the manifest of a snapshot. Snapshots from before manifests were
+    written get one that lists their gzipped CSV files."""
+    full_dir_path = os.path.join(snapshots_dir, snapshot)
+    manifest_fp = os.path.join(full_dir_path, MANIFEST_FILENAME)
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {
+        "snapshot": snapshot,
+        "legacy": True,
+        "type": "full",
+        "base_snapshot": None,
+        "format": "csv",
+        "compression": "gzip",
+        "tables": {
+            file.split(".")[0]: {"file": file}
+            for file in os.listdir(full_dir_path)
+            if file.endswith(".csv.gz")
+        }
+    }
+
+
+def get_snapshot_chain(snapshot: str) -> list[dict]:
+    """Returns the manifests of a snapshot and of the snapshots that it builds
+    on, oldest first."""
+    manifests: list[dict] = []
+    while snapshot:
+        manifest = load_snapshot_manifest(snapshot)
+        manifests.insert(0, manifest)
+        snapshot = manifest["base_snapshot"]
+    return manifests
+
+
+def load_snapshot_schemas(snapshot: str) -> dict[str, dict]:
+    """Returns the col:dtype map of each table in a snapshot."""
+    schemas_fp = os.path.join(snapshots_dir, snapshot, "schemas.jsonl")
+    table_to_schema_map: dict[str, dict] = {}
+    if not os.path.exists(schemas_fp):
+        return table_to_schema_map
+    with open(schemas_fp, "r", encoding="utf-8") as f:
+        for line in f:
+            table_to_schema_map.update(json.loads(line))
+    return table_to_schema_map
+
+
+def verify_snapshot_file(snapshot: str, table_manifest: dict) -> str:
+    """Returns the path to a table's file, after checking it against the
+    checksum in the manifest (if there is one)."""
+    file_path = os.path.join(snapshots_dir, snapshot, table_manifest["file"])
+    expected_checksum = table_manifest.get("sha256")
+    if expected_checksum and get_file_checksum(file_path) != expected_checksum:
+        raise ValueError(f"Checksum of {file_path} doesn't match manifest.")
+    return file_path
 
 
 def load_single_data_dump(table_name: str, file_path: str) -> None:
@@ -43,29 +115,334 @@ def load_single_data_dump(table_name: str, file_path: str) -> None:
         raise e
 
 
-def load_dumps_into_db(compressed_files: list[str]) -> None:
-    # creating a map like this is necessary so that the tables are all build
-    # in the correct order. Otherwise, we will try to create tables that
-    # reference other tables before those other tables exist.
-    table_name_to_filepath_map = {
-        os.path.basename(file_path).split(".")[0]: file_path
-        for file_path in compressed_files
+def get_csv_header_columns(file_path: str, compression: Compression) -> list[str]: # noqa
+    """Returns the columns in the header of a .csv file, which are in the
+    order that they were dumped in (which can differ from the table's)."""
+    with open_compressed_file(
+        file_path, compression=compression, binary=False, mode="r"
+    ) as f:
+        return f.readline().strip().split(",")
+
+
+def check_if_table_is_empty(table_name: str) -> bool:
+    cursor.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {table_name});")
+    return cursor.fetchone()[0]
+
+
+def create_missing_tables(
+    table_names: list[str], table_to_schema_map: dict[str, dict]
+) -> None:
+    """Creates (in foreign-key order) the tables that don't exist yet, using
+    their schemas from the snapshot."""
+    for table_level in get_table_write_levels(table_names):
+        for table_name in table_level:
+            if check_if_table_exists(table_name):
+                continue
+            print(f"Table {table_name} doesn't exist. Creating now...")
+            cursor.execute(generate_create_table_statement(
+                table_name=table_name,
+                field_to_sql_type_map=table_to_schema_map[table_name]
+            ))
+            if check_if_table_is_partitioned(table_name):
+                create_partitions_for_months(
+                    table_name=table_name, month_starts=[], commit=False
+                )
+    conn.commit()
+
+
+def drop_indexes_and_constraints(table_names: list[str]) -> list[str]:
+    """Drops the indexes and constraints of tables (and the foreign keys that
+    reference them), without committing.
+
+    Returns the statements that recreate them, in the order that they should
+    be run: primary keys and unique constraints, then other indexes, then
+    foreign keys.
+    """
+    cursor.execute(
+        """
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE contype = 'f'
+            AND conparentid = 0
+            AND (
+                conrelid::regclass::text = ANY(%(table_names)s)
+                OR confrelid::regclass::text = ANY(%(table_names)s)
+            );
+        """,
+        {"table_names": table_names}
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        """
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE contype IN ('p', 'u')
+            AND conparentid = 0
+            AND conrelid::regclass::text = ANY(%(table_names)s);
+        """,
+        {"table_names": table_names}
+    )
+    key_constraints = cursor.fetchall()
+    cursor.execute(
+        """
+            SELECT indexname, indexdef
+            FROM pg_indexes
+            WHERE schemaname = 'public'
+            AND tablename = ANY(%(table_names)s)
+            AND indexname NOT IN (
+                SELECT conname FROM pg_constraint WHERE contype IN ('p', 'u')
+            );
+        """,
+        {"table_names": table_names}
+    )
+    indexes = cursor.fetchall()
+    for table_name, constraint_name, _ in foreign_keys + key_constraints:
+        cursor.execute(
+            f"ALTER TABLE {table_name} DROP CONSTRAINT {constraint_name};"
+        )
+    for index_name, _ in indexes:
+        cursor.execute(f"DROP INDEX {index_name};")
+    return (
+        [
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} {constraint_def};" # noqa
+            for table_name, constraint_name, constraint_def in key_constraints
+        ]
+        + [f"{index_def};" for _, index_def in indexes]
+        + [
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} {constraint_def};" # noqa
+            for table_name, constraint_name, constraint_def in foreign_keys
+        ]
+    )
+
+
+def copy_file_into_table(
+    copy_cursor: psycopg2.extensions.cursor,
+    table_name: str,
+    file_path: str,
+    format: str,
+    compression: Compression,
+    columns: list[str]
+) -> int:
+    """Streams a snapshot file into a table with `COPY ... FROM STDIN`.
+    Returns the number of rows copied."""
+    f: IO
+    with open_compressed_file(
+        file_path, compression=compression, binary=True, mode="r"
+    ) as f:
+        copy_cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN {format_to_copy_options[format]}", # noqa
+            f
+        )
+    return copy_cursor.rowcount
+
+
+def restore_table(
+    table_name: str,
+    file_path: str,
+    format: str,
+    compression: Compression,
+    columns: list[str],
+    upsert_keys: Optional[list[str]] = None,
+    partition_key: Optional[str] = None
+) -> int:
+    """Loads a snapshot file into a table, through its own connection.
+
+    Rows are copied straight into the table, unless the table needs to be
+    upserted into (on `upsert_keys`), or is partitioned (so that the
+    partitions for its rows can be created before they're inserted). Then,
+    they're copied into a staging table first.
+
+    Returns the number of rows loaded.
+    """
+    restore_conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with restore_conn.cursor() as restore_cursor:
+            if not upsert_keys and not partition_key:
+                row_count = copy_file_into_table(
+                    copy_cursor=restore_cursor,
+                    table_name=table_name,
+                    file_path=file_path,
+                    format=format,
+                    compression=compression,
+                    columns=columns
+                )
+                bump_table_write_version(
+                    table_name=table_name, write_cursor=restore_cursor
+                )
+                restore_conn.commit()
+                return row_count
+            staging_table_name = f"{table_name}_staging"
+            restore_cursor.execute(f"""
+                CREATE TEMP TABLE {staging_table_name}
+                (LIKE {table_name}) ON COMMIT DROP;
+            """)
+            row_count = copy_file_into_table(
+                copy_cursor=restore_cursor,
+                table_name=staging_table_name,
+                file_path=file_path,
+                format=format,
+                compression=compression,
+                columns=columns
+            )
+            if partition_key:
+                restore_cursor.execute(f"""
+                    SELECT DISTINCT EXTRACT(EPOCH FROM date_trunc('month', to_timestamp({partition_key}) AT TIME ZONE 'UTC'))
+                    FROM {staging_table_name}
+                    WHERE {partition_key} IS NOT NULL;
+                """) # noqa
+                for (month_start_epoch,) in restore_cursor.fetchall():
+                    restore_cursor.execute(generate_create_partition_statement(
+                        table_name=table_name,
+                        month_start=pd.Timestamp(
+                            float(month_start_epoch), unit="s", tz="UTC"
+                        )
+                    ))
+            update_fields = [
+                f"{col} = EXCLUDED.{col}"
+                for col in columns if col not in (upsert_keys or [])
+            ]
+            conflict_clause = f"""
+                ON CONFLICT ({', '.join(upsert_keys)})
+                DO {'UPDATE SET ' + ', '.join(update_fields) if update_fields else 'NOTHING'}
+            """ if upsert_keys else "" # noqa
+            restore_cursor.execute(f"""
+                INSERT INTO {table_name} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM {staging_table_name}
+                {conflict_clause};
+            """)
+            bump_table_write_version(
+                table_name=table_name, write_cursor=restore_cursor
+            )
+        restore_conn.commit()
+        return row_count
+    except Exception as e:
+        restore_conn.rollback()
+        print(f"Unable to load {file_path} into {table_name}, with error {e}.")
+        raise
+    finally:
+        restore_conn.close()
+
+
+def restore_snapshot(
+    manifest: dict,
+    table_to_schema_map: dict[str, dict],
+    max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
+    """Loads one snapshot into the database."""
+    snapshot = manifest["snapshot"]
+    # only the tables that we manage are loaded; other tables in the snapshot
+    # (e.g., views or summary tables) are derived from them.
+    table_names = [
+        table_name for table_name in TABLE_TO_KEYS_MAP.keys()
+        if table_name in manifest["tables"]
+    ]
+    print(f"Loading {manifest['type']} snapshot {snapshot} into tables {table_names}...") # noqa
+    if manifest.get("legacy"):
+        for table_name in get_table_write_order(table_names):
+            load_single_data_dump(
+                table_name=table_name,
+                file_path=os.path.join(
+                    snapshots_dir, snapshot,
+                    manifest["tables"][table_name]["file"]
+                )
+            )
+        return
+    table_to_file_path_map = {
+        table_name: verify_snapshot_file(
+            snapshot=snapshot, table_manifest=manifest["tables"][table_name]
+        )
+        for table_name in table_names
     }
-    table_to_filepath_map = {
-        table: table_name_to_filepath_map[table]
-        for table in TABLE_TO_KEYS_MAP.keys()
+    create_missing_tables(
+        table_names=table_names, table_to_schema_map=table_to_schema_map
+    )
+    empty_tables = [
+        table_name for table_name in table_names
+        if check_if_table_is_empty(table_name)
+    ]
+    # workers have their own connections, so anything that they need from
+    # the database is looked up beforehand.
+    table_to_columns_map = {
+        table_name: (
+            get_csv_header_columns(
+                file_path=table_to_file_path_map[table_name],
+                compression=manifest["compression"]
+            )
+            if manifest["format"] == "csv"
+            else list(table_to_schema_map[table_name])
+        )
+        for table_name in table_names
     }
-    for table_name, file_path in table_to_filepath_map.items():
-        load_single_data_dump(table_name=table_name, file_path=file_path)
-
+    table_to_partition_key_map = {
+        table_name: TABLE_TO_PARTITION_KEY_MAP[table_name]
+        for table_name in table_names
+        if table_name in TABLE_TO_PARTITION_KEY_MAP
+        and check_if_table_is_partitioned(table_name)
+    }
+    recreate_statements = drop_indexes_and_constraints(empty_tables)
+    # created up front, so that the workers (which bump the write version of
+    # each table that they load) don't race to create it.
+    cursor.execute(create_table_write_versions_table_statement)
+    conn.commit()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for table_level in get_table_write_levels(table_names):
+                table_to_future_map = {
+                    table_name: executor.submit(
+                        restore_table,
+                        table_name=table_name,
+                        file_path=table_to_file_path_map[table_name],
+                        format=manifest["format"],
+                        compression=manifest["compression"],
+                        columns=table_to_columns_map[table_name],
+                        upsert_keys=(
+                            None if table_name in empty_tables
+                            else get_table_upsert_keys(table_name)
+                        ),
+                        partition_key=table_to_partition_key_map.get(
+                            table_name
+                        )
+                    )
+                    for table_name in table_level
+                }
+                for table_name, future in table_to_future_map.items():
+                    print(f"Loaded {future.result()} rows into {table_name}.")
+    except Exception:
+        # recreating them over partially loaded tables would either fail
+        # (hiding the original error) or enforce them on partial data.
+        print(f"Unable to load snapshot {snapshot}. Not recreating the dropped indexes and constraints, which are:") # noqa
+        for statement in recreate_statements:
+            print(statement)
+        raise
+    print(f"Recreating {len(recreate_statements)} indexes and constraints...")
+    for statement in recreate_statements:
+        cursor.execute(statement)
+    conn.commit()
+    print(f"Finished loading snapshot {snapshot}.")
 
 
-def main() -> None:
-    latest_snapshot = get_latest_snapshot()
-    compressed_files = get_compressed_files_to_load(latest_snapshot)
-    load_dumps_into_db(compressed_files)
-    print(f"Finished loading data from {latest_snapshot} into the database.")
+def main(
+    snapshot: Optional[str] = None, max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
+    snapshot = snapshot or get_latest_snapshot()
+    for manifest in get_snapshot_chain(snapshot):
+        restore_snapshot(
+            manifest=manifest,
+            table_to_schema_map=load_snapshot_schemas(manifest["snapshot"]),
+            max_workers=max_workers
+        )
+    print(f"Finished loading data from {snapshot} into the database.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Restore a DB snapshot.")
+    parser.add_argument(
+        "--snapshot", default=None,
+        help="Snapshot to restore. Defaults to the latest snapshot."
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+        help="Max number of tables to load in parallel."
+    )
+    args = parser.parse_args()
+    main(snapshot=args.snapshot, max_workers=args.max_workers)
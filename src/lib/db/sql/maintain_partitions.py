@@ -0,0 +1,116 @@
+"""Maintains the monthly partitions of the partitioned tables.
+
+Creates partitions for the current month and the upcoming months, so that
+new rows never land in the default partition (which catches rows in months
+that don't have a partition; the partition key itself is part of the primary
+key, so it's never NULL), and optionally detaches
+partitions that are older than a given number of months. Detached partitions
+are left in the database as standalone tables, so that they can be archived
+(e.g., with `pg_dump -t <partition>`) and then dropped.
+
+Meant to be run on a schedule, e.g., before each sync.
+"""
+import argparse
+from typing import Optional
+
+import pandas as pd
+
+from lib.db.sql.helper import (
+    bump_table_write_version, check_if_table_is_partitioned, conn,
+    create_partitions_for_months, cursor, get_existing_partitions,
+    get_partition_name
+)
+from lib.db.sql.tables import TABLE_TO_PARTITION_KEY_MAP
+
+DEFAULT_NUM_MONTHS_AHEAD = 3
+
+
+def get_current_month_start() -> pd.Timestamp:
+    return pd.Timestamp.now(tz="UTC").normalize().replace(day=1)
+
+
+def create_upcoming_partitions(
+    table_name: str, num_months_ahead: int = DEFAULT_NUM_MONTHS_AHEAD
+) -> list[str]:
+    """Creates the partitions for the current month and the next
+    `num_months_ahead` months, if they don't exist yet."""
+    current_month_start = get_current_month_start()
+    month_starts = [
+        current_month_start + pd.offsets.MonthBegin(num_months)
+        for num_months in range(num_months_ahead + 1)
+    ]
+    return create_partitions_for_months(
+        table_name=table_name, month_starts=month_starts
+    )
+
+
+def detach_old_partitions(table_name: str, num_months_to_keep: int) -> list[str]:
+    """Detaches the monthly partitions that are older than
+    `num_months_to_keep` months. Returns the names of the detached
+    partitions."""
+    oldest_month_to_keep = (
+        get_current_month_start() - pd.offsets.MonthBegin(num_months_to_keep)
+    )
+    oldest_partition_to_keep = get_partition_name(
+        table_name=table_name, month_start=oldest_month_to_keep
+    )
+    default_partition_name = f"{table_name}_default"
+    # partition names end in _YYYY_MM, so they sort chronologically.
+    old_partitions = sorted(
+        partition for partition in get_existing_partitions(table_name)
+        if partition != default_partition_name
+        and partition < oldest_partition_to_keep
+    )
+    try:
+        for partition in old_partitions:
+            cursor.execute(
+                f"ALTER TABLE {table_name} DETACH PARTITION {partition};"
+            )
+        if old_partitions:
+            # the detached rows are no longer in the table.
+            bump_table_write_version(table_name=table_name)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to detach partitions of {table_name}: {e}")
+        raise
+    if old_partitions:
+        print(f"Detached partitions {old_partitions} of {table_name}.")
+    return old_partitions
+
+
+def main(
+    num_months_ahead: int = DEFAULT_NUM_MONTHS_AHEAD,
+    detach_older_than_months: Optional[int] = None
+) -> None:
+    for table_name in TABLE_TO_PARTITION_KEY_MAP.keys():
+        if not check_if_table_is_partitioned(table_name):
+            print(f"Table {table_name} isn't partitioned. Skipping...")
+            continue
+        create_upcoming_partitions(
+            table_name=table_name, num_months_ahead=num_months_ahead
+        )
+        if detach_older_than_months is not None:
+            detach_old_partitions(
+                table_name=table_name,
+                num_months_to_keep=detach_older_than_months
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create upcoming partitions and detach old partitions."
+    )
+    parser.add_argument(
+        "--num-months-ahead", type=int, default=DEFAULT_NUM_MONTHS_AHEAD,
+        help="Number of months ahead to create partitions for."
+    )
+    parser.add_argument(
+        "--detach-older-than-months", type=int, default=None,
+        help="If set, detach partitions older than this many months."
+    )
+    args = parser.parse_args()
+    main(
+        num_months_ahead=args.num_months_ahead,
+        detach_older_than_months=args.detach_older_than_months
+    )
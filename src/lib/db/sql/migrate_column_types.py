@@ -0,0 +1,75 @@
+"""One-time migration of existing tables to native column types.
+
+Converts the columns declared in `TABLE_TO_COLUMN_TYPES_MAP` from `text` to
+`jsonb` or `timestamptz`, and adds an index on each timestamp column so that
+time-range filters don't need to scan the whole table. Columns that already
+have the declared type are skipped, so this is safe to re-run.
+"""
+from lib.db.sql.helper import (
+    bump_table_write_version, check_if_table_exists, conn, cursor,
+    get_table_col_to_dtype_map
+)
+from lib.db.sql.tables import TABLE_TO_COLUMN_TYPES_MAP
+
+# how the existing `text` values are cast to the native type. Previous writes
+# serialized missing JSON values as 'NaN' and timestamps were written as
+# timezone-naive UTC ISO strings.
+sql_type_to_cast_expression = {
+    "jsonb": "NULLIF(NULLIF({col}, ''), 'NaN')::jsonb",
+    "timestamptz": "NULLIF({col}, '')::timestamp AT TIME ZONE 'UTC'"
+}
+
+sql_type_to_information_schema_type = {
+    "jsonb": "jsonb",
+    "timestamptz": "timestamp with time zone"
+}
+
+
+def migrate_column_type(table_name: str, col: str, sql_type: str) -> None:
+    """Converts a single column to its native type."""
+    cast_expression = sql_type_to_cast_expression[sql_type].format(col=col)
+    print(f"Converting {table_name}.{col} to {sql_type}...")
+    cursor.execute(f"""
+        ALTER TABLE {table_name}
+        ALTER COLUMN {col} TYPE {sql_type}
+        USING {cast_expression};
+    """)
+    if sql_type == "timestamptz":
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table_name}_{col}_idx "
+            f"ON {table_name} ({col});"
+        )
+
+
+def migrate_table_column_types(table_name: str) -> None:
+    """Converts the declared columns of a table to their native types."""
+    if not check_if_table_exists(table_name):
+        print(f"Table {table_name} doesn't exist. Skipping...")
+        return
+    table_col_to_dtype_map = get_table_col_to_dtype_map(table_name)
+    try:
+        for col, sql_type in TABLE_TO_COLUMN_TYPES_MAP[table_name].items():
+            if col not in table_col_to_dtype_map:
+                continue
+            if (
+                table_col_to_dtype_map[col]
+                == sql_type_to_information_schema_type[sql_type]
+            ):
+                print(f"{table_name}.{col} is already {sql_type}. Skipping...")
+                continue
+            migrate_column_type(
+                table_name=table_name, col=col, sql_type=sql_type
+            )
+        # cached query results have the old types.
+        bump_table_write_version(table_name=table_name)
+        conn.commit()
+        print(f"Finished migrating column types for table {table_name}.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to migrate column types for table {table_name}: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    for table_name in TABLE_TO_COLUMN_TYPES_MAP.keys():
+        migrate_table_column_types(table_name=table_name)
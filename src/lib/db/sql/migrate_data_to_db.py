@@ -1,29 +1,315 @@
-"""Migrate existing .csv data to DB"""
+"""Migrate existing .csv data to DB.
+
+The .csv files of a table are streamed in chunks and upserted, so memory use
+doesn't grow with the number of files. The files are overlapping snapshots,
+so rows are deduped on the table's primary keys: files are read newest first,
+and only the first (i.e., latest) version of each row is written. The keys
+that have been written are kept as sorted 64-bit hashes, rather than as the
+keys themselves. Since two keys can have the same hash, rows whose hash has
+been seen are only skipped once their key is found in the table.
+
+Each chunk is typed on its own, so a column that's empty in the first chunk
+would be read as float64. Instead, the dtype of each column is first inferred
+across every file, the table is created from those dtypes (if it doesn't exist), and
+every chunk is cast to them before it's written.
+
+Progress is saved after each file, so an interrupted migration picks up from
+the first file that it didn't finish.
+"""
+from functools import partial
+import json
 import os
+import time
+from typing import Callable, Optional
 
+import numpy as np
 import pandas as pd
 
 from data.helper import DATA_DIR
-from lib.db.sql.helper import write_df_to_database
+from lib.db.sql.helper import (
+    check_if_table_exists, create_new_table_from_df, current_file_directory,
+    drop_table, get_existing_keys, write_df_to_database
+)
+from lib.db.sql.tables import TABLE_TO_KEYS_MAP
+
+DEFAULT_CHUNK_SIZE = 50_000
+progress_dir = os.path.join(current_file_directory, "migration_progress")
+
+
+class SeenKeyIndex:
+    """Set of the hashed primary keys of the rows that have been written,
+    stored as a sorted array of uint64 hashes (8 bytes per key)."""
+
+    def __init__(self, key_hashes: Optional[np.ndarray] = None) -> None:
+        self.key_hashes = (
+            key_hashes if key_hashes is not None
+            else np.array([], dtype=np.uint64)
+        )
+
+    def __len__(self) -> int:
+        return len(self.key_hashes)
+
+    @staticmethod
+    def hash_keys(key_df: pd.DataFrame) -> np.ndarray:
+        return pd.util.hash_pandas_object(key_df, index=False).to_numpy(
+            dtype=np.uint64
+        )
+
+    def contains(self, key_hashes: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of which hashes are in the index."""
+        if len(self.key_hashes) == 0:
+            return np.zeros(len(key_hashes), dtype=bool)
+        positions = np.searchsorted(self.key_hashes, key_hashes)
+        positions[positions == len(self.key_hashes)] = 0
+        return self.key_hashes[positions] == key_hashes
+
+    def add(self, key_hashes: np.ndarray) -> None:
+        self.key_hashes = np.union1d(self.key_hashes, key_hashes)
+
+    def filter_unseen_rows(
+        self,
+        df: pd.DataFrame,
+        keys: list[str],
+        get_written_keys: Callable[[list[tuple]], set[tuple]]
+    ) -> pd.DataFrame:
+        """Returns the rows of a df whose keys haven't been seen (keeping the
+        first row of any key that's repeated in the df), and adds their keys
+        to the index.
+
+        `get_written_keys` returns which of the given keys have been written,
+        and is only called for the keys whose hash is in the index.
+        """
+        # keys are compared as strings, since the same key can be parsed as a
+        # different type in different chunks.
+        key_df = df[keys].astype(str)
+        key_hashes = self.hash_keys(key_df)
+        is_new = ~key_df.duplicated(keep="first").to_numpy()
+        is_hash_seen = is_new & self.contains(key_hashes)
+        if is_hash_seen.any():
+            hash_seen_keys = list(
+                key_df[is_hash_seen].itertuples(index=False, name=None)
+            )
+            written_keys = get_written_keys(hash_seen_keys)
+            is_new[is_hash_seen] = [
+                key not in written_keys for key in hash_seen_keys
+            ]
+        self.add(key_hashes[is_new])
+        return df[is_new]
+
+
+class MigrationProgress:
+    """Files of a table that have been migrated, along with the index of the
+    keys that they wrote, saved after each file."""
+
+    def __init__(self, table_name: str) -> None:
+        self.table_name = table_name
+        self.progress_fp = os.path.join(progress_dir, f"{table_name}.json")
+        self.seen_keys_fp = os.path.join(progress_dir, f"{table_name}.npy")
+        self.completed_files: list[str] = []
+        self.seen_key_index = SeenKeyIndex()
+
+    def load(self) -> None:
+        if not os.path.exists(self.progress_fp):
+            return
+        with open(self.progress_fp, "r", encoding="utf-8") as f:
+            self.completed_files = json.load(f)["completed_files"]
+        self.seen_key_index = SeenKeyIndex(np.load(self.seen_keys_fp))
+        print(f"Resuming migration of {self.table_name}, after {len(self.completed_files)} files.") # noqa
 
+    def save(self) -> None:
+        os.makedirs(progress_dir, exist_ok=True)
+        np.save(self.seen_keys_fp, self.seen_key_index.key_hashes)
+        with open(self.progress_fp, "w", encoding="utf-8") as f:
+            json.dump({"completed_files": self.completed_files}, f)
 
-def migrate_csv_to_db(table_name: str, rebuild_table: bool = False) -> None:
+    def clear(self) -> None:
+        for fp in [self.progress_fp, self.seen_keys_fp]:
+            if os.path.exists(fp):
+                os.remove(fp)
+
+
+def merge_dtypes(dtype: np.dtype, other_dtype: np.dtype) -> np.dtype:
+    """Dtype of a column that's `dtype` in some rows and `other_dtype` in
+    others, as pandas would infer it if it read them together."""
+    if dtype == other_dtype:
+        return dtype
+    if all(
+        pd.api.types.is_numeric_dtype(d) and not pd.api.types.is_bool_dtype(d)
+        for d in [dtype, other_dtype]
+    ):
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def infer_column_dtypes(
+    file_paths: list[str], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> dict[str, np.dtype]:
+    """Infers the dtype of each column across every chunk of every file.
+
+    A chunk in which a column is empty doesn't say anything about its type,
+    so it's skipped. Columns that are empty in every file are typed as
+    objects (i.e., text), rather than as float64.
+    """
+    col_to_dtype_map: dict[str, Optional[np.dtype]] = {}
+    for file_path in file_paths:
+        for chunk_df in pd.read_csv(file_path, chunksize=chunk_size):
+            has_values = chunk_df.notna().any()
+            for col in chunk_df.columns:
+                dtype = col_to_dtype_map.get(col)
+                if not has_values[col]:
+                    col_to_dtype_map[col] = dtype
+                elif dtype is None:
+                    col_to_dtype_map[col] = chunk_df[col].dtype
+                else:
+                    col_to_dtype_map[col] = merge_dtypes(
+                        dtype, chunk_df[col].dtype
+                    )
+    return {
+        col: dtype if dtype is not None else np.dtype(object)
+        for col, dtype in col_to_dtype_map.items()
+    }
+
+
+def create_table_from_column_dtypes(
+    table_name: str, col_to_dtype_map: dict[str, np.dtype]
+) -> None:
+    """Creates a table from the inferred dtypes of its columns (along with
+    any types declared in `TABLE_TO_COLUMN_TYPES_MAP`)."""
+    df = pd.DataFrame(
+        {
+            col: pd.Series(dtype=dtype)
+            for col, dtype in col_to_dtype_map.items()
+        }
+    )
+    create_new_table_from_df(df=df, table_name=table_name)
+
+
+def get_written_keys(
+    table_name: str, keys: list[str], key_values: list[tuple]
+) -> set[tuple]:
+    """Gets which of `key_values` have been written to a table, as tuples of
+    strings."""
+    return {
+        tuple(str(value) for value in key)
+        for key in get_existing_keys(
+            table_name=table_name, keys=keys, key_values=key_values
+        )
+    }
+
+
+def migrate_csv_file_to_db(
+    file_path: str,
+    table_name: str,
+    seen_key_index: SeenKeyIndex,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    col_to_dtype_map: Optional[dict[str, np.dtype]] = None
+) -> tuple[int, int]:
+    """Upserts the rows of a .csv file whose keys haven't been written yet,
+    one chunk at a time. If `col_to_dtype_map` is given, each chunk is cast
+    to those dtypes.
+
+    Returns a tuple of (number of rows read, number of rows written). Raises
+    if a chunk fails to be written, so that the file isn't marked as migrated
+    and the keys of its rows aren't saved as written.
+    """
+    primary_keys: list[str] = TABLE_TO_KEYS_MAP[table_name]["primary_keys"]
+    num_rows_read = 0
+    num_rows_written = 0
+    for chunk_df in pd.read_csv(file_path, chunksize=chunk_size):
+        num_rows_read += len(chunk_df)
+        chunk_df = chunk_df.dropna(subset=primary_keys)
+        chunk_df = seen_key_index.filter_unseen_rows(
+            df=chunk_df,
+            keys=primary_keys,
+            get_written_keys=partial(
+                get_written_keys, table_name, primary_keys
+            )
+        )
+        if len(chunk_df) == 0:
+            continue
+        if col_to_dtype_map is not None:
+            chunk_df = chunk_df.astype(
+                {
+                    col: col_to_dtype_map[col] for col in chunk_df.columns
+                    if chunk_df[col].dtype != col_to_dtype_map[col]
+                }
+            )
+        write_result = write_df_to_database(
+            df=chunk_df, table_name=table_name, upsert=True
+        )
+        if write_result.num_rows_written == 0:
+            raise ValueError(
+                f"Unable to write {len(chunk_df)} rows of {file_path} to "
+                f"{table_name}."
+            )
+        num_rows_written += write_result.num_rows_written
+    return (num_rows_read, num_rows_written)
+
+
+def migrate_csv_to_db(
+    table_name: str,
+    rebuild_table: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    resume: bool = True
+) -> None:
     """Migrate existing .csv data to DB"""
     table_dir_path = os.path.join(DATA_DIR, table_name)
-    # loop through all the .csv files and create pandas dataframes
-    # then, union together all the dataframes.
-    df = pd.concat([
-        pd.read_csv(os.path.join(table_dir_path, filename))
-        for filename in os.listdir(table_dir_path)
-        if filename.endswith(".csv")
-    ], ignore_index=True)
-
-    print(df.columns)
-    # write to Postgres db.
-    write_df_to_database(
-        df=df, table_name=table_name, rebuild_table=rebuild_table
+    progress = MigrationProgress(table_name=table_name)
+    if resume:
+        progress.load()
+    if rebuild_table and not progress.completed_files:
+        drop_table(table_name=table_name)
+    # filenames are timestamps, so this reads the newest files first.
+    filenames = sorted(
+        [
+            filename for filename in os.listdir(table_dir_path)
+            if filename.endswith(".csv")
+        ],
+        reverse=True
+    )
+    print(f"Inferring the schema of {table_name} from {len(filenames)} files...") # noqa
+    col_to_dtype_map = infer_column_dtypes(
+        file_paths=[
+            os.path.join(table_dir_path, filename) for filename in filenames
+        ],
+        chunk_size=chunk_size
+    )
+    if not check_if_table_exists(table_name=table_name):
+        create_table_from_column_dtypes(
+            table_name=table_name, col_to_dtype_map=col_to_dtype_map
+        )
+    total_rows_read = 0
+    total_rows_written = 0
+    start_time = time.time()
+    for filename in filenames:
+        if filename in progress.completed_files:
+            continue
+        file_start_time = time.time()
+        num_rows_read, num_rows_written = migrate_csv_file_to_db(
+            file_path=os.path.join(table_dir_path, filename),
+            table_name=table_name,
+            seen_key_index=progress.seen_key_index,
+            chunk_size=chunk_size,
+            col_to_dtype_map=col_to_dtype_map
+        )
+        progress.completed_files.append(filename)
+        progress.save()
+        total_rows_read += num_rows_read
+        total_rows_written += num_rows_written
+        file_runtime = time.time() - file_start_time
+        print(
+            f"Migrated {filename}: read {num_rows_read} rows, wrote "
+            f"{num_rows_written} new rows, in {file_runtime:.1f} seconds "
+            f"({num_rows_read / max(file_runtime, 1e-6):.0f} rows/second)."
+        )
+    runtime = time.time() - start_time
+    print(
+        f"Successfully uploaded .csv data to DB, for table {table_name}: read "
+        f"{total_rows_read} rows, wrote {total_rows_written} unique rows, in "
+        f"{runtime:.1f} seconds "
+        f"({total_rows_read / max(runtime, 1e-6):.0f} rows/second)."
     )
-    print(f"Successfully uploaded .csv data to DB, for table {table_name}")
+    progress.clear()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""One-time migration of existing tables to range-partitioned tables.
+
+For each table in `TABLE_TO_PARTITION_KEY_MAP` that isn't partitioned yet,
+creates a partitioned copy of the table (with the same column types), creates
+the monthly partitions that its existing rows need, copies the rows over, and
+replaces the original table. Each table is migrated in its own transaction.
+
+Foreign keys that reference a migrated table are dropped along with the
+original table. They're recreated (including the partition key) for tables
+that are migrated afterwards, e.g., `classified_comments`. Tables without the
+partition key, e.g., `comment_to_observer_map`, lose their foreign key to
+`comments`; see `adapt_foreign_keys_to_partitioned_tables`.
+"""
+from lib.db.sql.helper import (
+    bump_table_write_version, check_if_table_exists,
+    check_if_table_is_partitioned, conn, create_partitions_for_months, cursor,
+    generate_create_table_statement, get_months_of_epoch_series,
+    get_table_col_to_dtype_map, get_table_write_order, load_query_as_df
+)
+from lib.db.sql.tables import TABLE_TO_PARTITION_KEY_MAP
+
+
+def migrate_table_to_partitioned_table(table_name: str) -> None:
+    if not check_if_table_exists(table_name):
+        print(f"Table {table_name} doesn't exist. Skipping...")
+        return
+    if check_if_table_is_partitioned(table_name):
+        print(f"Table {table_name} is already partitioned. Skipping...")
+        return
+    partition_key = TABLE_TO_PARTITION_KEY_MAP[table_name]
+    unpartitioned_table_name = f"{table_name}_unpartitioned"
+    table_col_to_dtype_map = get_table_col_to_dtype_map(table_name)
+    months_df = load_query_as_df(f"""
+        SELECT DISTINCT
+            EXTRACT(EPOCH FROM date_trunc('month', to_timestamp({partition_key}) AT TIME ZONE 'UTC')) AS {partition_key}
+        FROM {table_name}
+        WHERE {partition_key} IS NOT NULL;
+    """, use_cache=False) # noqa
+    try:
+        print(f"Migrating table {table_name} to a partitioned table...")
+        cursor.execute(
+            f"ALTER TABLE {table_name} RENAME TO {unpartitioned_table_name};"
+        )
+        cursor.execute(
+            f"ALTER INDEX IF EXISTS {table_name}_pkey "
+            f"RENAME TO {unpartitioned_table_name}_pkey;"
+        )
+        cursor.execute(generate_create_table_statement(
+            table_name=table_name,
+            field_to_sql_type_map=table_col_to_dtype_map,
+            partitioned=True
+        ))
+        create_partitions_for_months(
+            table_name=table_name,
+            month_starts=get_months_of_epoch_series(months_df[partition_key]),
+            commit=False
+        )
+        cols = ', '.join(table_col_to_dtype_map.keys())
+        cursor.execute(f"""
+            INSERT INTO {table_name} ({cols})
+            SELECT {cols} FROM {unpartitioned_table_name};
+        """)
+        cursor.execute(f"DROP TABLE {unpartitioned_table_name} CASCADE;")
+        bump_table_write_version(table_name=table_name)
+        conn.commit()
+        print(f"Finished migrating table {table_name}.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Unable to migrate table {table_name}: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    for table_name in get_table_write_order(
+        list(TABLE_TO_PARTITION_KEY_MAP.keys())
+    ):
+        migrate_table_to_partitioned_table(table_name=table_name)
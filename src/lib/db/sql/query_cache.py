@@ -0,0 +1,208 @@
+"""Read-through cache of query results, stored as local Parquet files.
+
+Results are keyed by the normalized text of the query plus the write version
+of every table that the query reads from (see `get_table_write_versions` in
+`lib/db/sql/helper.py`). Since `write_df_to_database` bumps the version of
+the table it writes to, a write makes the cached results of every query
+that reads the table unreachable, and they age out of the cache through its
+size-based LRU eviction.
+
+The cache is opt-in: pass `use_cache=True` to `load_table_as_df` (or
+`load_query_as_df`), or set `USE_QUERY_CACHE=true` to turn it on for every
+load, e.g., for interactive analysis. Code that writes to a table without
+`write_df_to_database` (raw SQL, COPY, migrations) calls
+`bump_table_write_version` in the same transaction. Tables that are written
+by triggers (e.g., `user_to_message_status_summary`) are never bumped, so
+they're always loaded with `use_cache=False`. After writing to a table
+by hand (e.g., from psql), invalidate its cached queries with:
+
+    python -m lib.db.sql.query_cache --invalidate <table_name> [...]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from typing import Optional
+
+import pandas as pd
+
+current_file_directory = os.path.dirname(os.path.abspath(__file__))
+USE_QUERY_CACHE: bool = (
+    os.getenv("USE_QUERY_CACHE", "false").lower() == "true"
+)
+QUERY_CACHE_DIR = os.getenv(
+    "QUERY_CACHE_DIR", os.path.join(current_file_directory, "query_cache")
+)
+QUERY_CACHE_MAX_SIZE_MB = int(os.getenv("QUERY_CACHE_MAX_SIZE_MB", "1024"))
+
+# quoted string literals and identifiers, in which whitespace is significant.
+quoted_regex = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+# names that follow FROM or JOIN, i.e., the tables (or views) that a query
+# reads from, including in subqueries.
+referenced_table_regex = re.compile(
+    r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE
+)
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a query so that queries that only differ in whitespace or a
+    trailing semicolon share a cache entry. Whitespace inside quoted literals
+    and identifiers is kept as is."""
+    # splitting on a capturing group puts the quoted parts at odd indices.
+    parts = quoted_regex.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def get_tables_referenced_by_query(query: str) -> list[str]:
+    """Returns the (lowercased, sorted) names of the tables or views that a
+    query reads from."""
+    return sorted({
+        table_name.lower()
+        for table_name in referenced_table_regex.findall(query)
+        if table_name.lower() != "select"
+    })
+
+
+class QueryCacheStats:
+    """Hit/miss counts of a query cache."""
+
+    def __init__(self) -> None:
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+
+    @property
+    def num_lookups(self) -> int:
+        return self.num_hits + self.num_misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_hits / self.num_lookups if self.num_lookups else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "num_hits": self.num_hits,
+            "num_misses": self.num_misses,
+            "num_evictions": self.num_evictions,
+            "hit_rate": self.hit_rate
+        }
+
+    def __repr__(self) -> str:
+        return f"QueryCacheStats({self.to_dict()})"
+
+
+class ParquetQueryCache:
+    """Stores query results as Parquet files in a local directory.
+
+    The least recently used files are evicted once the directory grows past
+    `max_size_bytes`. A file's modification time is used as its last access
+    time, since access times aren't reliably updated on every filesystem.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = QUERY_CACHE_DIR,
+        max_size_bytes: int = QUERY_CACHE_MAX_SIZE_MB * 1024 * 1024
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.stats = QueryCacheStats()
+
+    @staticmethod
+    def get_cache_key(query: str, table_versions: dict[str, int]) -> str:
+        key_data = {
+            "query": normalize_query(query),
+            "table_versions": sorted(table_versions.items())
+        }
+        return hashlib.sha256(
+            json.dumps(key_data).encode("utf-8")
+        ).hexdigest()
+
+    def get_cache_path(self, cache_key: str) -> str:
+        return os.path.join(self.cache_dir, f"{cache_key}.parquet")
+
+    def get(self, cache_key: str) -> Optional[pd.DataFrame]:
+        """Returns the cached df for a key, or None if it isn't cached."""
+        cache_path = self.get_cache_path(cache_key)
+        if not os.path.exists(cache_path):
+            self.stats.num_misses += 1
+            return None
+        try:
+            df = pd.read_parquet(cache_path)
+        except Exception as e:
+            print(f"Unable to read cached query results {cache_path}: {e}")
+            self.stats.num_misses += 1
+            return None
+        os.utime(cache_path)
+        self.stats.num_hits += 1
+        return df
+
+    def put(self, cache_key: str, df: pd.DataFrame) -> None:
+        """Caches a df. Failures to cache (e.g., columns that can't be
+        stored in Parquet) are printed rather than raised, since the caller
+        already has the result."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.get_cache_path(cache_key)
+        tmp_cache_path = f"{cache_path}.tmp"
+        try:
+            df.to_parquet(tmp_cache_path, index=False)
+            os.replace(tmp_cache_path, cache_path)
+        except Exception as e:
+            print(f"Unable to cache query results: {e}")
+            if os.path.exists(tmp_cache_path):
+                os.remove(tmp_cache_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used files until the cache fits in
+        `max_size_bytes`."""
+        cache_files = [
+            os.path.join(self.cache_dir, filename)
+            for filename in os.listdir(self.cache_dir)
+            if filename.endswith(".parquet")
+        ]
+        file_stats = [(path, os.stat(path)) for path in cache_files]
+        total_size_bytes = sum(stat.st_size for _, stat in file_stats)
+        for path, stat in sorted(file_stats, key=lambda x: x[1].st_mtime):
+            if total_size_bytes <= self.max_size_bytes:
+                break
+            os.remove(path)
+            total_size_bytes -= stat.st_size
+            self.stats.num_evictions += 1
+
+    def clear(self) -> None:
+        if not os.path.exists(self.cache_dir):
+            return
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".parquet"):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+
+query_cache = ParquetQueryCache()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Invalidate or clear the query cache."
+    )
+    parser.add_argument(
+        "--invalidate",
+        nargs="+",
+        default=[],
+        help="Tables whose cached queries should no longer be used."
+    )
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+    if args.invalidate:
+        # imported here since the helper imports this module.
+        from lib.db.sql.helper import invalidate_cached_queries
+        invalidate_cached_queries(table_names=args.invalidate)
+        print(f"Invalidated cached queries on {args.invalidate}.")
+    if args.clear:
+        query_cache.clear()
+        print("Cleared the query cache.")
@@ -0,0 +1,186 @@
+"""Helper utilities for interacting with an embedded SQLite database.
+
+Used instead of Postgres when `DB_BACKEND=sqlite` (see `lib/db/sql/helper.py`),
+so that the pipeline can run in a single process without a database server,
+e.g., on a laptop, in CI, or for reproducible profiling runs. Tables are
+created with the same schemas, keys, and upsert semantics as in Postgres.
+"""
+import datetime
+import json
+import os
+import sqlite3
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from lib.db.sql.tables import TABLE_TO_KEYS_MAP
+
+current_file_directory = os.path.dirname(os.path.abspath(__file__))
+SQLITE_DB_PATH = os.getenv(
+    "SQLITE_DB_PATH", os.path.join(current_file_directory, "reddit_data.db")
+)
+
+# SQLite keeps the column types as they were declared in the CREATE TABLE
+# statement. We map them to the names that Postgres' information_schema uses,
+# so that callers see the same schema on either backend.
+declared_type_to_information_schema_type = {
+    "text": "text",
+    "bool": "boolean",
+    "int": "integer",
+    "float": "double precision",
+    "timestamptz": "timestamp with time zone",
+    "jsonb": "jsonb"
+}
+
+
+def connect(db_path: str = SQLITE_DB_PATH) -> sqlite3.Connection:
+    """Connects to (and creates, if needed) the SQLite database file."""
+    conn = sqlite3.connect(db_path)
+    # SQLite doesn't enforce foreign keys unless asked to.
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    return conn
+
+
+def check_if_table_exists(cursor: sqlite3.Cursor, table_name: str) -> bool:
+    """Checks if a table exists in the database."""
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?);", # noqa
+        (table_name,)
+    )
+    return bool(cursor.fetchone()[0])
+
+
+def get_all_tables_in_db(cursor: sqlite3.Cursor) -> list[str]:
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name;"
+    )
+    return [table[0] for table in cursor.fetchall()]
+
+
+def get_table_col_to_dtype_map(
+    cursor: sqlite3.Cursor, table_name: str
+) -> dict:
+    """Returns a map of col:dtype for a given SQLite table, using the same
+    type names as Postgres."""
+    cursor.execute(f"PRAGMA table_info({table_name});")
+    return {
+        col[1]: declared_type_to_information_schema_type.get(
+            col[2].lower(), col[2].lower()
+        )
+        for col in cursor.fetchall()
+    }
+
+
+def convert_value_for_sqlite(value: Any) -> Any:
+    """Converts a value to a type that the sqlite3 module can bind.
+
+    numpy scalars are converted to Python scalars, timestamps to ISO strings,
+    complex values to JSON strings, and nulls (None/NaN/NaT) to None.
+    """
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def create_write_query_from_df(
+    df: pd.DataFrame, table_name: str, upsert_keys: Optional[list[str]] = None
+) -> str:
+    """Creates an insert query (or an upsert query, if `upsert_keys` are
+    given) from a dataframe."""
+    query = f"""
+        INSERT INTO {table_name} ({', '.join(df.columns)})
+        VALUES ({', '.join(['?'] * len(df.columns))})
+    """
+    if upsert_keys:
+        update_fields = [
+            f"{col} = excluded.{col}"
+            for col in df.columns
+            if col not in upsert_keys
+        ]
+        query += f"""
+            ON CONFLICT ({', '.join(upsert_keys)})
+            DO {'UPDATE SET ' + ', '.join(update_fields) if update_fields else 'NOTHING'}
+        """ # noqa
+    return query + ";"
+
+
+# number of keys that are looked up per query. Keeps the number of bound
+# parameters well under SQLite's limit.
+EXISTING_KEYS_CHUNK_SIZE = 500
+
+
+def get_existing_keys(
+    cursor: sqlite3.Cursor,
+    table_name: str,
+    upsert_keys: list[str],
+    keys: list[tuple]
+) -> set[tuple]:
+    """Gets which of `keys` (tuples of the `upsert_keys` values) are already
+    in a table. Only those keys are looked up, a chunk at a time, so the
+    cost doesn't grow with the size of the table."""
+    existing_keys: set[tuple] = set()
+    unique_keys = list(set(keys))
+    key_cols = ", ".join(upsert_keys)
+    row_placeholder = f"({', '.join(['?'] * len(upsert_keys))})"
+    for i in range(0, len(unique_keys), EXISTING_KEYS_CHUNK_SIZE):
+        keys_chunk = unique_keys[i:i + EXISTING_KEYS_CHUNK_SIZE]
+        cursor.execute(
+            f"""
+                SELECT {key_cols}
+                FROM {table_name}
+                WHERE ({key_cols}) IN (
+                    VALUES {', '.join([row_placeholder] * len(keys_chunk))}
+                );
+            """,
+            tuple(value for key in keys_chunk for value in key)
+        )
+        existing_keys.update(cursor.fetchall())
+    return existing_keys
+
+
+def execute_write_query_from_df(
+    cursor: sqlite3.Cursor,
+    df: pd.DataFrame,
+    table_name: str,
+    upsert: bool = False
+) -> tuple[int, int]:
+    """Writes the rows of a dataframe to a table, without committing.
+
+    Returns a tuple of (number of rows inserted, number of rows updated).
+    """
+    upsert_keys: Optional[list[str]] = (
+        TABLE_TO_KEYS_MAP[table_name]["primary_keys"] if upsert else None
+    )
+    if upsert_keys:
+        df = df.drop_duplicates(subset=upsert_keys, keep="last")
+    query = create_write_query_from_df(
+        df=df, table_name=table_name, upsert_keys=upsert_keys
+    )
+    rows = [
+        tuple(convert_value_for_sqlite(value) for value in row)
+        for row in df.itertuples(index=False, name=None)
+    ]
+    if not upsert_keys:
+        cursor.executemany(query, rows)
+        return (len(rows), 0)
+    # SQLite has no equivalent of Postgres' `xmax`, so we look up which keys
+    # already exist to tell inserts apart from updates.
+    key_col_indices = [list(df.columns).index(key) for key in upsert_keys]
+    row_keys = [tuple(row[idx] for idx in key_col_indices) for row in rows]
+    existing_keys = get_existing_keys(
+        cursor=cursor,
+        table_name=table_name,
+        upsert_keys=upsert_keys,
+        keys=row_keys
+    )
+    num_rows_updated = sum(1 for key in row_keys if key in existing_keys)
+    cursor.executemany(query, rows)
+    return (len(rows) - num_rows_updated, num_rows_updated)
@@ -1,6 +1,21 @@
 # https://www.postgresqltutorial.com/postgresql-tutorial/postgresql-create-table/
 # https://www.postgresql.org/docs/current/ddl-constraints.html#DDL-CONSTRAINTS-FK
-TABLE_TO_KEYS_MAP = {
+from typing import TypedDict
+
+
+class ForeignKey(TypedDict):
+    key: str
+    reference_table: str
+    reference_table_key: str
+    on_delete: str
+
+
+class TableKeys(TypedDict):
+    primary_keys: list[str]
+    foreign_keys: list[ForeignKey]
+
+
+TABLE_TO_KEYS_MAP: dict[str, TableKeys] = {
     "subreddits": {
         "primary_keys": ["id"],
         "foreign_keys": []
@@ -54,6 +69,14 @@ TABLE_TO_KEYS_MAP = {
             }
         ]
     },
+    "classification_cache": {
+        "primary_keys": ["model_hash", "text_hash"],
+        "foreign_keys": []
+    },
+    "classification_queue": {
+        "primary_keys": ["id"],
+        "foreign_keys": []
+    },
     "user_to_message_status": {
         "primary_keys": ["user_id"],
         "foreign_keys": [
@@ -116,3 +139,65 @@ TABLE_TO_KEYS_MAP = {
         ]
     }
 }
+
+# Columns whose Postgres type can't be inferred from the pandas dtype. Nested
+# Reddit API fields (lists/dicts) are stored as JSONB and sync/update
+# timestamps (ISO strings in Python) are stored as TIMESTAMPTZ. Any column not
+# listed here falls back to being inferred from its pandas dtype.
+TABLE_TO_COLUMN_TYPES_MAP = {
+    "subreddits": {
+        "allowed_media_in_comments": "jsonb",
+        "banner_size": "jsonb",
+        "comment_contribution_settings": "jsonb",
+        "icon_size": "jsonb",
+        "user_flair_richtext": "jsonb",
+        "synctimestamp": "timestamptz",
+    },
+    "users": {
+        "synctimestamp": "timestamptz",
+    },
+    "threads": {
+        "_comments_by_id": "jsonb",
+        "all_awardings": "jsonb",
+        "author_flair_richtext": "jsonb",
+        "awarders": "jsonb",
+        "gildings": "jsonb",
+        "link_flair_richtext": "jsonb",
+        "media_embed": "jsonb",
+        "mod_reports": "jsonb",
+        "preview": "jsonb",
+        "secure_media_embed": "jsonb",
+        "treatment_tags": "jsonb",
+        "user_reports": "jsonb",
+        "synctimestamp": "timestamptz",
+    },
+    "comments": {
+        "all_awardings": "jsonb",
+        "author_flair_richtext": "jsonb",
+        "awarders": "jsonb",
+        "gildings": "jsonb",
+        "mod_reports": "jsonb",
+        "treatment_tags": "jsonb",
+        "user_reports": "jsonb",
+        "synctimestamp": "timestamptz",
+    },
+    "user_to_message_status": {
+        "last_update_timestamp": "timestamptz",
+    },
+    "messages_received": {
+        "synctimestamp": "timestamptz",
+    },
+    "classification_queue": {
+        "synctimestamp": "timestamptz",
+        "claimed_at": "timestamptz",
+    },
+}
+
+# Tables that are range-partitioned by month, on a column of UTC epoch
+# seconds. Postgres requires the partition key to be part of the primary key
+# (and of any foreign key that references the table), so it's added to the
+# primary key of these tables when they're partitioned.
+TABLE_TO_PARTITION_KEY_MAP = {
+    "comments": "created_utc",
+    "classified_comments": "created_utc",
+}
@@ -0,0 +1,48 @@
+import unittest
+
+from pipelines.benchmark_imports import (
+    IMPORT_TIME_BUDGET_SECONDS, benchmark_pipeline_import, get_pipelines
+)
+
+# errors that mean the environment is missing something (a package, or NLTK
+# data that the preprocessing loads at import, see
+# `lib/download_extra_packages.py`), rather than that the import is broken.
+MISSING_DEPENDENCY_ERRORS = ["ModuleNotFoundError", "LookupError"]
+
+
+class TestPipelineImportTime(unittest.TestCase):
+    results: dict[str, dict]
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.results = {
+            pipeline: benchmark_pipeline_import(pipeline)
+            for pipeline in get_pipelines()
+        }
+
+    def get_result(self, pipeline: str) -> dict:
+        result = self.results[pipeline]
+        if result["error"] and any(
+            error in result["error"] for error in MISSING_DEPENDENCY_ERRORS
+        ):
+            self.skipTest(f"Dependency of {pipeline} isn't installed: {result['error']}") # noqa
+        self.assertIsNone(result["error"])
+        return result
+
+    def test_pipelines_defer_heavy_imports(self) -> None:
+        for pipeline in self.results:
+            with self.subTest(pipeline=pipeline):
+                result = self.get_result(pipeline)
+                self.assertEqual(result["heavy_modules_imported"], [])
+
+    def test_pipelines_import_within_budget(self) -> None:
+        for pipeline in self.results:
+            with self.subTest(pipeline=pipeline):
+                result = self.get_result(pipeline)
+                self.assertLessEqual(
+                    result["import_time_seconds"], IMPORT_TIME_BUDGET_SECONDS
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
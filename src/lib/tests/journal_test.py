@@ -0,0 +1,99 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from data.journal import CheckpointJournal
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.journal = self.open_journal()
+
+    def tearDown(self) -> None:
+        self.journal.close()
+        self.tmp_dir.cleanup()
+
+    def open_journal(self) -> CheckpointJournal:
+        return CheckpointJournal(
+            table_name="user_to_message_status",
+            key_fields=("user_id",),
+            fsync_every=2,
+            journal_dir=self.tmp_dir.name
+        )
+
+    def test_append_keeps_latest_record_of_each_key(self) -> None:
+        self.journal.append({"user_id": "a", "message_status": "pending"})
+        self.journal.append({"user_id": "b", "message_status": "pending"})
+        self.journal.append({"user_id": "a", "message_status": "messaged"})
+        self.assertEqual(len(self.journal), 2)
+        self.assertTrue(("a",) in self.journal)
+        self.assertFalse(("c",) in self.journal)
+        self.assertEqual(
+            self.journal.get(("a",)),
+            {"user_id": "a", "message_status": "messaged"}
+        )
+        self.assertIsNone(self.journal.get(("c",)))
+
+    def test_replay_after_reopening(self) -> None:
+        self.journal.append({"user_id": "a", "message_status": "pending"})
+        self.journal.append({"user_id": "b", "message_status": "pending"})
+        self.journal.append({"user_id": "a", "message_status": "messaged"})
+        self.journal.close()
+        self.journal = self.open_journal()
+        # records are replayed in the order that their latest version was
+        # appended.
+        self.assertEqual(
+            self.journal.records(),
+            [
+                {"user_id": "b", "message_status": "pending"},
+                {"user_id": "a", "message_status": "messaged"}
+            ]
+        )
+
+    def test_partially_written_record_is_truncated(self) -> None:
+        self.journal.append({"user_id": "a", "message_status": "messaged"})
+        self.journal.close()
+        size_before_crash = os.path.getsize(self.journal.journal_fp)
+        # a crash in the middle of an append leaves an unterminated line.
+        with open(self.journal.journal_fp, "ab") as f:
+            f.write(b'{"user_id": "b", "message_st')
+        self.journal = self.open_journal()
+        self.assertEqual(
+            self.journal.records(),
+            [{"user_id": "a", "message_status": "messaged"}]
+        )
+        self.assertEqual(
+            os.path.getsize(self.journal.journal_fp), size_before_crash
+        )
+
+    def test_resume_after_crash(self) -> None:
+        self.journal.append({"user_id": "a", "message_status": "messaged"})
+        # simulate a crash: the file is never synced or closed, but appends
+        # are flushed to the OS, so a new process can still read them.
+        crashed_journal = self.journal
+        self.journal = self.open_journal()
+        self.assertTrue(("a",) in self.journal)
+        self.journal.append({"user_id": "b", "message_status": "messaged"})
+        self.assertEqual(
+            [record["user_id"] for record in self.journal.records()],
+            ["a", "b"]
+        )
+        crashed_journal.journal_file.close()
+
+    def test_clear_deletes_records(self) -> None:
+        self.journal.append({"user_id": "a", "message_status": "messaged"})
+        self.journal.clear()
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(self.journal.records(), [])
+        self.journal.append({"user_id": "b", "message_status": "messaged"})
+        self.journal.close()
+        self.journal = self.open_journal()
+        self.assertEqual(
+            self.journal.records(),
+            [{"user_id": "b", "message_status": "messaged"}]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
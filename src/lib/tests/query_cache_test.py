@@ -0,0 +1,95 @@
+import os
+from tempfile import TemporaryDirectory
+import time
+import unittest
+
+import pandas as pd
+
+from lib.db.sql.query_cache import (
+    ParquetQueryCache,
+    get_tables_referenced_by_query,
+    normalize_query
+)
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.cache = ParquetQueryCache(cache_dir=self.tmp_dir.name)
+        self.df = pd.DataFrame({"id": ["a", "b"], "score": [1.0, 2.0]})
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_normalize_query(self) -> None:
+        self.assertEqual(
+            normalize_query("\n  SELECT id\n    FROM users\n    ;  "),
+            "SELECT id FROM users"
+        )
+
+    def test_normalize_query_keeps_whitespace_in_literals(self) -> None:
+        self.assertEqual(
+            normalize_query("SELECT id\n  FROM users WHERE name = 'a  b';"),
+            "SELECT id FROM users WHERE name = 'a  b'"
+        )
+        self.assertNotEqual(
+            normalize_query("SELECT * FROM users WHERE name = 'a b'"),
+            normalize_query("SELECT * FROM users WHERE name = 'a  b'")
+        )
+        self.assertEqual(
+            normalize_query("SELECT  'it''s  here',  \"my  col\" FROM t"),
+            "SELECT 'it''s  here', \"my  col\" FROM t"
+        )
+
+    def test_get_tables_referenced_by_query(self) -> None:
+        query = """
+            SELECT id FROM comments
+            JOIN users ON comments.author_id = users.id
+            WHERE id NOT IN (SELECT id FROM classified_comments);
+        """
+        self.assertEqual(
+            get_tables_referenced_by_query(query),
+            ["classified_comments", "comments", "users"]
+        )
+
+    def test_cache_key_changes_with_table_version(self) -> None:
+        query = "SELECT * FROM users;"
+        self.assertEqual(
+            self.cache.get_cache_key(query, {"users": 1}),
+            self.cache.get_cache_key(" SELECT *  FROM users", {"users": 1})
+        )
+        self.assertNotEqual(
+            self.cache.get_cache_key(query, {"users": 1}),
+            self.cache.get_cache_key(query, {"users": 2})
+        )
+
+    def test_get_and_put(self) -> None:
+        self.assertIsNone(self.cache.get("key"))
+        self.cache.put("key", self.df)
+        pd.testing.assert_frame_equal(self.cache.get("key"), self.df)
+        self.assertEqual(self.cache.stats.num_hits, 1)
+        self.assertEqual(self.cache.stats.num_misses, 1)
+        self.assertEqual(self.cache.stats.hit_rate, 0.5)
+
+    def test_evicts_least_recently_used(self) -> None:
+        self.cache.put("first", self.df)
+        self.cache.put("second", self.df)
+        file_size = os.path.getsize(self.cache.get_cache_path("first"))
+        # make "first" the oldest file, then read it so that "second" is
+        # the least recently used.
+        old_time = time.time() - 100
+        os.utime(self.cache.get_cache_path("first"), (old_time, old_time))
+        os.utime(
+            self.cache.get_cache_path("second"), (old_time + 1, old_time + 1)
+        )
+        self.cache.get("first")
+        self.cache.max_size_bytes = 2 * file_size
+        self.cache.put("third", self.df)
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("third"))
+        self.assertEqual(self.cache.stats.num_evictions, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
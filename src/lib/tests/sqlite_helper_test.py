@@ -0,0 +1,100 @@
+import sqlite3
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib.db.sql.sqlite_helper import (
+    check_if_table_exists,
+    convert_value_for_sqlite,
+    execute_write_query_from_df,
+    get_existing_keys,
+    get_table_col_to_dtype_map
+)
+
+
+class TestSqliteHelper(unittest.TestCase):
+    def setUp(self) -> None:
+        self.conn = sqlite3.connect(":memory:")
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("""
+            CREATE TABLE users (
+                id text NOT NULL,
+                name text,
+                is_blocked bool,
+                synctimestamp timestamptz,
+                PRIMARY KEY (id)
+            )
+        """)
+
+    def tearDown(self) -> None:
+        self.conn.close()
+
+    def test_check_if_table_exists(self) -> None:
+        self.assertTrue(check_if_table_exists(self.cursor, "users"))
+        self.assertFalse(check_if_table_exists(self.cursor, "comments"))
+
+    def test_get_table_col_to_dtype_map(self) -> None:
+        self.assertEqual(
+            get_table_col_to_dtype_map(self.cursor, "users"),
+            {
+                "id": "text",
+                "name": "text",
+                "is_blocked": "boolean",
+                "synctimestamp": "timestamp with time zone"
+            }
+        )
+
+    def test_convert_value_for_sqlite(self) -> None:
+        self.assertEqual(convert_value_for_sqlite(np.int64(3)), 3)
+        self.assertIsNone(convert_value_for_sqlite(np.nan))
+        self.assertIsNone(convert_value_for_sqlite(None))
+        self.assertEqual(convert_value_for_sqlite({"a": [1]}), '{"a": [1]}')
+        self.assertEqual(
+            convert_value_for_sqlite(pd.Timestamp("2023-10-12", tz="UTC")),
+            "2023-10-12T00:00:00+00:00"
+        )
+
+    def test_execute_write_query_from_df_upserts(self) -> None:
+        df = pd.DataFrame([
+            {"id": "a", "name": "Alice", "is_blocked": False},
+            {"id": "b", "name": "Bob", "is_blocked": False},
+        ])
+        self.assertEqual(
+            execute_write_query_from_df(self.cursor, df, "users"), (2, 0)
+        )
+        updated_df = pd.DataFrame([
+            {"id": "b", "name": "Bobby", "is_blocked": True},
+            {"id": "c", "name": "Charlie", "is_blocked": False},
+        ])
+        self.assertEqual(
+            execute_write_query_from_df(
+                self.cursor, updated_df, "users", upsert=True
+            ),
+            (1, 1)
+        )
+        self.cursor.execute("SELECT id, name, is_blocked FROM users ORDER BY id")
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [("a", "Alice", 0), ("b", "Bobby", 1), ("c", "Charlie", 0)]
+        )
+
+    def test_get_existing_keys_only_returns_given_keys(self) -> None:
+        self.cursor.executemany(
+            "INSERT INTO users (id) VALUES (?)",
+            [(str(i),) for i in range(1200)]
+        )
+        keys = [("5",), ("1100",), ("5",), ("missing",)]
+        self.assertEqual(
+            get_existing_keys(self.cursor, "users", ["id"], keys),
+            {("5",), ("1100",)}
+        )
+        many_keys = [(str(i),) for i in range(0, 2400, 2)]
+        self.assertEqual(
+            len(get_existing_keys(self.cursor, "users", ["id"], many_keys)),
+            600
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Benchmarks how long it takes to import each pipeline.
+
+Each pipeline is imported in a fresh interpreter, so that nothing is already
+imported. Pipelines shouldn't pay for TensorFlow/Keras unless they classify,
+so importing any pipeline (including `classify`, which only loads the model
+when it runs) has to stay under the budget without importing them.
+
+Usage (from `src/`):
+    python -m pipelines.benchmark_imports [--budget-seconds 3] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Optional
+
+PIPELINES_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.dirname(PIPELINES_DIR)
+IMPORT_TIME_BUDGET_SECONDS = 3.0
+# modules that no pipeline should import until it classifies.
+HEAVY_MODULES = ["tensorflow", "keras"]
+
+# the line of a traceback that names the exception, e.g., "LookupError: ...".
+exception_line_regex = re.compile(r"^[A-Za-z_][\w.]*(?:Error|Exception)\b")
+
+# run in the child interpreter: imports the pipeline and reports how long it
+# took and which heavy modules were imported.
+benchmark_script = """
+import json, sys, time
+start_time = time.perf_counter()
+import pipelines.{pipeline}.main
+import_time = time.perf_counter() - start_time
+print(json.dumps({{
+    "import_time_seconds": import_time,
+    "heavy_modules_imported": [
+        module for module in {heavy_modules} if module in sys.modules
+    ]
+}}))
+"""
+
+
+def get_pipelines() -> list[str]:
+    return sorted(
+        name for name in os.listdir(PIPELINES_DIR)
+        if os.path.exists(os.path.join(PIPELINES_DIR, name, "main.py"))
+    )
+
+
+def get_error_line(stderr: str) -> str:
+    """Returns the line of a traceback that names the exception, rather than
+    just the last line, since some messages (e.g., NLTK's for missing data)
+    span several lines."""
+    error_lines = stderr.strip().splitlines()
+    for line in reversed(error_lines):
+        if exception_line_regex.match(line):
+            return line
+    return error_lines[-1] if error_lines else "Unknown error."
+
+
+def benchmark_pipeline_import(
+    pipeline: str, budget_seconds: float = IMPORT_TIME_BUDGET_SECONDS
+) -> dict:
+    """Imports a pipeline in a new interpreter. The result has the import
+    time, whether it's within budget, and the error if the import failed."""
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            benchmark_script.format(
+                pipeline=pipeline, heavy_modules=HEAVY_MODULES
+            )
+        ],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True
+    )
+    result: dict = {
+        "pipeline": pipeline,
+        "process_time_seconds": time.perf_counter() - start_time,
+        "error": None
+    }
+    if process.returncode != 0:
+        result["error"] = get_error_line(process.stderr)
+        result["is_within_budget"] = False
+        return result
+    result.update(json.loads(process.stdout.strip().splitlines()[-1]))
+    result["is_within_budget"] = (
+        result["import_time_seconds"] <= budget_seconds
+        and not result["heavy_modules_imported"]
+    )
+    return result
+
+
+def benchmark_pipeline_imports(
+    pipelines: Optional[list[str]] = None,
+    budget_seconds: float = IMPORT_TIME_BUDGET_SECONDS
+) -> list[dict]:
+    return [
+        benchmark_pipeline_import(pipeline, budget_seconds=budget_seconds)
+        for pipeline in (pipelines or get_pipelines())
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark how long it takes to import each pipeline."
+    )
+    parser.add_argument(
+        "--budget-seconds", type=float, default=IMPORT_TIME_BUDGET_SECONDS
+    )
+    parser.add_argument("--pipelines", nargs="*", default=None)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    results = benchmark_pipeline_imports(
+        pipelines=args.pipelines, budget_seconds=args.budget_seconds
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            if result["error"]:
+                print(f"{result['pipeline']}: failed to import ({result['error']})") # noqa
+                continue
+            heavy_modules = ", ".join(result["heavy_modules_imported"])
+            print(
+                f"{result['pipeline']}: {result['import_time_seconds']:.2f}s"
+                f"{' (imports ' + heavy_modules + ')' if heavy_modules else ''}" # noqa
+                f"{'' if result['is_within_budget'] else ' OVER BUDGET'}"
+            )
+    sys.exit(0 if all(result["is_within_budget"] for result in results) else 1) # noqa
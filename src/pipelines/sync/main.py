@@ -1,4 +1,5 @@
 """Gets raw data from Reddit and writes to Postgres DB."""
+from lib.db.sql.maintain_partitions import main as maintain_partitions
 from lib.helper import track_function_runtime
 from services.sync_single_subreddit.handler import main as sync_single_subreddit # noqa
 from services.sync_subreddits.handler import main as sync_subreddits
@@ -8,6 +9,7 @@ from services.sync_subreddits.handler import main as sync_subreddits
 def main() -> None:
     event = {'subreddits': 'PoliticalHumor', 'thread_sort_type': 'controversial', 'max_num_threads': 20, 'max_total_comments': 400}
     context = {}
+    maintain_partitions()
     payloads = sync_subreddits(event, context)
     for payload in payloads:
         sync_single_subreddit(payload, context)
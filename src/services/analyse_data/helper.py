@@ -62,7 +62,8 @@ def get_author_phase_data() -> pd.DataFrame:
         select_fields=[
             "author_id", "comment_id", "comment_text", "dm_text", "score"
         ],
-        where_filter=where_filter
+        where_filter=where_filter,
+        use_cache=True
     )
     # break up the scores into the individual components
     scores = df["score"].tolist()
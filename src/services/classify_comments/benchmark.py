@@ -0,0 +1,457 @@
+"""Benchmark preprocessing and classification on the synced comments.
+
+Replays the comments under `data/comments/*.csv` through each stage of
+classification, and reports how long each stage took, how many comments per
+second it processed, and its memory:
+
+- features: `obtain_string_features_dict`, with all of the features.
+- classifier_features: `obtain_string_features_dict`, with only the features
+  that the classifier needs.
+- preprocess_text: `preprocess_text`.
+- padded_sequences: preprocessing and tokenizing the comments into padded
+  sequences, in this process and in a `PreprocessingPool` of each number of
+  workers.
+- classify_text: `classify_text`, one comment at a time (on a sample).
+- classify_padded_sequences: model inference only, at each batch size.
+- classify_texts: preprocessing and inference, at each batch size.
+- classify_texts_in_parallel: same, with each number of workers.
+
+Memory is reported as the change in the resident memory (RSS) of the process
+over each stage (on Linux), along with the process's peak RSS so far, which
+can't be reset between stages. Stages that use worker processes also report
+the peak RSS of the largest worker so far. With `--trace-memory`, the peak
+Python memory of each stage is traced too.
+
+The lemma cache is cleared before each stage, so that stages don't benefit
+from the lemmas of the previous ones. Stages that need the model (or the
+tokenizer) record the error instead if it can't be loaded.
+
+Results are saved as JSON, along with the commit that they were run on, and
+can be compared to the results of a previous run.
+
+Usage (from `src/`):
+    python -m services.classify_comments.benchmark [--max-comments 5000]
+        [--batch-sizes 32 256 1024] [--num-workers 2 4] [--trace-memory]
+        [--output results.json] [--compare previous_results.json]
+"""
+import argparse
+from functools import partial
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+import pandas as pd
+
+from data.helper import DATA_DIR
+from lib.helper import CURRENT_TIME_STR
+from services.classify_comments.inference import (
+    CLASSIFIER_FEATURES,
+    DEFAULT_BATCH_SIZE,
+    classify_padded_sequences,
+    classify_text,
+    classify_texts,
+    get_embedding_and_tokenizer,
+    texts_to_padded_sequences
+)
+from services.classify_comments.preprocess.lemma_cache import lemma_cache
+from services.classify_comments.preprocess.strings import (
+    obtain_string_features_dict, preprocess_text
+)
+
+COMMENTS_CORPUS_GLOB = os.path.join(DATA_DIR, "comments", "*.csv")
+BENCHMARKS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmarks"
+)
+DEFAULT_BATCH_SIZES = [32, DEFAULT_BATCH_SIZE, 1024]
+DEFAULT_NUM_WORKERS = [2, 4]
+# `classify_text` is slow enough that it's only run on a sample.
+DEFAULT_CLASSIFY_TEXT_SAMPLE_SIZE = 200
+
+
+def load_comments_corpus(max_comments: Optional[int] = None) -> list[str]:
+    """Returns the unique, non-empty comment bodies of the corpus, in a
+    deterministic order."""
+    bodies: set[str] = set()
+    for file_path in sorted(glob.glob(COMMENTS_CORPUS_GLOB)):
+        df = pd.read_csv(file_path, usecols=["body"], dtype=object)
+        bodies.update(body for body in df["body"].dropna() if body.strip())
+    return sorted(bodies)[:max_comments]
+
+
+def get_max_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident memory so far, in MB, of this process (or, with
+    `RUSAGE_CHILDREN`, of its largest child process that has exited)."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    # bytes on macOS, kilobytes on Linux.
+    return max_rss / 1e6 if sys.platform == "darwin" else max_rss / 1e3
+
+
+def get_rss_mb() -> Optional[float]:
+    """Current resident memory of this process, in MB, if it can be read
+    (i.e., on Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            num_resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return num_resident_pages * resource.getpagesize() / 1e6
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(
+    stage: str,
+    func: Callable[[], object],
+    num_comments: int,
+    trace_memory: bool = False,
+    **params: Any
+) -> dict:
+    """Runs a stage once, and returns its timing and memory. If the stage
+    fails, its error is returned instead."""
+    result: dict = {
+        "stage": stage, **params, "num_comments": num_comments, "error": None
+    }
+    lemma_cache.clear()
+    if trace_memory:
+        tracemalloc.start()
+    start_rss_mb = get_rss_mb()
+    start_time = time.perf_counter()
+    try:
+        func()
+        time_seconds = time.perf_counter() - start_time
+        end_rss_mb = get_rss_mb()
+        if trace_memory:
+            result["peak_traced_memory_mb"] = (
+                tracemalloc.get_traced_memory()[1] / 1e6
+            )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        print(format_stage_result(result))
+        return result
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    result["time_seconds"] = time_seconds
+    result["comments_per_second"] = (
+        num_comments / time_seconds if time_seconds > 0 else None
+    )
+    result["rss_delta_mb"] = (
+        end_rss_mb - start_rss_mb
+        if start_rss_mb is not None and end_rss_mb is not None else None
+    )
+    result["max_rss_mb"] = get_max_rss_mb()
+    if params.get("num_workers", 1) > 1:
+        result["workers_max_rss_mb"] = get_max_rss_mb(resource.RUSAGE_CHILDREN)
+    print(format_stage_result(result))
+    return result
+
+
+def run_preprocessing_stages(
+    texts: list[str], trace_memory: bool = False
+) -> list[dict]:
+    return [
+        run_stage(
+            "features",
+            lambda: [obtain_string_features_dict(text) for text in texts],
+            num_comments=len(texts),
+            trace_memory=trace_memory
+        ),
+        run_stage(
+            "classifier_features",
+            lambda: [
+                obtain_string_features_dict(text, features=CLASSIFIER_FEATURES)
+                for text in texts
+            ],
+            num_comments=len(texts),
+            trace_memory=trace_memory
+        ),
+        run_stage(
+            "preprocess_text",
+            lambda: [preprocess_text(text) for text in texts],
+            num_comments=len(texts),
+            trace_memory=trace_memory
+        )
+    ]
+
+
+def run_classification_stages(
+    texts: list[str],
+    batch_sizes: list[int] = DEFAULT_BATCH_SIZES,
+    num_workers_list: list[int] = DEFAULT_NUM_WORKERS,
+    classify_text_sample_size: int = DEFAULT_CLASSIFY_TEXT_SAMPLE_SIZE,
+    trace_memory: bool = False
+) -> list[dict]:
+    """Runs the stages that need the model and the tokenizer."""
+    # imported here since the pool is only needed for these stages.
+    from services.classify_comments.preprocess_pool import (
+        PreprocessingPool, classify_texts_in_parallel
+    )
+
+    model: dict = {}
+
+    def load_model() -> None:
+        model["embedding"], model["tokenizer"] = get_embedding_and_tokenizer()
+
+    results = [run_stage("load_model", load_model, num_comments=0)]
+    if results[0]["error"]:
+        return results
+    embedding, tokenizer = model["embedding"], model["tokenizer"]
+
+    padded_sequences: dict = {}
+
+    def pad_texts() -> None:
+        padded_sequences["sequences"] = texts_to_padded_sequences(
+            texts, tokenizer
+        )
+
+    results.append(run_stage(
+        "padded_sequences",
+        pad_texts,
+        num_comments=len(texts),
+        trace_memory=trace_memory,
+        num_workers=1
+    ))
+    for num_workers in num_workers_list:
+        def pad_texts_in_pool(num_workers: int = num_workers) -> None:
+            with PreprocessingPool(num_workers=num_workers) as pool:
+                pool.texts_to_padded_sequences(texts)
+
+        results.append(run_stage(
+            "padded_sequences",
+            pad_texts_in_pool,
+            num_comments=len(texts),
+            trace_memory=trace_memory,
+            num_workers=num_workers
+        ))
+
+    sample = texts[:classify_text_sample_size]
+    results.append(run_stage(
+        "classify_text",
+        lambda: [classify_text(text, embedding, tokenizer) for text in sample],
+        num_comments=len(sample),
+        trace_memory=trace_memory,
+        batch_size=1
+    ))
+    for batch_size in batch_sizes:
+        if "sequences" in padded_sequences:
+            results.append(run_stage(
+                "classify_padded_sequences",
+                partial(
+                    classify_padded_sequences,
+                    padded_sequences["sequences"],
+                    embedding,
+                    batch_size=batch_size
+                ),
+                num_comments=len(texts),
+                trace_memory=trace_memory,
+                batch_size=batch_size
+            ))
+        results.append(run_stage(
+            "classify_texts",
+            partial(
+                classify_texts, texts, embedding, tokenizer,
+                batch_size=batch_size
+            ),
+            num_comments=len(texts),
+            trace_memory=trace_memory,
+            batch_size=batch_size,
+            num_workers=1
+        ))
+    for num_workers in num_workers_list:
+        results.append(run_stage(
+            "classify_texts_in_parallel",
+            partial(
+                classify_texts_in_parallel, texts, embedding,
+                num_workers=num_workers
+            ),
+            num_comments=len(texts),
+            trace_memory=trace_memory,
+            batch_size=DEFAULT_BATCH_SIZE,
+            num_workers=num_workers
+        ))
+    return results
+
+
+def run_benchmark(
+    max_comments: Optional[int] = None,
+    batch_sizes: list[int] = DEFAULT_BATCH_SIZES,
+    num_workers_list: list[int] = DEFAULT_NUM_WORKERS,
+    classify_text_sample_size: int = DEFAULT_CLASSIFY_TEXT_SAMPLE_SIZE,
+    skip_classification: bool = False,
+    trace_memory: bool = False
+) -> dict:
+    corpus: dict = {}
+
+    def load_corpus() -> None:
+        corpus["texts"] = load_comments_corpus(max_comments=max_comments)
+
+    stage_results = [run_stage("load_corpus", load_corpus, num_comments=0)]
+    texts = corpus.get("texts", [])
+    stage_results.extend(run_preprocessing_stages(texts, trace_memory))
+    if not skip_classification:
+        stage_results.extend(run_classification_stages(
+            texts,
+            batch_sizes=batch_sizes,
+            num_workers_list=num_workers_list,
+            classify_text_sample_size=classify_text_sample_size,
+            trace_memory=trace_memory
+        ))
+    return {
+        "timestamp": CURRENT_TIME_STR,
+        "git_commit": get_git_commit(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "num_comments": len(texts),
+        "trace_memory": trace_memory,
+        "stages": stage_results
+    }
+
+
+def get_stage_key(result: dict) -> tuple:
+    return (
+        result["stage"], result.get("batch_size"), result.get("num_workers")
+    )
+
+
+def compare_results(results: dict, previous_results: dict) -> list[dict]:
+    """Returns the speedup of each stage over a previous run (throughput
+    divided by the previous throughput)."""
+    key_to_previous_result = {
+        get_stage_key(result): result for result in previous_results["stages"]
+    }
+    comparisons = []
+    for result in results["stages"]:
+        previous_result = key_to_previous_result.get(get_stage_key(result))
+        if (
+            previous_result is None
+            or not result.get("comments_per_second")
+            or not previous_result.get("comments_per_second")
+        ):
+            continue
+        comparisons.append({
+            "stage": result["stage"],
+            "batch_size": result.get("batch_size"),
+            "num_workers": result.get("num_workers"),
+            "comments_per_second": result["comments_per_second"],
+            "previous_comments_per_second": (
+                previous_result["comments_per_second"]
+            ),
+            "speedup": (
+                result["comments_per_second"]
+                / previous_result["comments_per_second"]
+            )
+        })
+    return comparisons
+
+
+def get_stage_name(result: dict) -> str:
+    params = ", ".join(
+        f"{param}={result[param]}" for param in ["batch_size", "num_workers"]
+        if result.get(param) is not None
+    )
+    return f"{result['stage']} ({params})" if params else result["stage"]
+
+
+def format_stage_result(result: dict) -> str:
+    name = get_stage_name(result)
+    if result["error"]:
+        # errors (e.g., NLTK's missing resource errors) can span many lines.
+        error_lines = [
+            line.strip() for line in result["error"].splitlines()
+            if line.strip().strip("*")
+        ]
+        return f"{name}: failed ({' '.join(error_lines[:2])})"
+    comments_per_second = (
+        f", {result['comments_per_second']:.1f} comments/s"
+        if result["num_comments"] and result["comments_per_second"] else ""
+    )
+    rss_delta = (
+        f", RSS {result['rss_delta_mb']:+.0f} MB"
+        if result["rss_delta_mb"] is not None else ""
+    )
+    workers_max_rss = (
+        f", workers' max RSS {result['workers_max_rss_mb']:.0f} MB"
+        if "workers_max_rss_mb" in result else ""
+    )
+    return (
+        f"{name}: {result['time_seconds']:.2f}s{comments_per_second}"
+        f"{rss_delta} (max RSS {result['max_rss_mb']:.0f} MB)"
+        f"{workers_max_rss}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark preprocessing and classification on the comments corpus." # noqa
+    )
+    parser.add_argument(
+        "--max-comments",
+        type=int,
+        default=None,
+        help="Number of comments to benchmark on (default: all)."
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES
+    )
+    parser.add_argument(
+        "--num-workers", type=int, nargs="+", default=DEFAULT_NUM_WORKERS
+    )
+    parser.add_argument(
+        "--classify-text-sample-size",
+        type=int,
+        default=DEFAULT_CLASSIFY_TEXT_SAMPLE_SIZE
+    )
+    parser.add_argument(
+        "--skip-classification",
+        action="store_true",
+        help="Only benchmark preprocessing (doesn't need the model)."
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also report the peak Python memory of each stage (slows the stages down)." # noqa
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(BENCHMARKS_DIR, f"{CURRENT_TIME_STR}.json")
+    )
+    parser.add_argument(
+        "--compare", default=None, help="Results of a previous run."
+    )
+    args = parser.parse_args()
+    results = run_benchmark(
+        max_comments=args.max_comments,
+        batch_sizes=args.batch_sizes,
+        num_workers_list=args.num_workers,
+        classify_text_sample_size=args.classify_text_sample_size,
+        skip_classification=args.skip_classification,
+        trace_memory=args.trace_memory
+    )
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = compare_results(results, json.load(f))
+        for comparison in results["comparison"]:
+            print(f"{get_stage_name(comparison)}: {comparison['speedup']:.2f}x") # noqa
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}.")
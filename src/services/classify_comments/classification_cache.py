@@ -0,0 +1,187 @@
+"""Cache of classifications, keyed by the model and the text.
+
+Identical texts (reposted copypasta, bot replies, "This.", "lol") get the
+same classification, so the `classification_cache` table maps
+(model hash, text hash) to (prob, label), and only the texts that aren't in
+it are sent to the model.
+
+The model hash is a hash of the contents of the model and tokenizer files
+(`MODEL_NAME`, or `TFLITE_MODEL_FILE`, and `TOKENIZER_JOBLIB_FILE`) and of
+the settings that turn predictions into labels, so pointing either at a
+different file, or retraining the model in place, starts from an empty cache
+without having to clear anything. Texts are hashed after collapsing whitespace, since the
+preprocessing ignores it.
+"""
+import hashlib
+import os
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from lib.db.sql.helper import (
+    check_if_table_exists, load_table_as_df, write_df_to_database
+)
+from services.classify_comments.inference import (
+    LABEL_THRESHOLD,
+    MAX_SEQUENCE_LENGTH,
+    MODEL_BACKEND,
+    MODEL_NAME,
+    TFLITE_MODEL_FILE,
+    TOKENIZER_JOBLIB_FILE
+)
+
+table_name = "classification_cache"
+# number of hashes to look up per query.
+LOOKUP_CHUNK_SIZE = 5000
+
+# (file path, modification time, size) -> hash of the file, so that files
+# are only hashed again when they change.
+file_hashes: dict[tuple[str, float, int], str] = {}
+
+
+def get_file_hash(file_path: str) -> str:
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime, stat.st_size)
+    if key not in file_hashes:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        file_hashes[key] = sha256.hexdigest()
+    return file_hashes[key]
+
+
+def get_model_hash(
+    model_name: Optional[str] = None,
+    tokenizer_joblib_file: str = TOKENIZER_JOBLIB_FILE
+) -> str:
+    """Returns a hash of the model and tokenizer artifacts and of the
+    settings that turn their predictions into labels. The model defaults to
+    the artifact of `MODEL_BACKEND`."""
+    if model_name is None:
+        model_name = (
+            TFLITE_MODEL_FILE if MODEL_BACKEND == "tflite" else MODEL_NAME
+        )
+    return hashlib.sha256(
+        "|".join([
+            get_file_hash(model_name),
+            get_file_hash(tokenizer_joblib_file),
+            str(LABEL_THRESHOLD),
+            str(MAX_SEQUENCE_LENGTH)
+        ]).encode("utf-8")
+    ).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace, which doesn't change the classification."""
+    return " ".join(str(text).split())
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def lookup_cached_classifications(
+    model_hash: str, text_hashes: list[str]
+) -> dict[str, Tuple[float, int]]:
+    """Returns the cached (prob, label) of each text hash that's in the
+    cache, looking them up a chunk at a time."""
+    if not text_hashes or not check_if_table_exists(table_name):
+        return {}
+    text_hash_to_classification: dict[str, Tuple[float, int]] = {}
+    for i in range(0, len(text_hashes), LOOKUP_CHUNK_SIZE):
+        # hashes are hex digests, so they're safe to put in the query.
+        text_hashes_list = ", ".join(
+            f"'{text_hash}'"
+            for text_hash in text_hashes[i:i + LOOKUP_CHUNK_SIZE]
+        )
+        df = load_table_as_df(
+            table_name=table_name,
+            select_fields=["text_hash", "prob", "label"],
+            where_filter=f"""
+                WHERE model_hash = '{model_hash}'
+                AND text_hash IN ({text_hashes_list})
+            """
+        )
+        for text_hash, prob, label in df.itertuples(index=False):
+            text_hash_to_classification[text_hash] = (float(prob), int(label))
+    return text_hash_to_classification
+
+
+def cache_classifications(
+    model_hash: str,
+    text_hashes: list[str],
+    probs: np.ndarray,
+    labels: np.ndarray
+) -> None:
+    """Caches the classifications of texts. A failed write is printed rather
+    than raised, since the caller already has the classifications; the texts
+    are just classified again the next time they're seen."""
+    if not text_hashes:
+        return
+    df = pd.DataFrame({
+        "model_hash": model_hash,
+        "text_hash": text_hashes,
+        "prob": np.asarray(probs, dtype=float),
+        "label": np.asarray(labels, dtype=int)
+    })
+    write_result = write_df_to_database(
+        df=df, table_name=table_name, upsert=True
+    )
+    if write_result.num_rows_written == 0:
+        print(
+            f"Unable to cache the classifications of {len(df)} texts in "
+            f"{table_name}. They'll be classified again next time."
+        )
+
+
+def classify_texts_with_cache(
+    texts: list[str],
+    classify_texts: Callable[[list[str]], Tuple[np.ndarray, np.ndarray]],
+    model_hash: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Classifies texts, only sending the texts that aren't in the cache (and
+    only one copy of each) to `classify_texts`, and caching the results.
+
+    Returns a tuple of (probabilities, labels) arrays, both of shape
+    (len(texts),).
+    """
+    text_hashes = [get_text_hash(text) for text in texts]
+    text_hash_to_classification = lookup_cached_classifications(
+        model_hash=model_hash, text_hashes=list(set(text_hashes))
+    )
+    text_hash_to_missing_text: dict[str, str] = {}
+    for text_hash, text in zip(text_hashes, texts):
+        if text_hash not in text_hash_to_classification:
+            text_hash_to_missing_text.setdefault(text_hash, text)
+    num_cached_texts = sum(
+        1 for text_hash in text_hashes
+        if text_hash in text_hash_to_classification
+    )
+    print(
+        f"Classification cache: {num_cached_texts}/{len(texts)} texts "
+        f"cached, classifying {len(text_hash_to_missing_text)} unique texts."
+    )
+    if text_hash_to_missing_text:
+        missing_text_hashes = list(text_hash_to_missing_text.keys())
+        probs, labels = classify_texts(
+            list(text_hash_to_missing_text.values())
+        )
+        cache_classifications(
+            model_hash=model_hash,
+            text_hashes=missing_text_hashes,
+            probs=probs,
+            labels=labels
+        )
+        for text_hash, prob, label in zip(missing_text_hashes, probs, labels):
+            text_hash_to_classification[text_hash] = (float(prob), int(label))
+    probs = np.array(
+        [text_hash_to_classification[text_hash][0] for text_hash in text_hashes], # noqa
+        dtype=np.float32
+    )
+    labels = np.array(
+        [text_hash_to_classification[text_hash][1] for text_hash in text_hashes], # noqa
+        dtype=int
+    )
+    return probs, labels
@@ -0,0 +1,213 @@
+"""Queue of comments that still need to be classified.
+
+Rather than scanning `comments` for ids that aren't in `classified_comments`
+on every run, the sync adds each comment that it writes to the
+`classification_queue` table, in the same transaction as the comment (see
+`sync_single_subreddit/helper.py`). Classifiers then work through the queue:
+
+1. A worker claims the next comments, oldest first (ordered by
+(synctimestamp, id), so the order is deterministic), by stamping them with
+its id and the claim time. On Postgres, the claim uses `FOR UPDATE SKIP
+LOCKED`, so concurrent workers claim disjoint comments without waiting on
+each other. SQLite only has one writer at a time, so claims are serialized.
+2. It classifies them and upserts them into `classified_comments`.
+3. It removes them from the queue.
+
+A claim is a lease: comments that were claimed more than `lease_seconds` ago
+(e.g., by a worker that crashed) can be claimed again, so a run can always be
+resumed. Since classifications are upserted, a comment that's classified
+twice is just overwritten.
+"""
+from datetime import datetime, timedelta, timezone
+import os
+import socket
+from typing import Any, Optional
+import uuid
+
+import pandas as pd
+
+from lib.db.sql import sqlite_helper
+from lib.db.sql.helper import DB_BACKEND, bump_table_write_version, conn
+
+table_name = "classification_queue"
+DEFAULT_LEASE_SECONDS = 30 * 60
+# number of comments that a worker claims at once.
+DEFAULT_CLAIM_SIZE = 1000
+
+create_table_statements = [
+    f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id text PRIMARY KEY,
+            synctimestamp timestamptz,
+            claimed_at timestamptz,
+            claimed_by text
+        );
+    """,
+    f"""
+        CREATE INDEX IF NOT EXISTS {table_name}_synctimestamp_id_idx
+        ON {table_name} (synctimestamp, id);
+    """
+]
+
+
+def get_worker_id() -> str:
+    """Unique id of a classifier worker, e.g. "myhost-1234-0f3c2a1b"."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def build_classification_queue_df(comments_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the rows of the queue for comments that were just synced."""
+    return comments_df[["id", "synctimestamp"]].copy()
+
+
+class ClassificationQueue:
+    def __init__(
+        self,
+        conn: Any,
+        backend: str = DB_BACKEND,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> None:
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.placeholder = "?" if backend == "sqlite" else "%s"
+
+    def bump_write_version(self) -> None:
+        """Invalidates cached queries on the queue (see
+        `lib/db/sql/query_cache.py`), in the transaction of the write."""
+        bump_table_write_version(
+            table_name=table_name,
+            write_cursor=self.cursor,
+            backend=self.backend
+        )
+
+    def check_if_table_exists(self, table_name: str) -> bool:
+        if self.backend == "sqlite":
+            return sqlite_helper.check_if_table_exists(self.cursor, table_name)
+        self.cursor.execute("SELECT to_regclass(%s);", (table_name,))
+        return self.cursor.fetchone()[0] is not None
+
+    def create_table(self) -> int:
+        """Creates the queue if it doesn't exist yet, and fills it with the
+        comments that haven't been classified. Returns the number of comments
+        that were added."""
+        if self.check_if_table_exists(table_name):
+            return 0
+        for statement in create_table_statements:
+            self.cursor.execute(statement)
+        num_comments_added = self.backfill()
+        self.bump_write_version()
+        self.conn.commit()
+        print(f"Created {table_name} with {num_comments_added} comments to classify.") # noqa
+        return num_comments_added
+
+    def backfill(self) -> int:
+        """Adds the comments that haven't been classified to the queue,
+        without committing."""
+        if not self.check_if_table_exists("comments"):
+            return 0
+        where_filter = """
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM classified_comments
+                WHERE classified_comments.id = comments.id
+                AND classified_comments.is_classified = TRUE
+            )
+        """ if self.check_if_table_exists("classified_comments") else "WHERE TRUE" # noqa
+        self.cursor.execute(f"""
+            INSERT INTO {table_name} (id, synctimestamp)
+            SELECT id, MIN(synctimestamp)
+            FROM comments
+            {where_filter}
+            GROUP BY id
+            ON CONFLICT (id) DO NOTHING;
+        """)
+        return self.cursor.rowcount
+
+    def claim(
+        self, worker_id: str, num_comments: int = DEFAULT_CLAIM_SIZE
+    ) -> list[str]:
+        """Claims the next comments to classify, and commits the claim.
+        Returns their ids, oldest first."""
+        now = datetime.now(timezone.utc)
+        lease_expiry = (now - timedelta(seconds=self.lease_seconds)).isoformat()
+        lock_clause = "FOR UPDATE SKIP LOCKED" if self.backend == "postgres" else "" # noqa
+        p = self.placeholder
+        self.cursor.execute(
+            f"""
+                UPDATE {table_name}
+                SET claimed_at = {p}, claimed_by = {p}
+                WHERE id IN (
+                    SELECT id
+                    FROM {table_name}
+                    WHERE claimed_at IS NULL OR claimed_at < {p}
+                    ORDER BY synctimestamp, id
+                    LIMIT {p}
+                    {lock_clause}
+                )
+                RETURNING id, synctimestamp;
+            """,
+            (now.isoformat(), worker_id, lease_expiry, num_comments)
+        )
+        claimed_rows = self.cursor.fetchall()
+        self.bump_write_version()
+        self.conn.commit()
+        # RETURNING doesn't keep the order of the subquery.
+        return [
+            comment_id for comment_id, _ in sorted(
+                claimed_rows, key=lambda row: (str(row[1]), row[0])
+            )
+        ]
+
+    def get_ids_filter(self, comment_ids: list[str]) -> tuple[str, tuple]:
+        if self.backend == "sqlite":
+            placeholders = ", ".join(["?"] * len(comment_ids))
+            return f"id IN ({placeholders})", tuple(comment_ids)
+        return "id = ANY(%s)", (list(comment_ids),)
+
+    def complete(self, comment_ids: list[str], worker_id: str) -> int:
+        """Removes classified comments from the queue, and commits. Comments
+        whose claim has since been taken over by another worker are left for
+        that worker. Returns the number of comments removed."""
+        if not comment_ids:
+            return 0
+        ids_filter, params = self.get_ids_filter(comment_ids)
+        self.cursor.execute(
+            f"DELETE FROM {table_name} WHERE {ids_filter} AND claimed_by = {self.placeholder};", # noqa
+            (*params, worker_id)
+        )
+        num_comments_removed = self.cursor.rowcount
+        self.bump_write_version()
+        self.conn.commit()
+        return num_comments_removed
+
+    def release(self, comment_ids: list[str], worker_id: str) -> None:
+        """Releases the claim on comments (e.g., if classifying them failed),
+        so that they can be claimed again right away."""
+        if not comment_ids:
+            return
+        ids_filter, params = self.get_ids_filter(comment_ids)
+        self.cursor.execute(
+            f"""
+                UPDATE {table_name}
+                SET claimed_at = NULL, claimed_by = NULL
+                WHERE {ids_filter} AND claimed_by = {self.placeholder};
+            """,
+            (*params, worker_id)
+        )
+        self.bump_write_version()
+        self.conn.commit()
+
+    def get_num_comments(self, claimed: Optional[bool] = None) -> int:
+        """Number of comments in the queue (only claimed or unclaimed ones,
+        if `claimed` is given)."""
+        where_filter = "" if claimed is None else (
+            "WHERE claimed_at IS NOT NULL" if claimed
+            else "WHERE claimed_at IS NULL"
+        )
+        self.cursor.execute(f"SELECT COUNT(*) FROM {table_name} {where_filter};") # noqa
+        return self.cursor.fetchone()[0]
+
+
+classification_queue = ClassificationQueue(conn)
@@ -0,0 +1,214 @@
+"""Export the Keras GRU model to TensorFlow Lite, and check its parity.
+
+The exported model is used for classification with `MODEL_BACKEND=tflite`
+(see `inference.py`). With `--quantize int8`, the weights are quantized to
+8-bit integers (dynamic range quantization), which makes the artifact about
+4x smaller and faster on CPU, at the cost of slightly different
+probabilities.
+
+After exporting, both models classify the stored `classified_comments`, and
+a parity report (probability differences, label agreement, load times and
+per-batch latencies) is written next to the artifact. The export is
+considered to be at parity if at least `MIN_LABEL_AGREEMENT` of the labels
+match and no probability differs by more than `MAX_PROB_DIFF`. The model is
+exported to a candidate file next to the artifact, which only replaces the
+artifact once it's at parity (or the report is skipped). If it isn't, the
+candidate is deleted, the existing artifact is kept, and the script exits
+with a non-zero status.
+
+Usage:
+    python -m services.classify_comments.export_model [--quantize int8]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Optional, Union
+
+import numpy as np
+import tensorflow as tf
+
+from lib.db.sql.helper import load_table_as_df
+from services.classify_comments.inference import (
+    DEFAULT_BATCH_SIZE,
+    MODEL_NAME,
+    TFLITE_MODEL_FILE,
+    TOKENIZER_JOBLIB_FILE,
+    classify_padded_sequences,
+    load_embedding_and_tokenizer,
+    load_tflite_embedding_and_tokenizer,
+    texts_to_padded_sequences,
+    threshold_acc
+)
+
+if TYPE_CHECKING:
+    from keras.models import Model
+
+    from services.classify_comments.tflite_model import TFLiteModel
+
+# documented tolerance of an exported model, compared to the .h5 model.
+MIN_LABEL_AGREEMENT = 0.995
+MAX_PROB_DIFF = 0.05
+
+
+def export_to_tflite(
+    model_name: str = MODEL_NAME,
+    output_file: str = TFLITE_MODEL_FILE,
+    quantize: Optional[str] = None
+) -> str:
+    """Converts the Keras model to a TFLite file. Returns its path."""
+    model, _ = load_embedding_and_tokenizer(
+        model_name, TOKENIZER_JOBLIB_FILE, threshold_acc
+    )
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    try:
+        tflite_model = converter.convert()
+    except Exception as e:
+        # some TF versions can't lower the GRU's loop to builtin ops, in
+        # which case the TF ops are kept (needs the full TF interpreter).
+        print(f"Unable to convert with builtin ops only ({e}), retrying with TF ops...") # noqa
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS
+        ]
+        tflite_model = converter.convert()
+    with open(output_file, "wb") as f:
+        f.write(tflite_model)
+    print(f"Exported {model_name} to {output_file} ({len(tflite_model) / 1e6:.1f} MB).") # noqa
+    return output_file
+
+
+def get_candidate_file(output_file: str) -> str:
+    """Path that a model is exported to before it replaces `output_file`, in
+    the same directory so that `os.replace` is atomic."""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.candidate{ext}"
+
+
+def time_batches(
+    model: Union["Model", "TFLiteModel"],
+    padded_sequences: np.ndarray,
+    batch_size: int
+) -> dict:
+    """Returns the per-batch latencies (ms) of classifying the sequences."""
+    latencies_ms = []
+    for i in range(0, len(padded_sequences), batch_size):
+        start_time = time.perf_counter()
+        model.predict(
+            padded_sequences[i:i + batch_size], batch_size=batch_size, verbose=0
+        )
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+    return {
+        "p50": float(np.percentile(latencies_ms, 50)),
+        "p90": float(np.percentile(latencies_ms, 90)),
+        "mean": float(np.mean(latencies_ms))
+    }
+
+
+def generate_parity_report(
+    tflite_model_file: str = TFLITE_MODEL_FILE,
+    model_name: str = MODEL_NAME,
+    num_comments: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> dict:
+    """Classifies the stored classified comments with both models and
+    compares the results."""
+    limit = f"LIMIT {num_comments}" if num_comments else ""
+    comments_df = load_table_as_df(
+        table_name="classified_comments",
+        select_fields=["id", "body", "label"],
+        limit_clause=limit
+    )
+    texts = comments_df["body"].fillna("").tolist()
+
+    start_time = time.perf_counter()
+    keras_model, tokenizer = load_embedding_and_tokenizer(
+        model_name, TOKENIZER_JOBLIB_FILE, threshold_acc
+    )
+    keras_load_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    tflite_model, _ = load_tflite_embedding_and_tokenizer(
+        tflite_model_file, TOKENIZER_JOBLIB_FILE
+    )
+    tflite_load_time = time.perf_counter() - start_time
+
+    padded_sequences = texts_to_padded_sequences(texts, tokenizer)
+    keras_probs, keras_labels = classify_padded_sequences(
+        padded_sequences, keras_model, batch_size=batch_size
+    )
+    tflite_probs, tflite_labels = classify_padded_sequences(
+        padded_sequences, tflite_model, batch_size=batch_size
+    )
+    prob_diffs = np.abs(keras_probs - tflite_probs)
+    label_agreement = float(np.mean(keras_labels == tflite_labels))
+    max_prob_diff = float(prob_diffs.max()) if len(texts) else 0.0
+    report: dict[str, Any] = {
+        "tflite_model_file": tflite_model_file,
+        "tflite_model_size_mb": os.path.getsize(tflite_model_file) / 1e6,
+        "keras_model_size_mb": os.path.getsize(model_name) / 1e6,
+        "num_comments": len(texts),
+        "label_agreement": label_agreement,
+        "num_label_changes": int(np.sum(keras_labels != tflite_labels)),
+        "max_prob_diff": max_prob_diff,
+        "mean_prob_diff": float(prob_diffs.mean()) if len(texts) else 0.0,
+        "stored_label_agreement": {
+            "keras": float(np.mean(keras_labels == comments_df["label"])),
+            "tflite": float(np.mean(tflite_labels == comments_df["label"]))
+        },
+        "load_time_seconds": {
+            "keras": keras_load_time, "tflite": tflite_load_time
+        },
+        "batch_latency_ms": {
+            "keras": time_batches(keras_model, padded_sequences, batch_size),
+            "tflite": time_batches(tflite_model, padded_sequences, batch_size)
+        },
+        "tolerance": {
+            "min_label_agreement": MIN_LABEL_AGREEMENT,
+            "max_prob_diff": MAX_PROB_DIFF
+        }
+    }
+    report["is_at_parity"] = (
+        label_agreement >= MIN_LABEL_AGREEMENT
+        and max_prob_diff <= MAX_PROB_DIFF
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the GRU model to TensorFlow Lite."
+    )
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--output-file", default=TFLITE_MODEL_FILE)
+    parser.add_argument("--quantize", choices=["int8"], default=None)
+    parser.add_argument(
+        "--num-comments",
+        type=int,
+        default=None,
+        help="Number of classified comments to check parity on (default: all)." # noqa
+    )
+    parser.add_argument("--skip-parity-report", action="store_true")
+    args = parser.parse_args()
+    candidate_file = export_to_tflite(
+        model_name=args.model_name,
+        output_file=get_candidate_file(args.output_file),
+        quantize=args.quantize
+    )
+    if not args.skip_parity_report:
+        report = generate_parity_report(
+            tflite_model_file=candidate_file,
+            model_name=args.model_name,
+            num_comments=args.num_comments
+        )
+        report_file = f"{args.output_file}.parity.json"
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
+        if not report["is_at_parity"]:
+            os.remove(candidate_file)
+            print(f"ERROR: the export isn't at parity with {args.model_name}, keeping the existing {args.output_file}.") # noqa
+            sys.exit(1)
+    os.replace(candidate_file, args.output_file)
+    print(f"Replaced {args.output_file} with the export.")
@@ -6,13 +6,23 @@ even be a batch of size 1.
 # NOTE: need to import the necessary models outside of
 # the main function, otherwise the lambda function
 # will import the models every time it is called
+from services.classify_comments.classification_queue import DEFAULT_CLAIM_SIZE
 from services.classify_comments.helper import classify_comments
+from services.classify_comments.inference import DEFAULT_BATCH_SIZE
 
 def main(event: dict, context: dict) -> int:
     classify_new_comments_only = event.get("classify_new_comments_only", True)
     num_comments_to_classify = event.get("num_comments_to_classify", None)
+    batch_size = event.get("batch_size", DEFAULT_BATCH_SIZE)
+    num_workers = event.get("num_workers", 1)
+    use_classification_cache = event.get("use_classification_cache", True)
+    claim_size = event.get("claim_size", DEFAULT_CLAIM_SIZE)
     classify_comments(
         classify_new_comments_only=classify_new_comments_only,
-        num_comments_to_classify=num_comments_to_classify
+        num_comments_to_classify=num_comments_to_classify,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        use_classification_cache=use_classification_cache,
+        claim_size=claim_size
     )
     return 0
@@ -1,12 +1,23 @@
-from typing import Optional
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
 
 from data.helper import dump_df_to_csv
-from lib.db.sql.helper import (
-    check_if_table_exists, load_table_as_df, write_df_to_database
-)
+from lib.db.sql.helper import load_table_as_df, write_df_to_database
 from lib.helper import CURRENT_TIME_STR
+from services.classify_comments.classification_cache import (
+    classify_texts_with_cache, get_model_hash
+)
+from services.classify_comments.classification_queue import (
+    DEFAULT_CLAIM_SIZE, classification_queue, get_worker_id
+)
 from services.classify_comments.inference import (
-    classify_text, load_default_embedding_and_tokenizer
+    DEFAULT_BATCH_SIZE, classify_texts, get_embedding_and_tokenizer
+)
+from services.classify_comments.preprocess.lemma_cache import lemma_cache
+from services.classify_comments.preprocess_pool import (
+    PreprocessingPool, classify_texts_in_parallel
 )
 
 table_name = "classified_comments"
@@ -14,34 +25,28 @@ subset_columns = [
     "id", "author_screen_name", "author_id", "body", "permalink",
     "created_utc", "subreddit_name_prefixed"
 ]
-embedding, tokenizer = load_default_embedding_and_tokenizer()
 
 
-def classify_comments(
-    classify_new_comments_only: bool = True,
-    num_comments_to_classify: Optional[int] = None
-) -> None:
-    classified_comments_table_exists = check_if_table_exists(table_name)
-    select_fields = ["*"]
-    where_filter = f"""
-        WHERE id NOT IN (
-            SELECT
-                id
-            FROM {table_name}
-            WHERE is_classified = TRUE
-        )
-    """ if classified_comments_table_exists and classify_new_comments_only else "" # noqa
-    limit = f"LIMIT {num_comments_to_classify}" if num_comments_to_classify else "" # noqa
-    comments_df = load_table_as_df(
-        table_name="comments",
-        select_fields=select_fields,
-        where_filter=where_filter,
-        limit_clause=limit
-    )
-    if comments_df.shape[0] == 0:
-        print("No new comments to classify...")
-        return
+def build_classified_comments_df(
+    comments_df: pd.DataFrame, probs: np.ndarray, labels: np.ndarray
+) -> pd.DataFrame:
+    """Returns the rows of `classified_comments` for comments, given their
+    probabilities and labels (in the same order as `comments_df`)."""
+    classified_comments_df = comments_df[subset_columns].copy()
+    classified_comments_df["prob"] = probs
+    classified_comments_df["label"] = labels
+    classified_comments_df["is_classified"] = True
+    classified_comments_df["classification_timestamp"] = CURRENT_TIME_STR
+    return classified_comments_df
+
 
+def classify_and_write_comments(
+    comments_df: pd.DataFrame,
+    classify: Callable[[list[str]], tuple[np.ndarray, np.ndarray]],
+    use_classification_cache: bool = True
+) -> pd.DataFrame:
+    """Classifies comments, and upserts them into `classified_comments`.
+    Returns their rows of `classified_comments`."""
     # get only the subset of relevant columns from comments df that we want in
     # the table of classified comments. These are the information that we need
     # to (1) uniquely identify the comment + author and (2) populate the DM
@@ -50,29 +55,164 @@ def classify_comments(
 
     print(f"Number of comments to classify: {comments_df.shape[0]}")
 
-    # classify
     texts_to_classify = comments_df["body"].tolist()
-    
-    probs: list[float] = []
-    labels: list[int] = []
-
-    for idx, text in enumerate(texts_to_classify):
-        if idx % 50 == 0 and idx != 0:
-            print(f"Classifying comment {idx} of {len(texts_to_classify)}...")
-        prob, label = classify_text(text, embedding, tokenizer)
-        probs.append(prob[0]) # returned as n=1 np.array, so need to extract
-        labels.append(label)
-
-    comments_df["prob"] = probs
-    comments_df["label"] = labels
-    comments_df["is_classified"] = True
-    comments_df["classification_timestamp"] = CURRENT_TIME_STR
+    if use_classification_cache:
+        probs, labels = classify_texts_with_cache(
+            texts_to_classify, classify, model_hash=get_model_hash()
+        )
+    else:
+        probs, labels = classify(texts_to_classify)
+
+    comments_df = build_classified_comments_df(comments_df, probs, labels)
 
     print(f"Classified {comments_df.shape[0]} comments.")
-    print(f"Number of comments classified as having outrage: {sum(labels)}")
-    print(f"Number of comments classified as not having outrage: {len(labels) - sum(labels)}") # noqa
+    print(f"Number of comments classified as having outrage: {labels.sum()}")
+    print(f"Number of comments classified as not having outrage: {len(labels) - labels.sum()}") # noqa
 
-    # write to CSV, upload to DB. Should not have to upsert since we only
-    # classify comments that we haven't seen before.
+    # write to CSV, upload to DB. Upserted, since a comment whose claim
+    # expired (see `classification_queue`) can be classified twice.
     dump_df_to_csv(df=comments_df, table_name=table_name)
-    write_df_to_database(df=comments_df, table_name=table_name)
+    write_df_to_database(df=comments_df, table_name=table_name, upsert=True)
+    return comments_df
+
+
+def load_comments_by_ids(comment_ids: list[str]) -> pd.DataFrame:
+    """Loads comments, in the order of `comment_ids`."""
+    # ids are base-36 Reddit ids, so they're safe to put in the query.
+    comment_ids_list = ", ".join(f"'{comment_id}'" for comment_id in comment_ids)
+    comments_df = load_table_as_df(
+        table_name="comments",
+        select_fields=subset_columns,
+        where_filter=f"WHERE id IN ({comment_ids_list})",
+        use_cache=False
+    )
+    comments_df = comments_df.drop_duplicates(subset=["id"], keep="last")
+    id_to_position = {
+        comment_id: position for position, comment_id in enumerate(comment_ids)
+    }
+    return comments_df.sort_values(
+        "id", key=lambda ids: ids.map(id_to_position)
+    ).reset_index(drop=True)
+
+
+def classify_all_comments(
+    classify: Callable[[list[str]], tuple[np.ndarray, np.ndarray]],
+    num_comments_to_classify: Optional[int] = None,
+    use_classification_cache: bool = True
+) -> None:
+    """(Re)classifies all comments, oldest first."""
+    limit = f"LIMIT {num_comments_to_classify}" if num_comments_to_classify else "" # noqa
+    comments_df = load_table_as_df(
+        table_name="comments",
+        select_fields=subset_columns,
+        order_by_clause="ORDER BY synctimestamp, id",
+        limit_clause=limit
+    )
+    if comments_df.shape[0] == 0:
+        print("No comments to classify...")
+        return
+    classify_and_write_comments(
+        comments_df, classify, use_classification_cache
+    )
+
+
+def classify_queued_comments(
+    classify: Callable[[list[str]], tuple[np.ndarray, np.ndarray]],
+    num_comments_to_classify: Optional[int] = None,
+    use_classification_cache: bool = True,
+    claim_size: int = DEFAULT_CLAIM_SIZE
+) -> None:
+    """Classifies the comments in the `classification_queue`, claiming
+    `claim_size` at a time."""
+    classification_queue.create_table()
+    worker_id = get_worker_id()
+    num_comments_classified = 0
+    while (
+        num_comments_to_classify is None
+        or num_comments_classified < num_comments_to_classify
+    ):
+        num_comments_to_claim = claim_size if num_comments_to_classify is None else min( # noqa
+            claim_size, num_comments_to_classify - num_comments_classified
+        )
+        comment_ids = classification_queue.claim(
+            worker_id=worker_id, num_comments=num_comments_to_claim
+        )
+        if not comment_ids:
+            break
+        print(f"Claimed {len(comment_ids)} comments to classify.")
+        try:
+            comments_df = load_comments_by_ids(comment_ids)
+            if comments_df.shape[0] > 0:
+                classify_and_write_comments(
+                    comments_df, classify, use_classification_cache
+                )
+        except Exception:
+            classification_queue.release(comment_ids, worker_id=worker_id)
+            raise
+        # comments that no longer exist are dropped from the queue as well.
+        classification_queue.complete(comment_ids, worker_id=worker_id)
+        num_comments_classified += len(comment_ids)
+
+    if num_comments_classified == 0:
+        print("No new comments to classify...")
+        return
+    print(f"Classified {num_comments_classified} comments from the queue.")
+    print(f"Comments left in the queue: {classification_queue.get_num_comments()}") # noqa
+    # with a pool, this includes the lookups of the workers.
+    print(f"Lemma cache: {lemma_cache.stats}")
+
+
+def classify_comments(
+    classify_new_comments_only: bool = True,
+    num_comments_to_classify: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_workers: int = 1,
+    use_classification_cache: bool = True,
+    claim_size: int = DEFAULT_CLAIM_SIZE
+) -> None:
+    """Classifies comments. With `num_workers` > 1, the comments are
+    preprocessed in a pool of that many processes (see `preprocess_pool`),
+    which is worth it for large backlogs. The pool is started the first time
+    that there's something to classify, and reused for the rest of the run.
+    With `use_classification_cache`, only comments whose text hasn't been
+    classified by the current model are sent to the model (see
+    `classification_cache`).
+
+    With `classify_new_comments_only`, the comments to classify are claimed
+    from the `classification_queue`, `claim_size` at a time, so several
+    classifiers can run at once, and an interrupted run picks up where it
+    left off. Otherwise, all comments are (re)classified."""
+    pool: Optional[PreprocessingPool] = None
+
+    def classify(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        nonlocal pool
+        # the model is only loaded if there's something to classify that
+        # isn't cached.
+        embedding, tokenizer = get_embedding_and_tokenizer()
+        if num_workers > 1:
+            if pool is None:
+                pool = PreprocessingPool(num_workers=num_workers)
+            return classify_texts_in_parallel(
+                texts, embedding, batch_size=batch_size, pool=pool
+            )
+        return classify_texts(
+            texts, embedding, tokenizer, batch_size=batch_size
+        )
+
+    try:
+        if classify_new_comments_only:
+            classify_queued_comments(
+                classify,
+                num_comments_to_classify=num_comments_to_classify,
+                use_classification_cache=use_classification_cache,
+                claim_size=claim_size
+            )
+        else:
+            classify_all_comments(
+                classify,
+                num_comments_to_classify=num_comments_to_classify,
+                use_classification_cache=use_classification_cache
+            )
+    finally:
+        if pool is not None:
+            pool.close()
@@ -1,23 +1,48 @@
+"""Classify texts with the GRU model.
+
+TensorFlow/Keras take seconds to import, so they're only imported when a
+model is loaded or used, rather than when this module is imported. Use
+`get_embedding_and_tokenizer` to get the model: it's loaded the first time
+that it's needed and then reused, and `start_warm_up` loads it in a
+background thread ahead of time.
+"""
 from joblib import load
 import os
-from typing import Callable, Tuple
+import threading
+from typing import TYPE_CHECKING, Callable, Optional, Tuple, Union
 
-from keras import backend as K
-from keras.models import load_model, Model
-from keras.preprocessing.text import Tokenizer
-from keras.utils import pad_sequences
-import pandas as pd
-import tensorflow as tf
+import numpy as np
 
 from lib.helper import ROOT_DIR
 from services.classify_comments.preprocess.strings import obtain_string_features_dict # noqa
 
+if TYPE_CHECKING:
+    from keras.models import Model
+    from keras.preprocessing.text import Tokenizer
+    import tensorflow as tf
+
+    from services.classify_comments.tflite_model import TFLiteModel
+
 MODEL_NAME = os.path.join(ROOT_DIR, "model_files/GRU.h5")
 TOKENIZER_JOBLIB_FILE = os.path.join(ROOT_DIR, "model_files/26k_training_data.joblib")
+# "keras" for the .h5 model, or "tflite" for the artifact exported from it by
+# `export_model.py`.
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "keras")
+TFLITE_MODEL_FILE = os.getenv(
+    "TFLITE_MODEL_FILE", os.path.join(ROOT_DIR, "model_files/GRU.tflite")
+)
 THRESHOLD = 0.70
+LABEL_THRESHOLD = 0.51
+MAX_SEQUENCE_LENGTH = 50
+# number of texts that the model predicts on at once.
+DEFAULT_BATCH_SIZE = 256
+# the string features that the model is trained on.
+CLASSIFIER_FEATURES = ["wn_lemmatize_hashtag"]
 
 
-def threshold_acc(y_true: tf.Tensor, y_pred: tf.Tensor) -> float:
+def threshold_acc(y_true: "tf.Tensor", y_pred: "tf.Tensor") -> float:
+    from keras import backend as K
+
     if K.backend() == "tensorflow":
         return K.mean(
             K.equal(y_true, K.cast(K.greater_equal(y_pred, THRESHOLD), y_true.dtype))
@@ -28,46 +53,150 @@ def threshold_acc(y_true: tf.Tensor, y_pred: tf.Tensor) -> float:
 
 def load_embedding_and_tokenizer(
     model_name: str, tokenizer_joblib_file: str, threshold_acc: Callable
-) -> Tuple[Model, Tokenizer]:
+) -> Tuple["Model", "Tokenizer"]:
+    from keras.models import load_model
+
     gru_model = load_model(model_name, custom_objects={"threshold_acc": threshold_acc})
     embedding_tokenizer = load(tokenizer_joblib_file)
     return gru_model, embedding_tokenizer
 
 
-def load_default_embedding_and_tokenizer() -> Tuple[Model, Tuple]:
+def load_tflite_embedding_and_tokenizer(
+    tflite_model_file: str, tokenizer_joblib_file: str
+) -> Tuple["TFLiteModel", "Tokenizer"]:
+    from services.classify_comments.tflite_model import TFLiteModel
+
+    return TFLiteModel(tflite_model_file), load(tokenizer_joblib_file)
+
+
+def load_default_embedding_and_tokenizer() -> Tuple[
+    Union["Model", "TFLiteModel"], "Tokenizer"
+]:
+    """Loads the model of `MODEL_BACKEND`, along with the tokenizer."""
+    if MODEL_BACKEND == "tflite":
+        return load_tflite_embedding_and_tokenizer(
+            TFLITE_MODEL_FILE, TOKENIZER_JOBLIB_FILE
+        )
     return load_embedding_and_tokenizer(
         MODEL_NAME, TOKENIZER_JOBLIB_FILE, threshold_acc
     )
 
 
-def classify_text(
-    text: str, embedding: Model, tokenizer: Tokenizer
-) -> Tuple[float, int]:
-    """Take single text, return inferred outrage classification."""
+# the default model and tokenizer, once loaded by
+# `get_embedding_and_tokenizer`.
+default_embedding_and_tokenizer: Optional[Tuple] = None
+default_embedding_and_tokenizer_lock = threading.Lock()
+
+
+def get_embedding_and_tokenizer() -> Tuple[
+    Union["Model", "TFLiteModel"], "Tokenizer"
+]:
+    """Returns the default model and tokenizer, loading them the first time
+    that they're needed (once per process)."""
+    global default_embedding_and_tokenizer
+    with default_embedding_and_tokenizer_lock:
+        if default_embedding_and_tokenizer is None:
+            default_embedding_and_tokenizer = (
+                load_default_embedding_and_tokenizer()
+            )
+        return default_embedding_and_tokenizer
+
+
+def start_warm_up() -> threading.Thread:
+    """Starts loading the default model and tokenizer in a background
+    thread, so that they're ready (or closer to it) by the time they're
+    needed."""
+    thread = threading.Thread(target=get_embedding_and_tokenizer, daemon=True)
+    thread.start()
+    return thread
+
+
+def preprocess_texts(texts: list[str]) -> list[str]:
+    """Returns the processed text that the model is trained on, for each
+    text. Only the features that the model needs are computed."""
+    return [
+        obtain_string_features_dict(text, features=CLASSIFIER_FEATURES)[
+            "wn_lemmatize_hashtag"
+        ]
+        for text in texts
+    ]
+
+
+def pad_sequences(
+    sequences: list[list[int]], maxlen: int = MAX_SEQUENCE_LENGTH
+) -> np.ndarray:
+    """Pads sequences with zeros at the end, and truncates them from the
+    start, into an int32 array of shape (len(sequences), maxlen). Same as
+    `keras.utils.pad_sequences(sequences, maxlen, padding="post")`, without
+    importing Keras."""
+    padded_sequences = np.zeros((len(sequences), maxlen), dtype=np.int32)
+    for i, sequence in enumerate(sequences):
+        truncated_sequence = sequence[-maxlen:]
+        padded_sequences[i, :len(truncated_sequence)] = truncated_sequence
+    return padded_sequences
+
+
+def texts_to_padded_sequences(
+    texts: list[str], tokenizer: "Tokenizer"
+) -> np.ndarray:
+    """Preprocesses and tokenizes texts into one padded array of shape
+    (len(texts), MAX_SEQUENCE_LENGTH)."""
+    return pad_sequences(
+        tokenizer.texts_to_sequences(preprocess_texts(texts)),
+        maxlen=MAX_SEQUENCE_LENGTH
+    )
 
-    text_features = obtain_string_features_dict(text)
 
-    text_features = {key: [value] for key, value in text_features.items()}
+def classify_texts(
+    texts: list[str],
+    embedding: Union["Model", "TFLiteModel"],
+    tokenizer: "Tokenizer",
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Take a list of texts, return inferred outrage classifications.
+
+    All texts are padded into one array, and the model (Keras or TFLite)
+    predicts on `batch_size` texts at a time. Returns a tuple of (probabilities, labels)
+    arrays, both of shape (len(texts),).
+    """
+    if not texts:
+        return np.array([], dtype=np.float32), np.array([], dtype=int)
+    padded_sequences = texts_to_padded_sequences(texts, tokenizer)
+    return classify_padded_sequences(
+        padded_sequences, embedding, batch_size=batch_size
+    )
 
-    df = pd.DataFrame(text_features)
 
-    tweet_emb_processed = pad_sequences(
-        tokenizer.texts_to_sequences(df["wn_lemmatize_hashtag"]),
-        padding="post",
-        maxlen=50,
-    )
-    tweet_gru_predict = embedding.predict(tweet_emb_processed)
-    gru_prob = tweet_gru_predict.ravel()
-    gru_binary = 1 if gru_prob > 0.51 else 0
+def classify_padded_sequences(
+    padded_sequences: np.ndarray,
+    embedding: Union["Model", "TFLiteModel"],
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns a tuple of (probabilities, labels) arrays for already padded
+    sequences, predicting on `batch_size` sequences at a time."""
+    probs = embedding.predict(
+        padded_sequences, batch_size=batch_size, verbose=0
+    ).ravel()
+    labels = (probs > LABEL_THRESHOLD).astype(int)
+    return probs, labels
 
-    return gru_prob, gru_binary
+
+def classify_text(
+    text: str,
+    embedding: Union["Model", "TFLiteModel"],
+    tokenizer: "Tokenizer"
+) -> Tuple[np.ndarray, int]:
+    """Take single text, return inferred outrage classification.
+
+    Returns the probability as an array of size 1, along with the label.
+    """
+    probs, labels = classify_texts([text], embedding, tokenizer)
+    return probs, int(labels[0])
 
 
 def classify_reddit_text(text: str, embedding=None, tokenizer=None) -> None:
     if not embedding or not tokenizer:
-        embedding, tokenizer = load_embedding_and_tokenizer(
-            MODEL_NAME, TOKENIZER_JOBLIB_FILE, threshold_acc
-        )
+        embedding, tokenizer = get_embedding_and_tokenizer()
     prob, label = classify_text(text, embedding, tokenizer)
     print(f"Outrage probability: {prob}\tLabel: {label}")
 
@@ -0,0 +1,96 @@
+"""Classify comments while they're being synced.
+
+A sync spends most of its time waiting on the Reddit API, so the comments of
+each thread are queued as soon as the thread is parsed, and a background
+thread (a `MicroBatcher`) classifies them in batches while the sync walks the
+next threads. Once the walk is done, the classifications of the comments that
+are kept are written to `classified_comments` in the same transaction as the
+comments themselves, so that their authors can be messaged right after the
+sync, rather than after the next run of the classify pipeline.
+
+The classification cache isn't used here: it's read and written through the
+DB connection that the sync uses, which the background thread shouldn't
+share. Comments are new when they're synced, so the cache would rarely hit.
+"""
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from services.classify_comments.helper import build_classified_comments_df
+from services.classify_comments.inference import (
+    DEFAULT_BATCH_SIZE, classify_texts, get_embedding_and_tokenizer,
+    start_warm_up
+)
+from services.classify_comments.micro_batcher import MicroBatcher
+
+# the comments of a thread arrive at once, and the next thread takes seconds
+# to fetch, so waiting a bit longer than the API does fills the batches.
+DEFAULT_MAX_LATENCY_MS = 1000.0
+
+
+class IngestClassifier:
+    """Classifies comments, in the background, as they're synced, e.g.:
+
+        classifier = IngestClassifier()
+        for thread in threads:
+            ...
+            classifier.submit_comments(comments_list_dicts)
+        classified_comments_df = classifier.get_classified_comments_df(
+            comments_df
+        )
+    """
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_latency_ms: float = DEFAULT_MAX_LATENCY_MS
+    ) -> None:
+        self.batch_size = batch_size
+        self.comment_id_to_future: dict[str, Future] = {}
+        # load the model while the first threads are fetched.
+        start_warm_up()
+        self.batcher = MicroBatcher(
+            classify_texts=self.classify,
+            max_batch_size=batch_size,
+            max_latency_ms=max_latency_ms
+        )
+
+    def classify(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        embedding, tokenizer = get_embedding_and_tokenizer()
+        return classify_texts(
+            texts, embedding, tokenizer, batch_size=self.batch_size
+        )
+
+    def submit_comments(self, comments: list[dict]) -> None:
+        """Queues comments (as parsed by the sync) to be classified."""
+        for comment in comments:
+            if comment["id"] not in self.comment_id_to_future:
+                self.comment_id_to_future[comment["id"]] = self.batcher.submit(
+                    comment.get("body") or ""
+                )
+
+    def close(self) -> None:
+        """Classifies the comments that have already been queued, then
+        stops the background thread."""
+        self.batcher.close()
+
+    def get_classified_comments_df(
+        self, comments_df: pd.DataFrame
+    ) -> pd.DataFrame:
+        """Waits for the comments to be classified, and returns their rows of
+        `classified_comments`. Comments that weren't submitted are classified
+        now. Raises the classifier's error if any batch failed."""
+        self.submit_comments(
+            comments_df[["id", "body"]].to_dict(orient="records")
+        )
+        self.close()
+        results = [
+            self.comment_id_to_future[comment_id].result()
+            for comment_id in comments_df["id"]
+        ]
+        return build_classified_comments_df(
+            comments_df,
+            probs=np.array([result["prob"] for result in results]),
+            labels=np.array([result["label"] for result in results])
+        )
@@ -0,0 +1,185 @@
+"""Coalesces concurrent classification requests into micro-batches.
+
+Predicting on one text at a time spends most of the time on per-call
+overhead, so requests are queued and a background thread classifies them
+together. A batch is sent to the model once it has `max_batch_size` texts, or
+`max_latency_ms` after its first text arrived, whichever comes first, so a
+lone request waits at most `max_latency_ms` for company. If a batch fails,
+its texts are retried one at a time, so that a bad request doesn't fail the
+requests that it was batched with.
+"""
+from collections import deque
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_LATENCY_MS = 10.0
+# number of recent requests/batches that latency and batch size percentiles
+# are computed over.
+METRICS_WINDOW_SIZE = 10_000
+
+
+class MicroBatcherMetrics:
+    """Request latencies and batch sizes of a micro-batcher."""
+
+    def __init__(self, window_size: int = METRICS_WINDOW_SIZE) -> None:
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.latencies_ms: deque[float] = deque(maxlen=window_size)
+        self.batch_sizes: deque[int] = deque(maxlen=window_size)
+        self.inference_times_ms: deque[float] = deque(maxlen=window_size)
+        self.lock = threading.Lock()
+
+    def record_batch(
+        self, batch_size: int, inference_time_ms: float, latencies_ms: list
+    ) -> None:
+        with self.lock:
+            self.num_batches += 1
+            self.num_requests += batch_size
+            self.batch_sizes.append(batch_size)
+            self.inference_times_ms.append(inference_time_ms)
+            self.latencies_ms.extend(latencies_ms)
+
+    def record_error(self, batch_size: int) -> None:
+        with self.lock:
+            self.num_errors += batch_size
+
+    @staticmethod
+    def get_percentiles(values: list) -> dict:
+        if not values:
+            return {}
+        return {
+            f"p{percentile}": float(np.percentile(values, percentile))
+            for percentile in [50, 90, 99]
+        }
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            latencies_ms = list(self.latencies_ms)
+            batch_sizes = list(self.batch_sizes)
+            inference_times_ms = list(self.inference_times_ms)
+            return {
+                "num_requests": self.num_requests,
+                "num_batches": self.num_batches,
+                "num_errors": self.num_errors,
+                "mean_batch_size": (
+                    float(np.mean(batch_sizes)) if batch_sizes else 0.0
+                ),
+                "batch_size": self.get_percentiles(batch_sizes),
+                "latency_ms": self.get_percentiles(latencies_ms),
+                "inference_time_ms": self.get_percentiles(inference_times_ms)
+            }
+
+
+class MicroBatcher:
+    """Classifies texts submitted from any thread in micro-batches.
+
+    `classify_texts` takes a list of texts and returns a tuple of
+    (probabilities, labels) arrays, like `inference.classify_texts`.
+    """
+
+    def __init__(
+        self,
+        classify_texts: Callable[[list[str]], Tuple[np.ndarray, np.ndarray]],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_latency_ms: float = DEFAULT_MAX_LATENCY_MS
+    ) -> None:
+        self.classify_texts = classify_texts
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.metrics = MicroBatcherMetrics()
+        # items are (text, future, time submitted), or None to stop.
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queues a text. The future's result is a dict with its "prob" and
+        "label"."""
+        future: Future = Future()
+        self.queue.put((text, future, time.perf_counter()))
+        return future
+
+    def classify(self, text: str, timeout: Optional[float] = None) -> dict:
+        return self.submit(text).result(timeout=timeout)
+
+    def classify_many(
+        self, texts: list[str], timeout: Optional[float] = None
+    ) -> list[dict]:
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def get_batch(self) -> Optional[list]:
+        """Waits for the next batch. Returns None once the batcher has been
+        closed."""
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = item[2] + self.max_latency_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, and stop after it.
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def classify_batch(self, batch: list) -> None:
+        """Classifies a batch, and sets the results of its futures. Raises
+        the classifier's error if it fails."""
+        texts = [text for text, _, _ in batch]
+        start_time = time.perf_counter()
+        probs, labels = self.classify_texts(texts)
+        end_time = time.perf_counter()
+        for (_, future, _), prob, label in zip(batch, probs, labels):
+            future.set_result({"prob": float(prob), "label": int(label)})
+        self.metrics.record_batch(
+            batch_size=len(batch),
+            inference_time_ms=(end_time - start_time) * 1000,
+            latencies_ms=[
+                (end_time - submitted_time) * 1000
+                for _, _, submitted_time in batch
+            ]
+        )
+
+    def run(self) -> None:
+        while True:
+            batch = self.get_batch()
+            if batch is None:
+                return
+            try:
+                self.classify_batch(batch)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    self.metrics.record_error(1)
+                    batch[0][1].set_exception(e)
+                    continue
+            # a single bad text fails its whole batch, so the texts are
+            # retried one at a time, and only the requests that fail on
+            # their own get an error.
+            for item in batch:
+                try:
+                    self.classify_batch([item])
+                except Exception as e:
+                    self.metrics.record_error(1)
+                    item[1].set_exception(e)
+
+    def close(self) -> None:
+        """Classifies the texts that have already been queued, then stops."""
+        self.queue.put(None)
+        self.thread.join()
@@ -1,17 +1,19 @@
 import pickle
 
-from emoji.unicode_codes.data_dict import EMOJI_DATA
+from services.classify_comments.preprocess.emoji_index import EMOJI_INDEX
 
 TOP_EMOJIS = ["😂", "🤣", "😡", "🖕", "😹", "🙏", "👎", "🌊", "🙄", "🤔"]
 
-emoji_name_to_unicode_map = {
-    EMOJI_DATA[unicode_key]["en"]: unicode_key for unicode_key in EMOJI_DATA
-}
 
-emoji_unicode_to_name_map = {
-    unicode_key: EMOJI_DATA[unicode_key]["en"] for unicode_key in EMOJI_DATA
-}
+def __getattr__(name: str) -> dict:
+    # the maps are only built the first time that they're used.
+    if name == "emoji_name_to_unicode_map":
+        return EMOJI_INDEX.name_to_unicode_map
+    if name == "emoji_unicode_to_name_map":
+        return EMOJI_INDEX.unicode_to_name_map
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
     with open("emoji_name_to_unicode_map.pickle", "wb") as file:
-        pickle.dump(emoji_name_to_unicode_map, file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(EMOJI_INDEX.name_to_unicode_map, file, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,139 @@
+"""Index of emojis, for finding them in text in one pass.
+
+Checking whether a character is an emoji is a set lookup. To find the emojis
+in a string, a compiled regex finds the characters that can start an emoji
+(skipping everything else in C), and a trie of all of the emojis finds the
+longest emoji that starts at each of them, so finding the emojis in a string
+takes time proportional to its length. Since the longest match is taken,
+emojis that are made of several codepoints (e.g., skin tones, flags and ZWJ
+sequences like "👨‍👩‍👧") are found whole, rather than as the
+single-codepoint emojis that they're made of.
+
+The index (and the maps between emojis and their names) is only built the
+first time that it's used.
+"""
+from functools import cached_property
+import re
+from typing import Dict, FrozenSet, List, Optional
+
+from emoji.unicode_codes.data_dict import EMOJI_DATA
+
+# key that marks the end of an emoji, in the trie.
+END_OF_EMOJI = ""
+
+
+def build_trie(strings: List[str]) -> Dict:
+    trie: Dict = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[END_OF_EMOJI] = {}
+    return trie
+
+
+def get_character_class_regex(chars: List[str]) -> str:
+    """Returns a regex character class that matches any of the characters,
+    using ranges for runs of consecutive codepoints. Most emojis are outside
+    of the Basic Multilingual Plane, where a class of single characters is
+    checked one character at a time, so ranges make it much faster."""
+    ranges: List[List[int]] = []
+    for codepoint in sorted(ord(char) for char in chars if char):
+        if ranges and codepoint == ranges[-1][1] + 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return "[%s]" % "".join(
+        re.escape(chr(start)) if start == end
+        else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+        for start, end in ranges
+    )
+
+
+class EmojiIndex:
+    def __init__(self, emoji_data: Dict = EMOJI_DATA) -> None:
+        self.emoji_data = emoji_data
+
+    @cached_property
+    def emojis(self) -> FrozenSet[str]:
+        return frozenset(self.emoji_data.keys())
+
+    @cached_property
+    def single_codepoint_emojis(self) -> FrozenSet[str]:
+        return frozenset(emoji for emoji in self.emojis if len(emoji) == 1)
+
+    @cached_property
+    def trie(self) -> Dict:
+        return build_trie(list(self.emojis))
+
+    @cached_property
+    def first_char_pattern(self) -> re.Pattern:
+        """Matches any character that an emoji can start with."""
+        return re.compile(get_character_class_regex(list(self.trie)))
+
+    def get_name(self, emoji: str) -> str:
+        """Returns the name of an emoji, without building the name maps."""
+        return self.emoji_data[emoji]["en"]
+
+    @cached_property
+    def unicode_to_name_map(self) -> Dict[str, str]:
+        return {
+            unicode_key: self.get_name(unicode_key)
+            for unicode_key in self.emoji_data
+        }
+
+    @cached_property
+    def name_to_unicode_map(self) -> Dict[str, str]:
+        return {
+            name: unicode_key
+            for unicode_key, name in self.unicode_to_name_map.items()
+        }
+
+    def is_emoji(self, string: str) -> bool:
+        """Returns whether a string (e.g., a single character) is an
+        emoji."""
+        if len(string) == 1:
+            return string in self.single_codepoint_emojis
+        return string in self.emojis
+
+    def is_emoji_name(self, string: str) -> bool:
+        return string in self.name_to_unicode_map
+
+    def match_at(self, string: str, start: int) -> Optional[str]:
+        """Returns the longest emoji that starts at `start`, if any."""
+        node = self.trie
+        end = None
+        for i in range(start, len(string)):
+            next_node = node.get(string[i])
+            if next_node is None:
+                break
+            node = next_node
+            if END_OF_EMOJI in node:
+                end = i + 1
+        return string[start:end] if end is not None else None
+
+    def find(self, string: str) -> List[str]:
+        """Returns the emojis in a string, in order."""
+        emojis: List[str] = []
+        end = 0
+        for match in self.first_char_pattern.finditer(string):
+            start = match.start()
+            if start < end:
+                # part of the previous emoji.
+                continue
+            emoji = self.match_at(string, start)
+            if emoji is not None:
+                emojis.append(emoji)
+                end = start + len(emoji)
+        return emojis
+
+    def extract(self, strings: List[str]) -> List[List[str]]:
+        """Returns the emojis in each string."""
+        return [self.find(string) for string in strings]
+
+    def count(self, strings: List[str]) -> List[int]:
+        """Returns the number of emojis in each string."""
+        return [len(self.find(string)) for string in strings]
+
+
+EMOJI_INDEX = EmojiIndex()
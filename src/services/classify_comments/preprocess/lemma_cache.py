@@ -0,0 +1,172 @@
+"""Bounded LRU cache of lemmas.
+
+The vocabulary of comments is dominated by the same few thousand words, so
+lemmatizing each token with WordNet repeats the same lookups over and over.
+`lemma_cache` maps (word, WordNet POS) to the lemma, and is shared by
+everything in `preprocess/strings.py` that lemmatizes. Once it holds
+`LEMMA_CACHE_MAX_SIZE` lemmas, the least recently used ones are dropped.
+
+Set `LEMMA_CACHE_FILE` to keep the cache between runs: it's loaded when this
+module is imported and saved when the process exits.
+
+Workers of a `PreprocessingPool` each have their own cache. They load the
+saved cache too, but don't save theirs: instead, the lemmas that they add
+(and their hit/miss counts) are sent back with each chunk and merged into the
+cache of the parent process, which saves it.
+"""
+import atexit
+from collections import OrderedDict
+import json
+import os
+from typing import Optional
+
+from nltk.corpus.reader.wordnet import NOUN
+from nltk.stem.wordnet import WordNetLemmatizer
+
+LEMMA_CACHE_MAX_SIZE = int(os.getenv("LEMMA_CACHE_MAX_SIZE", "100000"))
+LEMMA_CACHE_FILE = os.getenv("LEMMA_CACHE_FILE")
+# (word, WordNet POS, lemma)
+LemmaEntry = tuple[str, str, str]
+
+
+class LemmaCacheStats:
+    """Hit/miss counts of a lemma cache."""
+
+    def __init__(self) -> None:
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+
+    @property
+    def num_lookups(self) -> int:
+        return self.num_hits + self.num_misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_hits / self.num_lookups if self.num_lookups else 0.0
+
+    def add(self, other: "LemmaCacheStats") -> None:
+        self.num_hits += other.num_hits
+        self.num_misses += other.num_misses
+        self.num_evictions += other.num_evictions
+
+    def to_dict(self) -> dict:
+        return {
+            "num_hits": self.num_hits,
+            "num_misses": self.num_misses,
+            "num_evictions": self.num_evictions,
+            "hit_rate": self.hit_rate
+        }
+
+    def __repr__(self) -> str:
+        return f"LemmaCacheStats({self.to_dict()})"
+
+
+class LemmaCache:
+    """Lemmatizes words, caching the lemma of each (word, pos)."""
+
+    def __init__(
+        self,
+        max_size: int = LEMMA_CACHE_MAX_SIZE,
+        lemmatizer: Optional[WordNetLemmatizer] = None
+    ) -> None:
+        self.max_size = max_size
+        self.lemmatizer = lemmatizer or WordNetLemmatizer()
+        self.lemmas: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self.stats = LemmaCacheStats()
+        # lemmas added since the last `pop_updates`, if they're tracked
+        # (i.e., in pool workers).
+        self.track_updates = False
+        self.new_lemmas: dict[tuple[str, str], str] = {}
+
+    def __len__(self) -> int:
+        return len(self.lemmas)
+
+    def lemmatize(self, word: str, pos: Optional[str] = None) -> str:
+        """Returns the lemma of a word, like `WordNetLemmatizer.lemmatize`
+        (which treats words without a POS as nouns)."""
+        key = (word, pos or NOUN)
+        lemma = self.lemmas.get(key)
+        if lemma is not None:
+            self.lemmas.move_to_end(key)
+            self.stats.num_hits += 1
+            return lemma
+        self.stats.num_misses += 1
+        lemma = self.lemmatizer.lemmatize(word, pos=key[1])
+        self.lemmas[key] = lemma
+        if self.track_updates:
+            self.new_lemmas[key] = lemma
+        if len(self.lemmas) > self.max_size:
+            self.lemmas.popitem(last=False)
+            self.stats.num_evictions += 1
+        return lemma
+
+    def pop_updates(self) -> tuple[list[LemmaEntry], LemmaCacheStats]:
+        """Returns the lemmas added and the stats since the last call, and
+        resets them."""
+        new_lemmas = [
+            (word, pos, lemma)
+            for (word, pos), lemma in self.new_lemmas.items()
+        ]
+        stats = self.stats
+        self.new_lemmas = {}
+        self.stats = LemmaCacheStats()
+        return new_lemmas, stats
+
+    def merge_updates(
+        self, new_lemmas: list[LemmaEntry], stats: LemmaCacheStats
+    ) -> None:
+        """Adds the lemmas and stats from another cache's `pop_updates`."""
+        for word, pos, lemma in new_lemmas:
+            self.lemmas[(word, pos)] = lemma
+            self.lemmas.move_to_end((word, pos))
+        while len(self.lemmas) > self.max_size:
+            self.lemmas.popitem(last=False)
+        self.stats.add(stats)
+
+    def load(self, file_path: str) -> None:
+        """Adds the lemmas saved in a file, if it exists."""
+        if not os.path.exists(file_path):
+            return
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except ValueError as e:
+            print(f"Unable to load lemma cache {file_path}: {e}")
+            return
+        # entries are saved from least to most recently used.
+        for word, pos, lemma in entries[-self.max_size:]:
+            self.lemmas[(word, pos)] = lemma
+
+    def save(self, file_path: str) -> None:
+        """Saves the lemmas, from least to most recently used."""
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, "w", encoding="utf-8") as f:
+            json.dump(
+                [[word, pos, lemma] for (word, pos), lemma in self.lemmas.items()], # noqa
+                f
+            )
+        os.replace(tmp_file_path, file_path)
+
+    def clear(self) -> None:
+        self.lemmas.clear()
+        self.new_lemmas = {}
+        self.stats = LemmaCacheStats()
+
+
+lemma_cache = LemmaCache()
+
+if LEMMA_CACHE_FILE:
+    lemma_cache.load(LEMMA_CACHE_FILE)
+    atexit.register(lemma_cache.save, LEMMA_CACHE_FILE)
+
+
+def track_updates_in_worker() -> None:
+    """Makes this process's cache track its updates for the parent process,
+    rather than saving itself at exit."""
+    lemma_cache.track_updates = True
+    if LEMMA_CACHE_FILE:
+        atexit.unregister(lemma_cache.save)
@@ -4,28 +4,50 @@ import csv
 import os
 import re
 import string
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from nltk import pos_tag
 from nltk.corpus import stopwords, wordnet
 from nltk.stem.snowball import SnowballStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.tokenize import TweetTokenizer, word_tokenize
 import numpy as np
 
-from services.classify_comments.preprocess.emoji_helper import (
-    emoji_name_to_unicode_map,
-    emoji_unicode_to_name_map,
-    TOP_EMOJIS,
-)
-
-PUNCTUATION_REGEX = r"[%s]" % re.escape("""!"$%&()*+,-./:;<=>?@[\]^_`{|}~""")
-SHORT_LINK_REGEX = "//t.co\S+"
-URL_LINK_REGEX = "http\S+\s*"
-LEMMATIZER = WordNetLemmatizer()
-STOPWORDS = stopwords.words("english")
+from services.classify_comments.preprocess.emoji_helper import TOP_EMOJIS
+from services.classify_comments.preprocess.emoji_index import EMOJI_INDEX
+from services.classify_comments.preprocess.lemma_cache import lemma_cache
+
+PUNCTUATION_CHARS = """!"$%&()*+,-./:;<=>?@[\]^_`{|}~"""
+PUNCTUATION_REGEX = r"[%s]" % re.escape(PUNCTUATION_CHARS)
+SHORT_LINK_REGEX = r"//t.co\S+"
+URL_LINK_REGEX = r"http\S+\s*"
+RT_AND_CC_REGEX = "RT|cc"
+HASHTAG_REGEX = r"#\S+"
+MENTION_REGEX = r"@\S+"
+WHITESPACE_REGEX = r"\s+"
+SHORT_LINK_PATTERN = re.compile(SHORT_LINK_REGEX)
+URL_LINK_PATTERN = re.compile(URL_LINK_REGEX)
+RT_AND_CC_PATTERN = re.compile(RT_AND_CC_REGEX)
+HASHTAG_PATTERN = re.compile(HASHTAG_REGEX)
+MENTION_PATTERN = re.compile(MENTION_REGEX)
+PUNCTUATION_PATTERN = re.compile(PUNCTUATION_REGEX)
+WHITESPACE_PATTERN = re.compile(WHITESPACE_REGEX)
+# removing hashtags and then mentions gives the same result as removing both
+# in one pass, since neither can create or break up a match of the other.
+# 'RT' and 'cc' have to be removed before, e.g., "abc#cc" leaves "abc#".
+HASHTAG_MENTION_PATTERN = re.compile(r"[#@]\S+")
+PUNCTUATION_TRANSLATION_TABLE = str.maketrans("", "", PUNCTUATION_CHARS)
+LEMMATIZER = lemma_cache.lemmatizer
+STOPWORDS = frozenset(stopwords.words("english"))
 MIN_WORD_LENGTH = 3
 POS = ["adj", "verb", "noun", "adv", "pronoun", "wh", "other"]
+STEMMER = SnowballStemmer("english")
+TWEET_TOKENIZER = TweetTokenizer()
+# punctuation (other than "!" and "?") and stopwords, for `psy_string_process`
+PSY_STOPWORDS = (
+    set(STOPWORDS)
+    | set(x for x in string.punctuation if x not in ["!", "?"])
+    | set(["", " ", "  "])
+)
 
 """
 exp_outrage = os.path.join(
@@ -34,16 +56,17 @@ exp_outrage = os.path.join(
 """
 
 def char_is_emoji(char: str) -> bool:
-    return char in emoji_name_to_unicode_map.values()
+    return EMOJI_INDEX.is_emoji(char)
 
 
 def string_is_emoji_name(string: str) -> bool:
-    return string in emoji_name_to_unicode_map.keys()
+    return EMOJI_INDEX.is_emoji_name(string)
 
 
 def extract_emojis(string: str) -> str:
-    """From a given string, extract all the emojis."""
-    return " ".join([char for char in string if char_is_emoji(char)])
+    """From a given string, extract all the emojis (including emojis made of
+    several codepoints, e.g., with skin tones)."""
+    return " ".join(EMOJI_INDEX.find(string))
 
 
 def get_hashtags_from_string(string: str) -> str:
@@ -55,7 +78,7 @@ def get_hashtags_from_string(string: str) -> str:
 
 def string_has_link(string: str) -> bool:
     return bool(
-        re.findall(SHORT_LINK_REGEX, string) or re.findall(URL_LINK_REGEX, string)
+        SHORT_LINK_PATTERN.search(string) or URL_LINK_PATTERN.search(string)
     )
 
 
@@ -68,7 +91,7 @@ def remove_links(string: str) -> str:
     Returns:
         str: The input string with Twitter links removed.
     """
-    return re.sub("//t.co\S+", "", string)
+    return SHORT_LINK_PATTERN.sub("", string)
 
 
 def remove_urls(string: str) -> str:
@@ -80,7 +103,7 @@ def remove_urls(string: str) -> str:
     Returns:
         str: The input string with URLs removed.
     """
-    return re.sub("http\S+\s*", "", string)
+    return URL_LINK_PATTERN.sub("", string)
 
 
 def remove_rt_and_cc(string: str) -> str:
@@ -92,7 +115,7 @@ def remove_rt_and_cc(string: str) -> str:
     Returns:
         str: The input string with 'RT' and 'cc' removed.
     """
-    return re.sub("RT|cc", "", string)
+    return RT_AND_CC_PATTERN.sub("", string)
 
 
 def remove_hashtags(string: str) -> str:
@@ -104,7 +127,7 @@ def remove_hashtags(string: str) -> str:
     Returns:
         str: The input string with hashtags removed.
     """
-    return re.sub("#\S+", "", string)
+    return HASHTAG_PATTERN.sub("", string)
 
 
 def remove_mentions(string: str) -> str:
@@ -116,7 +139,7 @@ def remove_mentions(string: str) -> str:
     Returns:
         str: The input string with mentions removed.
     """
-    return re.sub("@\S+", "", string)
+    return MENTION_PATTERN.sub("", string)
 
 
 def remove_punctuation(string: str) -> str:
@@ -128,7 +151,7 @@ def remove_punctuation(string: str) -> str:
     Returns:
         str: The input string with punctuation removed.
     """
-    return re.sub(PUNCTUATION_REGEX, "", string)
+    return PUNCTUATION_PATTERN.sub("", string)
 
 
 def remove_whitespace(string: str) -> str:
@@ -140,7 +163,7 @@ def remove_whitespace(string: str) -> str:
     Returns:
         str: The input string with extra whitespace removed.
     """
-    return re.sub("\s+", " ", string)
+    return WHITESPACE_PATTERN.sub(" ", string)
 
 
 def remove_stopwords_and_short_words(string: str) -> str:
@@ -164,6 +187,14 @@ def token_postag(string: str) -> List[Tuple[str, str]]:
     return pos_tag(tokens)
 
 
+def preload_nltk_resources() -> None:
+    """Loads the NLTK corpora and models that are otherwise loaded the first
+    time that they're used (e.g., in each new worker process)."""
+    wordnet.ensure_loaded()
+    LEMMATIZER.lemmatize("loading")
+    token_postag("Loading the tagger.")
+
+
 def get_wordnet_pos(treebank_tag: str) -> Optional[str]:
     if treebank_tag.startswith("J"):
         return wordnet.ADJ
@@ -218,19 +249,75 @@ def modify_pos(dict: Dict) -> Dict:
     return result_dic
 
 
-def tokenize_stem_lemmatize_string(string: str) -> str:
-    tokens_pos = token_postag(string)
+def lemmatize_tagged_tokens(tokens_pos: List[Tuple[str, str]]) -> str:
     result_string = ""
     for word, tag in tokens_pos:
-        wntag = get_wordnet_pos(tag)
-        if wntag is None:
-            result_string += LEMMATIZER.lemmatize(word.lower())
-        else:
-            result_string += LEMMATIZER.lemmatize(word.lower(), pos=wntag)
+        result_string += lemma_cache.lemmatize(
+            word.lower(), pos=get_wordnet_pos(tag)
+        )
         result_string += " "
     return result_string
 
 
+def tokenize_stem_lemmatize_string(string: str) -> str:
+    return lemmatize_tagged_tokens(token_postag(string))
+
+
+class TextNormalizer:
+    """Removes links, URLs, 'RT' and 'cc', hashtags, mentions, punctuation,
+    extra whitespace, stopwords and short words from strings.
+
+    Gives the same output as calling `remove_links`, `remove_urls`,
+    `remove_rt_and_cc`, `remove_hashtags`, `remove_mentions`,
+    `remove_punctuation`, `remove_whitespace` and
+    `remove_stopwords_and_short_words` in turn, in fewer passes:
+        - hashtags and mentions are removed by one regex (after 'RT' and
+        'cc').
+        - punctuation is deleted with `str.translate`.
+        - extra whitespace doesn't need to be removed, since the string is
+        split on whitespace anyway.
+        - the string is split into words once, and each word is looked up
+        in a frozenset of stopwords.
+    Links and URLs are still removed one after the other, since removing a
+    URL also removes the whitespace after it, which can change what's left
+    for the next step to match.
+    """
+
+    def __init__(
+        self,
+        stopwords: Iterable[str] = STOPWORDS,
+        min_word_length: int = MIN_WORD_LENGTH
+    ) -> None:
+        self.stopwords = frozenset(stopwords)
+        self.min_word_length = min_word_length
+
+    def tokenize(self, string: str) -> List[str]:
+        """Returns the words that are left in the string."""
+        string = SHORT_LINK_PATTERN.sub("", string)
+        string = URL_LINK_PATTERN.sub("", string)
+        string = RT_AND_CC_PATTERN.sub("", string)
+        string = HASHTAG_MENTION_PATTERN.sub("", string)
+        string = string.translate(PUNCTUATION_TRANSLATION_TABLE)
+        return [
+            word
+            for word in string.split()
+            if len(word) >= self.min_word_length
+            and word.lower() not in self.stopwords
+        ]
+
+    def normalize(self, string: str) -> str:
+        return " ".join(self.tokenize(string))
+
+
+TEXT_NORMALIZER = TextNormalizer()
+
+
+def clean_text(string: str) -> str:
+    """Removes links, URLs, 'RT' and 'cc', hashtags, mentions, punctuation,
+    extra whitespace, stopwords and short words from the given string."""
+    return TEXT_NORMALIZER.normalize(string)
+
+
 def preprocess_text(string: str) -> str:
     """Preprocess the given text by removing links, URLs, 'RT' and 'cc', hashtags, mentions,
     punctuation, extra whitespace, stopwords and short words, and stemming and lemmatizing the
@@ -242,38 +329,22 @@ def preprocess_text(string: str) -> str:
     Returns:
         str: The preprocessed string.
     """
-    string = remove_links(string)
-    string = remove_urls(string)
-    string = remove_rt_and_cc(string)
-    string = remove_hashtags(string)
-    string = remove_mentions(string)
-    string = remove_punctuation(string)
-    string = remove_whitespace(string)
-    string = remove_stopwords_and_short_words(string)
+    string = clean_text(string)
     string = tokenize_stem_lemmatize_string(string)
     return string
 
 
 def psy_string_process(text: str) -> Tuple[List[str], int]:
-    keep = set(["!", "?"])
-    stop = set(stopwords.words("english"))
-    remove = set([x for x in list(string.punctuation) if x not in keep])
-    stop.update(remove)
-    stop.update(["", " ", "  "])
-    del keep, remove
-
-    stemmer = SnowballStemmer("english")
-    tokenizer = TweetTokenizer()
-    text_tokenized = tokenizer.tokenize(text)
+    text_tokenized = TWEET_TOKENIZER.tokenize(text)
     n = len(text_tokenized)
     try:
         text_tokenized = [
             str(y.encode("utf-8"), errors="ignore") for y in text_tokenized
         ]
-        stemmed = [stemmer.stem(y) for y in text_tokenized]
+        stemmed = [STEMMER.stem(y) for y in text_tokenized]
     except:
-        stemmed = [stemmer.stem(y) for y in text_tokenized]
-        stemmed = [d for d in stemmed if d not in stop]
+        stemmed = [STEMMER.stem(y) for y in text_tokenized]
+        stemmed = [d for d in stemmed if d not in PSY_STOPWORDS]
     return stemmed, n
 
 
@@ -324,68 +395,167 @@ def get_expanded_outrage(stemmed: List[str]) -> int:
     return 0
 
 
-def obtain_string_features_dict(string: str) -> Dict:
-    string_features_map: Dict[str, Any] = {}
-    string_features_map["text"] = str(string)
-    string_features_map["hashtag"] = get_hashtags_from_string(string)
-    string_features_map["wn_lemmatize"] = preprocess_text(string)
-    string_features_map["wn_lemmatize_hashtag"] = " ".join(
+# registry of feature name -> function that computes the feature from the
+# (lazily computed) features of a string. Features whose names start with "_"
+# are intermediates that are shared between features, rather than outputs.
+FEATURE_REGISTRY: Dict[str, Callable[["StringFeatures"], Any]] = {}
+
+
+def register_feature(name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        FEATURE_REGISTRY[name] = func
+        return func
+    return decorator
+
+
+class StringFeatures:
+    """Lazily computed features of a string.
+
+    Each feature is computed the first time that it's requested (along with
+    the features that it depends on) and then cached, so intermediates like
+    tokens and POS tags are only computed once, and features that aren't
+    requested aren't computed at all.
+    """
+
+    def __init__(self, string: str) -> None:
+        self.string = str(string)
+        self.cache: Dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self.cache:
+            self.cache[name] = FEATURE_REGISTRY[name](self)
+        return self.cache[name]
+
+    def get_features(self, names: List[str]) -> Dict[str, Any]:
+        return {name: self[name] for name in names}
+
+
+@register_feature("text")
+def _text(features: StringFeatures) -> str:
+    return features.string
+
+
+@register_feature("hashtag")
+def _hashtag(features: StringFeatures) -> str:
+    return get_hashtags_from_string(features.string)
+
+
+@register_feature("_cleaned_text")
+def _cleaned_text(features: StringFeatures) -> str:
+    return clean_text(features.string)
+
+
+@register_feature("wn_lemmatize")
+def _wn_lemmatize(features: StringFeatures) -> str:
+    return tokenize_stem_lemmatize_string(features["_cleaned_text"])
+
+
+@register_feature("wn_lemmatize_hashtag")
+def _wn_lemmatize_hashtag(features: StringFeatures) -> str:
+    return " ".join(
         [
             x
-            for x in string_features_map["wn_lemmatize"].split()
-            + string_features_map["hashtag"].split()
+            for x in features["wn_lemmatize"].split()
+            + features["hashtag"].split()
             if x
         ]
     )
-    (
-        string_features_map["psy_stemmed"],
-        string_features_map["len_tokenize"],
-    ) = psy_string_process(string)
-    """
-    string_features_map["get_arousal"] = get_arousal(
-        VALENCE_ARRAY,
-        string_features_map["psy_stemmed"],
-        string_features_map["len_tokenize"],
-    )
-    """
-    """
-    string_features_map["get_sentiment"] = get_sentiment(
-        NB_MODEL, NB_VECTORIZER, string_features_map["psy_stemmed"]
-    )
-    """
-    string_features_map["get_expanded_outrage"] = get_expanded_outrage(
-        string_features_map["psy_stemmed"]
+
+
+@register_feature("_psy_string_process")
+def _psy_string_process(features: StringFeatures) -> Tuple[List[str], int]:
+    return psy_string_process(features.string)
+
+
+@register_feature("psy_stemmed")
+def _psy_stemmed(features: StringFeatures) -> List[str]:
+    return features["_psy_string_process"][0]
+
+
+@register_feature("len_tokenize")
+def _len_tokenize(features: StringFeatures) -> int:
+    return features["_psy_string_process"][1]
+
+
+@register_feature("get_expanded_outrage")
+def _get_expanded_outrage(features: StringFeatures) -> int:
+    return get_expanded_outrage(features["psy_stemmed"])
+
+
+@register_feature("_emojis")
+def _emojis(features: StringFeatures) -> List[str]:
+    return EMOJI_INDEX.find(features.string)
+
+
+@register_feature("emojis_list")
+def _emojis_list(features: StringFeatures) -> str:
+    return " ".join(features["_emojis"])
+
+
+@register_feature("raw_len")
+def _raw_len(features: StringFeatures) -> int:
+    return len(features.string)
+
+
+@register_feature("has_hashtag")
+def _has_hashtag(features: StringFeatures) -> int:
+    return 1 if "#" in features.string else 0
+
+
+@register_feature("has_mention")
+def _has_mention(features: StringFeatures) -> int:
+    return 1 if "@" in features.string else 0
+
+
+@register_feature("has_link")
+def _has_link(features: StringFeatures) -> int:
+    return 1 if string_has_link(features.string) else 0
+
+
+@register_feature("count_emoji")
+def _count_emoji(features: StringFeatures) -> int:
+    return len(features["_emojis"])
+
+
+@register_feature("len_processed")
+def _len_processed(features: StringFeatures) -> int:
+    return len(features["wn_lemmatize"])
+
+
+# get top emojis and extract them into features (looking up just their names,
+# so that the name maps aren't built on import).
+for emoji in TOP_EMOJIS:
+    register_feature(EMOJI_INDEX.get_name(emoji))(
+        lambda features, emoji=emoji: [
+            1 if emoji in features["emojis_list"] else 0
+        ]
     )
 
-    string_features_map["emojis_list"] = extract_emojis(string)
-    string_features_map["raw_len"] = len(string)
-    string_features_map["has_hashtag"] = 1 if "#" in string else 0
-    string_features_map["has_mention"] = 1 if "@" in string else 0
-    string_features_map["has_link"] = 1 if string_has_link(string) else 0
-    string_features_map["count_emoji"] = sum(
-        [1 if char_is_emoji(char) else 0 for char in string]
+
+@register_feature("pos_count")
+def _pos_count(features: StringFeatures) -> Dict:
+    return modify_pos(
+        Counter(elem[1] for elem in token_postag(features["wn_lemmatize"]))
     )
-    string_features_map["len_processed"] = len(string_features_map["wn_lemmatize"])
 
-    # get top emojis and extract them into features
-    for emoji in TOP_EMOJIS:
-        name = emoji_unicode_to_name_map[emoji]
-        string_features_map[name] = [
-            1 if emoji in string_features_map["emojis_list"] else 0
-        ]
 
-    string_features_map["pos_count"] = modify_pos(
-        Counter(elem[1] for elem in token_postag(string_features_map["wn_lemmatize"]))
+for pos in POS:
+    register_feature(pos)(
+        lambda features, pos=pos: features["pos_count"].get(pos, 0)
     )
 
-    for pos_tag in POS:
-        string_features_map[pos_tag] = (
-            0
-            if pos_tag not in string_features_map["pos_count"]
-            else string_features_map["pos_count"][pos_tag]
-        )
+# all of the output features, in the order that they've always been returned.
+ALL_FEATURES = [
+    name for name in FEATURE_REGISTRY.keys() if not name.startswith("_")
+]
+
 
-    return string_features_map
+def obtain_string_features_dict(
+    string: str, features: Optional[List[str]] = None
+) -> Dict:
+    """Returns the requested features of a string (all of them, by default).
+    Only the transforms that the requested features need are run."""
+    return StringFeatures(string).get_features(features or ALL_FEATURES)
 
 
 if __name__ == "__main__":
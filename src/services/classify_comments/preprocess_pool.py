@@ -0,0 +1,150 @@
+"""Preprocess comments for classification in a pool of worker processes.
+
+POS tagging and lemmatization are CPU-bound and run on one core, so for
+large backlogs the texts are split into chunks that are preprocessed, in
+parallel, by worker processes. Each worker loads the NLTK resources and the
+tokenizer once, when it starts, and returns each chunk as a padded array of
+sequences (pickled NumPy), along with the lemmas that it added to its
+lemma cache, which are merged into the parent's (see
+`preprocess/lemma_cache.py`). The parent process then runs batched inference
+on all of the sequences, so the model is only loaded in the parent.
+
+Workers are started with "spawn" rather than "fork", since forking a
+process that has already loaded TensorFlow isn't safe.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from joblib import load
+import numpy as np
+
+from services.classify_comments.inference import (
+    DEFAULT_BATCH_SIZE,
+    MAX_SEQUENCE_LENGTH,
+    TOKENIZER_JOBLIB_FILE,
+    classify_padded_sequences,
+    texts_to_padded_sequences
+)
+from services.classify_comments.preprocess.lemma_cache import (
+    LemmaCacheStats, LemmaEntry, lemma_cache, track_updates_in_worker
+)
+from services.classify_comments.preprocess.strings import (
+    preload_nltk_resources
+)
+
+if TYPE_CHECKING:
+    from keras.models import Model
+    from keras.preprocessing.text import Tokenizer
+
+DEFAULT_NUM_WORKERS = os.cpu_count() or 1
+# number of texts that a worker preprocesses at once.
+DEFAULT_CHUNK_SIZE = 500
+
+# tokenizer of each worker process, loaded by `init_worker`.
+worker_tokenizer: Optional["Tokenizer"] = None
+
+
+def init_worker(tokenizer_joblib_file: str) -> None:
+    global worker_tokenizer
+    preload_nltk_resources()
+    track_updates_in_worker()
+    worker_tokenizer = load(tokenizer_joblib_file)
+
+
+def preprocess_chunk(
+    texts: list[str]
+) -> Tuple[np.ndarray, list[LemmaEntry], LemmaCacheStats]:
+    """Returns the padded sequences of a chunk, along with the updates to
+    the worker's lemma cache, to be merged into the parent's cache."""
+    padded_sequences = texts_to_padded_sequences(texts, worker_tokenizer)
+    return (padded_sequences, *lemma_cache.pop_updates())
+
+
+class PreprocessingPool:
+    """Pool of worker processes that turn texts into padded sequences.
+
+    Starting the workers (and loading their resources) takes a few seconds,
+    so a pool should be reused for as many texts as possible, e.g.:
+
+        with PreprocessingPool(num_workers=4) as pool:
+            padded_sequences = pool.texts_to_padded_sequences(texts)
+    """
+
+    def __init__(
+        self,
+        num_workers: int = DEFAULT_NUM_WORKERS,
+        tokenizer_joblib_file: str = TOKENIZER_JOBLIB_FILE
+    ) -> None:
+        self.num_workers = num_workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(tokenizer_joblib_file,)
+        )
+
+    def __enter__(self) -> "PreprocessingPool":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def texts_to_padded_sequences(
+        self, texts: list[str], chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> np.ndarray:
+        """Preprocesses and tokenizes texts, a chunk per worker task, into
+        one padded array of shape (len(texts), MAX_SEQUENCE_LENGTH), in the
+        same order as the texts. The lemmas that the workers added are merged
+        into this process's lemma cache."""
+        if not texts:
+            return np.zeros((0, MAX_SEQUENCE_LENGTH), dtype=np.int32)
+        chunks = [
+            texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)
+        ]
+        padded_sequences_list = []
+        for padded_sequences, new_lemmas, lemma_cache_stats in (
+            self.executor.map(preprocess_chunk, chunks)
+        ):
+            padded_sequences_list.append(padded_sequences)
+            lemma_cache.merge_updates(new_lemmas, lemma_cache_stats)
+        return np.concatenate(padded_sequences_list)
+
+
+def classify_texts_in_parallel(
+    texts: list[str],
+    embedding: "Model",
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    tokenizer_joblib_file: str = TOKENIZER_JOBLIB_FILE,
+    pool: Optional[PreprocessingPool] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Like `classify_texts`, but preprocesses the texts in a pool of
+    `num_workers` processes. Returns a tuple of (probabilities, labels)
+    arrays, both of shape (len(texts),).
+
+    If `pool` is given, it's used (and left open) instead of starting a new
+    pool, so that it can be reused across calls.
+    """
+    if not texts:
+        return np.array([], dtype=np.float32), np.array([], dtype=int)
+    if pool is not None:
+        padded_sequences = pool.texts_to_padded_sequences(
+            texts, chunk_size=chunk_size
+        )
+    else:
+        with PreprocessingPool(
+            num_workers=num_workers,
+            tokenizer_joblib_file=tokenizer_joblib_file
+        ) as pool:
+            padded_sequences = pool.texts_to_padded_sequences(
+                texts, chunk_size=chunk_size
+            )
+    return classify_padded_sequences(
+        padded_sequences, embedding, batch_size=batch_size
+    )
@@ -0,0 +1,65 @@
+import unittest
+
+from services.classify_comments.benchmark import (
+    compare_results, load_comments_corpus, run_stage
+)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_load_comments_corpus(self) -> None:
+        texts = load_comments_corpus(max_comments=10)
+        self.assertEqual(len(texts), 10)
+        self.assertEqual(texts, sorted(set(texts)))
+        self.assertTrue(all(text.strip() for text in texts))
+
+    def test_run_stage(self) -> None:
+        result = run_stage(
+            "sum", lambda: sum(range(1000)), num_comments=1000, batch_size=32
+        )
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["batch_size"], 32)
+        self.assertGreater(result["comments_per_second"], 0)
+        self.assertGreater(result["max_rss_mb"], 0)
+        self.assertIn("rss_delta_mb", result)
+        self.assertNotIn("workers_max_rss_mb", result)
+        result = run_stage(
+            "sum", lambda: sum(range(1000)), num_comments=1000, num_workers=2
+        )
+        self.assertIn("workers_max_rss_mb", result)
+
+    def test_run_stage_reports_rss_delta(self) -> None:
+        data: list = []
+        result = run_stage(
+            "allocate",
+            lambda: data.append(bytearray(50_000_000)),
+            num_comments=1
+        )
+        if result["rss_delta_mb"] is None:
+            self.skipTest("Current RSS can't be read on this platform.")
+        self.assertGreater(result["rss_delta_mb"], 40)
+
+    def test_run_stage_records_errors(self) -> None:
+        def fail() -> None:
+            raise ValueError("no model")
+
+        result = run_stage("fail", fail, num_comments=10, trace_memory=True)
+        self.assertEqual(result["error"], "ValueError: no model")
+        self.assertNotIn("comments_per_second", result)
+
+    def test_compare_results(self) -> None:
+        previous_results = {"stages": [
+            {"stage": "classify_texts", "batch_size": 32, "comments_per_second": 100.0}, # noqa
+            {"stage": "classify_texts", "batch_size": 256, "comments_per_second": 200.0}, # noqa
+        ]}
+        results = {"stages": [
+            {"stage": "classify_texts", "batch_size": 256, "comments_per_second": 300.0}, # noqa
+            {"stage": "classify_texts", "batch_size": 1024, "comments_per_second": 400.0}, # noqa
+        ]}
+        comparisons = compare_results(results, previous_results)
+        self.assertEqual(len(comparisons), 1)
+        self.assertEqual(comparisons[0]["batch_size"], 256)
+        self.assertEqual(comparisons[0]["speedup"], 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import sqlite3
+import unittest
+
+from services.classify_comments.classification_queue import (
+    ClassificationQueue
+)
+
+
+class TestClassificationQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        self.conn = sqlite3.connect(":memory:")
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE TABLE comments (id text, synctimestamp timestamptz)") # noqa
+        cursor.executemany(
+            "INSERT INTO comments VALUES (?, ?)",
+            [
+                ("d", "2023-10-12T00:00:03"),
+                ("c", "2023-10-12T00:00:01"),
+                ("b", "2023-10-12T00:00:01"),
+                ("a", "2023-10-12T00:00:00"),
+            ]
+        )
+        cursor.execute(
+            "CREATE TABLE classified_comments (id text, is_classified bool)"
+        )
+        cursor.execute("INSERT INTO classified_comments VALUES ('a', TRUE)")
+        self.conn.commit()
+        self.queue = ClassificationQueue(self.conn, backend="sqlite")
+
+    def tearDown(self) -> None:
+        self.conn.close()
+
+    def test_create_table_backfills_unclassified_comments(self) -> None:
+        self.assertEqual(self.queue.create_table(), 3)
+        self.assertEqual(self.queue.get_num_comments(), 3)
+        # the queue is only backfilled when it's created.
+        self.assertEqual(self.queue.create_table(), 0)
+
+    def test_claims_are_ordered_and_disjoint(self) -> None:
+        self.queue.create_table()
+        self.assertEqual(self.queue.claim("worker-1", 2), ["b", "c"])
+        self.assertEqual(self.queue.claim("worker-2", 2), ["d"])
+        self.assertEqual(self.queue.claim("worker-3", 2), [])
+        self.assertEqual(self.queue.get_num_comments(claimed=True), 3)
+
+    def test_writes_invalidate_cached_queries(self) -> None:
+        self.queue.create_table()
+        self.queue.claim("worker-1", 2)
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT version FROM table_write_versions WHERE table_name = 'classification_queue'" # noqa
+        )
+        self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_complete_removes_only_own_claims(self) -> None:
+        self.queue.create_table()
+        comment_ids = self.queue.claim("worker-1", 3)
+        self.assertEqual(self.queue.complete(comment_ids, "worker-2"), 0)
+        self.assertEqual(self.queue.complete(comment_ids, "worker-1"), 3)
+        self.assertEqual(self.queue.get_num_comments(), 0)
+
+    def test_released_comments_can_be_claimed_again(self) -> None:
+        self.queue.create_table()
+        comment_ids = self.queue.claim("worker-1", 2)
+        self.queue.release(comment_ids, "worker-1")
+        self.assertEqual(self.queue.claim("worker-2", 2), comment_ids)
+
+    def test_expired_claims_can_be_claimed_again(self) -> None:
+        self.queue.create_table()
+        self.queue.claim("worker-1", 3)
+        self.assertEqual(self.queue.claim("worker-2", 3), [])
+        self.queue.lease_seconds = -1
+        self.assertEqual(self.queue.claim("worker-2", 3), ["b", "c", "d"])
+        # the first worker can no longer complete the comments.
+        self.assertEqual(self.queue.complete(["b"], "worker-1"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from services.classify_comments.preprocess.emoji_index import (
+    EmojiIndex,
+    build_trie,
+    get_character_class_regex
+)
+
+
+class TestEmojiIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = EmojiIndex()
+
+    def test_is_emoji(self) -> None:
+        self.assertTrue(self.index.is_emoji("😂"))
+        self.assertTrue(self.index.is_emoji("👍🏽"))
+        self.assertFalse(self.index.is_emoji("a"))
+        self.assertFalse(self.index.is_emoji("ab"))
+
+    def test_find_single_codepoint_emojis(self) -> None:
+        self.assertEqual(self.index.find("lol 😂😂 ok 🙄"), ["😂", "😂", "🙄"])
+        self.assertEqual(self.index.find("no emojis here, #1"), [])
+
+    def test_find_multi_codepoint_emojis(self) -> None:
+        family = "\U0001F468‍\U0001F469‍\U0001F467"
+        self.assertEqual(
+            self.index.find(f"a {family} b 👍🏽 c 🇺🇸 d ❤️ e #️⃣"),
+            [family, "👍🏽", "🇺🇸", "❤️", "#️⃣"]
+        )
+
+    def test_finds_every_emoji_whole(self) -> None:
+        for emoji in self.index.emojis:
+            self.assertEqual(self.index.find(emoji), [emoji])
+
+    def test_extract_and_count(self) -> None:
+        strings = ["", "😂 x 😂", "👍🏽🙏"]
+        self.assertEqual(
+            self.index.extract(strings), [[], ["😂", "😂"], ["👍🏽", "🙏"]]
+        )
+        self.assertEqual(self.index.count(strings), [0, 2, 2])
+
+    def test_name_maps(self) -> None:
+        name = self.index.unicode_to_name_map["😂"]
+        self.assertEqual(self.index.name_to_unicode_map[name], "😂")
+        self.assertTrue(self.index.is_emoji_name(name))
+
+    def test_get_name_does_not_build_name_maps(self) -> None:
+        self.assertEqual(
+            self.index.get_name("😂"), self.index.emoji_data["😂"]["en"]
+        )
+        self.assertNotIn("unicode_to_name_map", self.index.__dict__)
+        self.assertNotIn("name_to_unicode_map", self.index.__dict__)
+
+    def test_build_trie(self) -> None:
+        self.assertEqual(
+            build_trie(["ab", "a"]), {"a": {"": {}, "b": {"": {}}}}
+        )
+
+    def test_get_character_class_regex(self) -> None:
+        self.assertEqual(get_character_class_regex(["c", "a", "b", "x"]), "[a-cx]")
+
+
+if __name__ == "__main__":
+    unittest.main()
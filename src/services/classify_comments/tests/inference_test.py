@@ -0,0 +1,21 @@
+import unittest
+
+import numpy as np
+
+from services.classify_comments.inference import pad_sequences
+
+
+class TestPadSequences(unittest.TestCase):
+    def test_pads_at_end_and_truncates_from_start(self) -> None:
+        padded_sequences = pad_sequences([[1, 2], [], [3, 4, 5, 6]], maxlen=3)
+        self.assertEqual(padded_sequences.dtype, np.int32)
+        np.testing.assert_array_equal(
+            padded_sequences, [[1, 2, 0], [0, 0, 0], [4, 5, 6]]
+        )
+
+    def test_no_sequences(self) -> None:
+        self.assertEqual(pad_sequences([], maxlen=3).shape, (0, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
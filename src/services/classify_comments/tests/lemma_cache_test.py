@@ -0,0 +1,80 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from services.classify_comments.preprocess.lemma_cache import LemmaCache
+
+
+class CountingLemmatizer:
+    """Lemmatizer that strips a trailing "s" and counts its calls."""
+
+    def __init__(self) -> None:
+        self.num_calls = 0
+
+    def lemmatize(self, word: str, pos: str = "n") -> str:
+        self.num_calls += 1
+        return word[:-1] if word.endswith("s") else word
+
+
+class TestLemmaCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lemmatizer = CountingLemmatizer()
+        self.cache = LemmaCache(max_size=2, lemmatizer=self.lemmatizer)
+
+    def test_lemmatize_caches_lemmas(self) -> None:
+        self.assertEqual(self.cache.lemmatize("cats"), "cat")
+        self.assertEqual(self.cache.lemmatize("cats", pos="n"), "cat")
+        self.assertEqual(self.lemmatizer.num_calls, 1)
+        self.assertEqual(self.cache.stats.num_hits, 1)
+        self.assertEqual(self.cache.stats.num_misses, 1)
+        self.assertEqual(self.cache.stats.hit_rate, 0.5)
+
+    def test_lemmas_are_cached_per_pos(self) -> None:
+        self.cache.lemmatize("runs", pos="n")
+        self.cache.lemmatize("runs", pos="v")
+        self.assertEqual(self.lemmatizer.num_calls, 2)
+
+    def test_evicts_least_recently_used(self) -> None:
+        self.cache.lemmatize("cats")
+        self.cache.lemmatize("dogs")
+        self.cache.lemmatize("cats")
+        self.cache.lemmatize("birds")
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats.num_evictions, 1)
+        self.assertIn(("cats", "n"), self.cache.lemmas)
+        self.assertNotIn(("dogs", "n"), self.cache.lemmas)
+
+    def test_save_and_load(self) -> None:
+        self.cache.lemmatize("cats")
+        self.cache.lemmatize("runs", pos="v")
+        with TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "lemmas.json")
+            self.cache.save(file_path)
+            loaded_cache = LemmaCache(lemmatizer=CountingLemmatizer())
+            loaded_cache.load(file_path)
+        self.assertEqual(loaded_cache.lemmas, self.cache.lemmas)
+        self.assertEqual(loaded_cache.lemmatize("cats"), "cat")
+        self.assertEqual(loaded_cache.lemmatizer.num_calls, 0)
+
+    def test_pop_and_merge_updates(self) -> None:
+        self.cache.track_updates = True
+        self.cache.lemmatize("cats")
+        self.cache.lemmatize("cats")
+        new_lemmas, stats = self.cache.pop_updates()
+        self.assertEqual(new_lemmas, [("cats", "n", "cat")])
+        self.assertEqual((stats.num_hits, stats.num_misses), (1, 1))
+        self.assertEqual(self.cache.pop_updates()[0], [])
+
+        parent_cache = LemmaCache(max_size=2, lemmatizer=CountingLemmatizer())
+        parent_cache.lemmatize("dogs")
+        parent_cache.lemmatize("birds")
+        parent_cache.merge_updates(new_lemmas, stats)
+        self.assertEqual(
+            list(parent_cache.lemmas), [("birds", "n"), ("cats", "n")]
+        )
+        self.assertEqual(parent_cache.stats.num_hits, 1)
+        self.assertEqual(parent_cache.stats.num_misses, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+
+import numpy as np
+
+from services.classify_comments.micro_batcher import MicroBatcher
+
+
+class RecordingClassifier:
+    """Classifies a text as its length / 10, and records each batch."""
+
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            self.batches.append(texts)
+        probs = np.array([len(text) / 10 for text in texts])
+        return probs, (probs > 0.51).astype(int)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.classifier = RecordingClassifier()
+
+    def test_classify(self) -> None:
+        batcher = MicroBatcher(self.classifier, max_latency_ms=1)
+        self.assertEqual(batcher.classify("abc"), {"prob": 0.3, "label": 0})
+        self.assertEqual(batcher.classify("abcdefg"), {"prob": 0.7, "label": 1})
+        batcher.close()
+
+    def test_coalesces_concurrent_requests(self) -> None:
+        batcher = MicroBatcher(
+            self.classifier, max_batch_size=8, max_latency_ms=200
+        )
+        texts = [str(i) * (i % 10) for i in range(32)]
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            results = list(executor.map(batcher.classify, texts))
+        batcher.close()
+        self.assertEqual(
+            [result["prob"] for result in results],
+            [len(text) / 10 for text in texts]
+        )
+        self.assertLess(len(self.classifier.batches), len(texts))
+        self.assertTrue(
+            all(len(batch) <= 8 for batch in self.classifier.batches)
+        )
+        metrics = batcher.metrics.to_dict()
+        self.assertEqual(metrics["num_requests"], 32)
+        self.assertEqual(
+            metrics["num_batches"], len(self.classifier.batches)
+        )
+        self.assertIn("p99", metrics["latency_ms"])
+
+    def test_classify_many(self) -> None:
+        batcher = MicroBatcher(
+            self.classifier, max_batch_size=4, max_latency_ms=50
+        )
+        results = batcher.classify_many(["a", "bb", "ccc", "dddd", "eeeee"])
+        batcher.close()
+        self.assertEqual(
+            [result["prob"] for result in results], [0.1, 0.2, 0.3, 0.4, 0.5]
+        )
+        self.assertEqual(
+            [len(batch) for batch in self.classifier.batches], [4, 1]
+        )
+
+    def test_errors_are_raised_to_callers(self) -> None:
+        def classify_texts(texts: list[str]) -> None:
+            raise ValueError("Model failed.")
+
+        batcher = MicroBatcher(classify_texts, max_latency_ms=1)
+        with self.assertRaises(ValueError):
+            batcher.classify("abc")
+        self.assertEqual(batcher.metrics.num_errors, 1)
+        batcher.close()
+
+    def test_failed_batches_are_retried_one_text_at_a_time(self) -> None:
+        def classify_texts(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+            if "bad" in texts:
+                raise ValueError("Model failed.")
+            return self.classifier(texts)
+
+        batcher = MicroBatcher(
+            classify_texts, max_batch_size=3, max_latency_ms=1000
+        )
+        futures = [batcher.submit(text) for text in ["abc", "bad", "abcdef"]]
+        self.assertEqual(futures[0].result(), {"prob": 0.3, "label": 0})
+        with self.assertRaises(ValueError):
+            futures[1].result()
+        self.assertEqual(futures[2].result(), {"prob": 0.6, "label": 1})
+        self.assertEqual(self.classifier.batches, [["abc"], ["abcdef"]])
+        self.assertEqual(batcher.metrics.num_errors, 1)
+        self.assertEqual(batcher.metrics.num_requests, 2)
+        batcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
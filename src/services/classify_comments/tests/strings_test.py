@@ -0,0 +1,93 @@
+import glob
+import os
+import re
+import unittest
+
+import pandas as pd
+
+from data.helper import DATA_DIR
+from services.classify_comments.preprocess.strings import (
+    PUNCTUATION_REGEX,
+    STOPWORDS,
+    TextNormalizer,
+    clean_text
+)
+
+COMMENTS_CORPUS_GLOB = os.path.join(DATA_DIR, "comments", "*.csv")
+
+
+def reference_clean_text(string: str) -> str:
+    """The original chain of regexes that `TextNormalizer` replaces."""
+    string = re.sub(r"//t.co\S+", "", string)
+    string = re.sub(r"http\S+\s*", "", string)
+    string = re.sub("RT|cc", "", string)
+    string = re.sub(r"#\S+", "", string)
+    string = re.sub(r"@\S+", "", string)
+    string = re.sub(PUNCTUATION_REGEX, "", string)
+    string = re.sub(r"\s+", " ", string)
+    stopwords = list(STOPWORDS)
+    return " ".join(
+        word
+        for word in string.split()
+        if word.lower() not in stopwords and len(word) >= 3
+    )
+
+
+def load_comments_corpus() -> list[str]:
+    bodies: set[str] = set()
+    for file_path in sorted(glob.glob(COMMENTS_CORPUS_GLOB)):
+        df = pd.read_csv(file_path, usecols=["body"], dtype=object)
+        bodies.update(df["body"].dropna())
+    return sorted(bodies)
+
+
+class TestTextNormalizer(unittest.TestCase):
+    golden_outputs = {
+        "": "",
+        "The cat sat on the mat": "cat sat mat",
+        "RT @someone: read this https://example.com/a?b=c  now": "read",
+        "check //t.co/abc123 and http://x.co #news #Politics": "check",
+        "Accounting, recycling & so on...": "Aounting recycling",
+        "  lots   of\twhitespace\n\nhere  ": "lots whitespace",
+        "email me@example.com about it!!": "email",
+        "don't won't can't isn't": "can't",
+        "up 100% agreed!!": "100 agreed",
+        "hashtag#inside a word": "hashtag word",
+        "abc#cc": "abc#",
+        "abc#RT": "abc#",
+        "ahttp://link.com  joined": "ajoined",
+        "😂😂😂 so funny 😡": "😂😂😂 funny",
+    }
+
+    def test_golden_outputs(self) -> None:
+        normalizer = TextNormalizer()
+        for string, expected_output in self.golden_outputs.items():
+            with self.subTest(string=string):
+                self.assertEqual(normalizer.normalize(string), expected_output)
+                self.assertEqual(reference_clean_text(string), expected_output)
+
+    def test_tokenize(self) -> None:
+        self.assertEqual(
+            TextNormalizer().tokenize("The quick brown fox, #fast"),
+            ["quick", "brown", "fox"]
+        )
+
+    def test_custom_stopwords_and_min_word_length(self) -> None:
+        normalizer = TextNormalizer(stopwords=["brown"], min_word_length=2)
+        self.assertEqual(
+            normalizer.normalize("The quick brown fox is a fox"),
+            "The quick fox is fox"
+        )
+
+    def test_matches_reference_on_comments_corpus(self) -> None:
+        corpus = load_comments_corpus()
+        if not corpus:
+            self.skipTest("No comments in data/comments.")
+        for string in corpus:
+            self.assertEqual(
+                clean_text(string), reference_clean_text(string), msg=string
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
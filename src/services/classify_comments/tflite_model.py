@@ -0,0 +1,68 @@
+"""Run the classifier with TensorFlow Lite instead of Keras.
+
+A TFLite artifact (see `export_model.py`) is much faster to load and has a
+smaller footprint than the Keras .h5 model. `TFLiteModel` has the same
+`predict` signature as a Keras model, so it can be passed anywhere that the
+Keras model is (e.g., to `inference.classify_texts`).
+
+The interpreter comes from the standalone `tflite_runtime` package if it's
+installed, so that running the model doesn't import TensorFlow, and from
+TensorFlow otherwise. Texts are padded with NumPy (see
+`inference.pad_sequences`), but the tokenizer is a pickled Keras `Tokenizer`,
+so loading it still imports Keras (and so TensorFlow).
+"""
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class TFLiteModel:
+    def __init__(self, model_path: str, num_threads: int = 1) -> None:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.model_path = model_path
+        self.interpreter = Interpreter(
+            model_path=model_path, num_threads=num_threads
+        )
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batch_size: Optional[int] = None
+        # an interpreter can only run one batch at a time.
+        self.lock = threading.Lock()
+
+    def resize(self, batch_size: int) -> None:
+        if batch_size == self.batch_size:
+            return
+        self.interpreter.resize_tensor_input(
+            self.input_details["index"],
+            [batch_size, *self.input_details["shape"][1:]]
+        )
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def predict_batch(self, padded_sequences: np.ndarray) -> np.ndarray:
+        with self.lock:
+            self.resize(len(padded_sequences))
+            self.interpreter.set_tensor(
+                self.input_details["index"],
+                padded_sequences.astype(self.input_details["dtype"])
+            )
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(
+                self.output_details["index"]
+            ).copy()
+
+    def predict(
+        self, padded_sequences: np.ndarray, batch_size: int = 32, verbose: int = 0
+    ) -> np.ndarray:
+        """Returns the model's predictions, like `keras.Model.predict`."""
+        if len(padded_sequences) == 0:
+            return np.zeros((0, 1), dtype=np.float32)
+        return np.concatenate([
+            self.predict_batch(padded_sequences[i:i + batch_size])
+            for i in range(0, len(padded_sequences), batch_size)
+        ])
@@ -114,20 +114,20 @@ def handle_received_messages() -> None:
             select_fields=select_fields,
             where_filter=where_filter
         )
-        most_recent_timestamp = most_recent_timestamp.iloc[0][0]
+        # `synctimestamp` is a TIMESTAMPTZ column, so this is a native
+        # timestamp (naive ISO strings from unmigrated tables are read as UTC)
+        most_recent_timestamp = pd.to_datetime(
+            most_recent_timestamp.iloc[0][0], utc=True
+        )
         # filter dms_received by most_recent_timestamp. If the DM was received
         # more recently than the last time that we appended data to the
         # messages_received table, then we want to keep it.
-        created_utc_list = messages_received_df["created_utc"].tolist()
-        created_utc_isoformat_list = [
-            pd.to_datetime(utc_float, unit="s").isoformat()
-            for utc_float in created_utc_list
-        ]
-        filter_list: list[bool] = [
-            isoformat_timestamp > most_recent_timestamp
-            for isoformat_timestamp in created_utc_isoformat_list
+        created_utc_timestamps = pd.to_datetime(
+            messages_received_df["created_utc"], unit="s", utc=True
+        )
+        messages_received_df = messages_received_df[
+            created_utc_timestamps > most_recent_timestamp
         ]
-        messages_received_df = messages_received_df[filter_list]
         if len(messages_received_df) == 0:
             print("No new messages received. Exiting.")
             return
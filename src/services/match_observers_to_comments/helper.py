@@ -130,14 +130,16 @@ def match_observers_to_comments() -> None:
         select_fields=["comment_id"],
         where_filter=comments_where_filter,
         order_by_clause="ORDER BY comment_id ASC", # added to make sure we get same comments each time
-        limit_clause=f"LIMIT {DEFAULT_COMMENT_LIMIT}"
+        limit_clause=f"LIMIT {DEFAULT_COMMENT_LIMIT}",
+        use_cache=True
     )
     valid_observers_df = load_table_as_df(
         table_name="user_to_message_status",
         select_fields=["user_id"],
         where_filter=observers_where_filter,
         order_by_clause="ORDER BY user_id ASC", # added to make sure we get same observers each time
-        limit_clause=f"LIMIT {DEFAULT_OBSERVER_LIMIT}"
+        limit_clause=f"LIMIT {DEFAULT_OBSERVER_LIMIT}",
+        use_cache=True
     )
 
     num_comments = len(valid_comments_df)
@@ -1,13 +1,14 @@
 import datetime
+import os
 from typing import Optional
 
 import pandas as pd
 from praw.exceptions import RedditAPIException
 
 from data.helper import (
-    delete_tmp_json_data, dump_df_to_csv, dump_dict_as_tmp_json,
-    load_tmp_json_data
+    DATA_DIR, delete_tmp_json_data, dump_df_to_csv, load_tmp_json_data
 )
+from data.journal import CheckpointJournal
 from lib.db.sql.helper import (
     load_table_as_df, return_statuses_of_user_to_message_status_table,
     write_df_to_database
@@ -38,7 +39,8 @@ def filter_payloads_by_valid_users_to_dm(
     filtered_users_df = load_table_as_df(
         table_name="users",
         select_fields=select_fields,
-        where_filter=where_filter
+        where_filter=where_filter,
+        use_cache=True
     )
     valid_users_to_dm = set(filtered_users_df["name"].tolist())
     filtered_payloads: list[dict] = []
@@ -120,13 +122,18 @@ def is_valid_payload(payload: dict) -> bool:
 
 
 def message_users(
-    payloads: list[dict], num_to_message: Optional[int] = None
+    payloads: list[dict],
+    num_to_message: Optional[int] = None,
+    journal: Optional[CheckpointJournal] = None
 ) -> tuple[list[dict], list[dict], list[dict]]:
     """Send messages to users.
     
     Returns a tuple of (successful_messages, messages_to_retry, failed_messages).
     Optionally takes a `num_to_message` parameter, which will limit the number
     of DMs sent to the number specified.
+
+    The outcome of each DM that isn't retried is appended to the checkpoint
+    `journal` (if given), so that an interrupted session can be resumed.
     """
     successful_messages = []
     messages_to_retry = []
@@ -144,8 +151,7 @@ def message_users(
         if not is_valid_payload(payload):
             raise ValueError(f"Invalid payload (fields are not correct): {payload}") # noqa
         status = message_single_user(payload, context)
-        tmp_filename = f"{payload['user_id']}_{payload['comment_id']}.json" # noqa
-        # write DMs to a temporary table, so that in case the
+        # write DMs to the checkpoint journal, so that in case the
         # messaging service fails at any point, there will be a record of the
         # DMs that have been successfully sent.
         if status == 0:
@@ -153,11 +159,8 @@ def message_users(
             updated_payload = {
                 **payload, **{"message_status": "messaged_successfully"}
             }
-            dump_dict_as_tmp_json(
-                data=updated_payload,
-                table_name=tmp_table_name,
-                filename=tmp_filename
-            )
+            if journal is not None:
+                journal.append(updated_payload)
         else:
             if (
                 isinstance(status, RedditAPIException)
@@ -173,15 +176,26 @@ def message_users(
                     **payload,
                     **{"message_status": "message_failed_dm_forbidden"}
                 }
-                dump_dict_as_tmp_json(
-                    data=updated_payload,
-                    table_name=tmp_table_name,
-                    filename=tmp_filename
-                )
+                if journal is not None:
+                    journal.append(updated_payload)
 
     return (successful_messages, messages_to_retry, failed_messages)
 
 
+def open_message_users_journal() -> CheckpointJournal:
+    """Opens the checkpoint journal of the messaging service. DMs cached as
+    .json files by earlier versions of the service are moved into it."""
+    journal = CheckpointJournal(
+        table_name=tmp_table_name, key_fields=("user_id", "comment_id")
+    )
+    if os.path.exists(os.path.join(DATA_DIR, tmp_table_name, "tmp")):
+        for cached_payload in load_tmp_json_data(table_name=tmp_table_name):
+            journal.append(cached_payload)
+        journal.sync()
+        delete_tmp_json_data(table_name=tmp_table_name)
+    return journal
+
+
 def add_cached_payloads_to_session(
     payloads: list[dict],
     cached_payloads: list[dict],
@@ -290,7 +304,8 @@ def handle_message_users(
             for payload in invalid_payloads
         ]
         failed_messages.extend(updated_invalid_payloads)
-    cached_payloads = load_tmp_json_data(table_name=tmp_table_name)
+    journal = open_message_users_journal()
+    cached_payloads = journal.records()
     payloads, cached_successes, cached_retries, cached_failed = (
         add_cached_payloads_to_session(
             payloads=payloads,
@@ -314,7 +329,7 @@ def handle_message_users(
         print(f"Batch size: {batch_size}\t Cached messages: {total_cached_messages}\t Number to message: {num_to_message}") # noqa
         if payloads:
             successes, retries, failures = (
-                message_users(payloads, num_to_message)
+                message_users(payloads, num_to_message, journal=journal)
             )
             successful_messages.extend(successes)
             messages_to_retry.extend(retries)
@@ -338,7 +353,9 @@ def handle_message_users(
             num_to_message = batch_size - total_messages
             if num_to_message > 0:
                 retry_successful_messages, more_messages_to_retry, retry_failed_messages = ( # noqa
-                    message_users(messages_to_retry, num_to_message)
+                    message_users(
+                        messages_to_retry, num_to_message, journal=journal
+                    )
                 )
                 successful_messages.extend(retry_successful_messages)
                 failed_messages.extend(retry_failed_messages)
@@ -394,9 +411,10 @@ def handle_message_users(
     )
     return_statuses_of_user_to_message_status_table()
 
-    # delete tmp json data (it exists solely in case there is an interruption
+    # clear the journal (it exists solely in case there is an interruption
     # in the run, so that we don't lose data on which users we've DMed).
-    delete_tmp_json_data(table_name=tmp_table_name)
+    journal.clear()
+    journal.close()
 
     print(f"Completed messaging users for {phase} phase.")
     print("Done")
@@ -20,12 +20,14 @@ def main(event: dict, context: dict) -> int:
     objects_to_sync = event.get(
         "object_to_sync", ["subreddits", "threads", "users", "comments"]
     )
+    classify_on_ingest = event.get("classify_on_ingest", False)
     sync_comments_from_one_subreddit(
         api=api,
         subreddit=subreddit,
         max_num_threads=max_num_threads,
         max_total_comments=max_total_comments,
         thread_sort_type=thread_sort_type,
-        objects_to_sync=objects_to_sync
+        objects_to_sync=objects_to_sync,
+        classify_on_ingest=classify_on_ingest
     )
     return 0
@@ -3,7 +3,7 @@ import csv
 from datetime import datetime
 import os
 import traceback
-from typing import Any, Literal, Union
+from typing import TYPE_CHECKING, Any, Literal, Optional, Union
 
 import pandas as pd
 from praw.models.comment_forest import CommentForest
@@ -17,13 +17,18 @@ from praw.reddit import Reddit
 import prawcore
 
 from data.helper import dump_df_to_csv
-from lib.db.sql.helper import load_table_as_df, write_df_to_database
+from lib.db.sql.helper import (
+    WriteResult, load_table_as_df, write_df_to_database, write_dfs_to_database
+)
 from lib.helper import (
     CURRENT_TIME_STR, DENYLIST_AUTHORS,
     add_enrichment_fields,
     generic_rate_limiter_decorator,
     is_json_serializable,
 )
+from services.classify_comments.classification_queue import (
+    build_classification_queue_df, classification_queue
+)
 from services.sync_single_subreddit.constants import (
     new_sync_metadata_dir, NEW_SYNC_METADATA_FULL_FP
 )
@@ -31,6 +36,9 @@ from services.sync_single_subreddit.transformations import (
     field_specific_parsing, object_specific_enrichments
 )
 
+if TYPE_CHECKING:
+    from services.classify_comments.ingest_classifier import IngestClassifier
+
 DEFAULT_THREAD_SORT_TYPE = "hot"
 DEFAULT_MAX_NUM_THREADS = 10
 DEFAULT_MAX_COMMENTS = 200
@@ -391,21 +399,28 @@ def parse_comment_thread_data(
 @generic_rate_limiter_decorator
 def get_threads_data(
     threads: list[Submission],
-    max_total_comments: int
+    max_total_comments: int,
+    ingest_classifier: Optional["IngestClassifier"] = None
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Given a list of threads, get the thread, comment, and user info for the
     thread, all comments in the thread (and their children comments), and the
     users who were involved/commented in the comment threads.
+
+    If an `ingest_classifier` is given, the comments of each thread are
+    queued to be classified, in the background, as soon as the thread is
+    parsed.
     
     Returns a tuple of 3 dataframes, one for the thread info, one for info on
     the comments in the thread, and one for the users in the thread.
     """
-    parsed_comment_threads_data = [
-        parse_comment_thread_data(
+    parsed_comment_threads_data = []
+    for thread in threads:
+        parsed_comment_thread_data = parse_comment_thread_data(
             thread=thread, max_total_comments=max_total_comments
         )
-        for thread in threads
-    ]
+        if ingest_classifier is not None:
+            ingest_classifier.submit_comments(parsed_comment_thread_data[2])
+        parsed_comment_threads_data.append(parsed_comment_thread_data)
     # get only threads that we actually processed, not any threads that we
     # skipped because we already had enough comments.
     threads_info_list: list[dict] = [
@@ -500,12 +515,17 @@ def sync_comments_from_one_subreddit(
     max_num_threads: int,
     max_total_comments: int,
     thread_sort_type: Literal["hot", "new", "top", "controversial"] = "hot",
-    objects_to_sync: list[str] = ["subreddits", "threads", "users", "comments"]
+    objects_to_sync: list[str] = ["subreddits", "threads", "users", "comments"],
+    classify_on_ingest: bool = False
 ) -> None:
     """Syncs the comments from one subreddit.
     
     Does so by grabbing threads and looking at the most recent
-    comments in a given thread."""
+    comments in a given thread.
+
+    With `classify_on_ingest`, the comments are also classified while they're
+    synced (see `classify_comments/ingest_classifier.py`) and written to
+    `classified_comments` in the same transaction as the comments."""
     subreddit = api.subreddit(subreddit)
     subreddit_df = get_subreddit_data(subreddit)   
     
@@ -527,10 +547,20 @@ def sync_comments_from_one_subreddit(
         thread_sort_type=thread_sort_type
     )
 
+    ingest_classifier: Optional["IngestClassifier"] = None
+    if classify_on_ingest and "comments" in objects_to_sync:
+        # imported here so that syncs that don't classify don't import the
+        # classifier's dependencies.
+        from services.classify_comments.ingest_classifier import (
+            IngestClassifier
+        )
+        ingest_classifier = IngestClassifier()
+
     try:
         threads_df, users_df, comments_df = get_threads_data(
             threads=threads,
-            max_total_comments=max_total_comments
+            max_total_comments=max_total_comments,
+            ingest_classifier=ingest_classifier
         )
         if len(comments_df) > 0 and len(users_df) > 0:
             comments_df = filter_comments_by_users(
@@ -540,6 +570,8 @@ def sync_comments_from_one_subreddit(
     except Exception as e:
         print(f"Unable to sync reddit data: {e}")
         traceback.print_exc()
+        if ingest_classifier is not None:
+            ingest_classifier.close()
         raise
 
     print("Successfully synced data from Reddit. Now writing to DB...")
@@ -547,8 +579,25 @@ def sync_comments_from_one_subreddit(
     # if we didn't sync any data, return. Nothing to write.
     if len(comments_df) == 0 and len(users_df) == 0:
         print("No comments or users synced. Exiting...")
+        if ingest_classifier is not None:
+            ingest_classifier.close()
         return
 
+    # the classifications of the comments that we kept. If classification
+    # failed, the comments are still synced, and are classified later by the
+    # classify pipeline instead.
+    classified_comments_df: Optional[pd.DataFrame] = None
+    if ingest_classifier is not None:
+        try:
+            classified_comments_df = (
+                ingest_classifier.get_classified_comments_df(comments_df)
+            )
+            print(f"Classified {classified_comments_df.shape[0]} comments on ingest.") # noqa
+        except Exception as e:
+            print(f"Unable to classify comments on ingest: {e}")
+            traceback.print_exc()
+            ingest_classifier.close()
+
     # consolidate field mismatch, if any, in the sync objects (this can happen
     # due to modifications either in the Reddit API or in the `praw` wrapper)
     subreddit_df = consolidate_field_mismatches(
@@ -568,33 +617,43 @@ def sync_comments_from_one_subreddit(
     print(f"Number of users: {users_df.shape[0]}")
     print(f"Number of comments: {comments_df.shape[0]}")
 
-    try:
-        for sync_object in objects_to_sync:
-            if sync_object == "subreddits":
-                print("Dumping subreddits to .csv, writing to DB...")
-                write_df_to_database(
-                    df=subreddit_df, table_name="subreddits", upsert=True
-                )
-                dump_df_to_csv(df=subreddit_df, table_name="subreddits")
-            elif sync_object == "users":
-                print("Dumping users to .csv, writing to DB...")
-                write_df_to_database(
-                    df=users_df, table_name="users", upsert=True
-                )
-                dump_df_to_csv(df=users_df, table_name="users")
-            elif sync_object == "threads":
-                print("Dumping threads to .csv, writing to DB...")
-                write_df_to_database(
-                    df=threads_df, table_name="threads", upsert=True
-                )
-                dump_df_to_csv(df=threads_df, table_name="threads")
-            elif sync_object == "comments":
-                print("Dumping comments to .csv, writing to DB...")
-                write_df_to_database(
-                    df=comments_df, table_name="comments", upsert=True
-                )
-                dump_df_to_csv(df=comments_df, table_name="comments")
+    sync_object_to_df_map = {
+        "subreddits": subreddit_df,
+        "users": users_df,
+        "threads": threads_df,
+        "comments": comments_df
+    }
+    table_to_df_list = [
+        (sync_object, sync_object_to_df_map[sync_object])
+        for sync_object in objects_to_sync
+    ]
+    if classified_comments_df is not None:
+        table_to_df_list.append(
+            ("classified_comments", classified_comments_df)
+        )
+    elif "comments" in objects_to_sync:
+        # queue the comments to be classified by the classify pipeline.
+        classification_queue.create_table()
+        table_to_df_list.append(
+            (
+                "classification_queue",
+                build_classification_queue_df(comments_df)
+            )
+        )
 
+    # write all the synced objects in one transaction, so a sync batch is
+    # written to the DB either in full or not at all.
+    write_results: list[WriteResult] = []
+    try:
+        print(f"Writing {[table_name for table_name, _ in table_to_df_list]} to DB...") # noqa
+        write_results = write_dfs_to_database(
+            table_to_df_list=table_to_df_list, upsert=True
+        )
+        for table_name, df in table_to_df_list:
+            if table_name == "classification_queue":
+                continue
+            print(f"Dumping {table_name} to .csv...")
+            dump_df_to_csv(df=df, table_name=table_name)
     except Exception as e:
         print(f"unable to write data to database: {e}")
         traceback.print_exc()
@@ -610,7 +669,18 @@ def sync_comments_from_one_subreddit(
         "num_duplicate_comments": duplicate_comments,
         "num_skipped_comments": skipped_comments,
         "num_skipped_authors": skipped_authors,
-        "old_threads_and_comments": old_threads_and_comments
+        "old_threads_and_comments": old_threads_and_comments,
+        "num_classified_comments_on_ingest": (
+            classified_comments_df.shape[0]
+            if classified_comments_df is not None else 0
+        ),
+        **{
+            f"num_{write_result.table_name}_{stat}": getattr(
+                write_result, f"num_rows_{stat}"
+            )
+            for write_result in write_results
+            for stat in ["inserted", "updated"]
+        }
     }
     write_metadata_file(metadata_dict=metadata_dict)
     print(
@@ -18,6 +18,7 @@ def main(event: dict, context: dict) -> list[dict]:
     max_num_threads = event.get("max_num_threads", DEFAULT_MAX_NUM_THREADS)
     thread_sort_type = event.get("thread_sort_type", DEFAULT_THREAD_SORT_TYPE)
     max_total_comments = event.get("max_total_comments", DEFAULT_MAX_COMMENTS)
+    classify_on_ingest = event.get("classify_on_ingest", False)
     if subreddits == "all":
         subreddits = get_all_subreddits()
     else:
@@ -27,7 +28,8 @@ def main(event: dict, context: dict) -> list[dict]:
             "subreddit": subreddit,
             "max_num_threads": max_num_threads,
             "thread_sort_type": thread_sort_type,
-            "max_total_comments": max_total_comments
+            "max_total_comments": max_total_comments,
+            "classify_on_ingest": classify_on_ingest
         }
         for subreddit in subreddits
     ]